@@ -0,0 +1,5 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
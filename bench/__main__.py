@@ -0,0 +1,226 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Mapping
+from typing import Optional, Type
+
+import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators.sentry as sentry
+import steamos_log_submitter.helpers
+import steamos_log_submitter.runner
+
+from . import generate, server
+
+PROJECTS = {
+    'kdump': 5,
+    'journal': 4,
+    'gpu': 3,
+    'minidump': 2,
+}
+
+
+def write_config(base: str, port: int, counts: Mapping[str, int], options: Mapping[str, str]) -> str:
+    lines = [
+        '[sls]',
+        f'base: {base}',
+        'local-config: ${base}/local.cfg',
+        'enable: on',
+        'collect: off',
+    ]
+    lines.extend(f'{key}: {value}' for key, value in options.items())
+    lines.append('')
+    for helper in sls.helpers.list_helpers():
+        lines.append(f'[helpers.{helper}]')
+        if helper == 'minidump':
+            lines.append(f'dsn: http://127.0.0.1:{port}/api/{PROJECTS[helper]}/minidump/?sentry_key=bench')
+        elif helper in PROJECTS:
+            lines.append(f'dsn: http://bench@127.0.0.1:{port}/{PROJECTS[helper]}')
+        if not counts.get(helper):
+            lines.append('enable: off')
+        lines.append('')
+    path = f'{base}/base.cfg'
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+    return path
+
+
+def setup_tree(base: str, config_path: str) -> None:
+    sls.config.base_config_path = config_path
+    sls.config.reload_config()
+    sls.base = base
+    sls.pending = f'{base}/pending'
+    sls.uploaded = f'{base}/uploaded'
+    sls.failed = f'{base}/failed'
+    sls.data.data_root = f'{base}/data'
+    for helper in sls.helpers.list_helpers():
+        for directory in (sls.pending, sls.uploaded, sls.failed):
+            os.makedirs(f'{directory}/{helper}', exist_ok=True)
+
+
+def peak_rss() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def run_trigger(latencies: dict[str, list[float]], envelopes: dict[str, float]) -> tuple[float, dict[str, sls.helpers.HelperResult | Exception]]:
+    submit_log = sls.runner.submit_log
+    seal = sentry.SentryEvent.seal
+
+    async def timed_submit_log(helper: Type[sls.helpers.Helper], log: str) -> sls.helpers.HelperResult:
+        start = time.perf_counter()
+        try:
+            return await submit_log(helper, log)
+        finally:
+            latencies.setdefault(helper.name, []).append(time.perf_counter() - start)
+
+    def counted_seal(self: sentry.SentryEvent, *, minidump: bool = False) -> None:
+        seal(self, minidump=minidump)
+        if not self.raw_size:
+            return
+        envelopes['count'] += 1
+        envelopes['cpu_time'] += self.seal_time
+        envelopes['raw_bytes'] += self.raw_size
+        envelopes['encoded_bytes'] += self.encoded_size
+
+    sls.runner.submit_log = timed_submit_log
+    sentry.SentryEvent.seal = counted_seal  # type: ignore[method-assign]
+    try:
+        start = time.perf_counter()
+        _, submitted = await sls.runner.trigger()
+        return time.perf_counter() - start, submitted
+    finally:
+        sls.runner.submit_log = submit_log
+        sentry.SentryEvent.seal = seal  # type: ignore[method-assign]
+        await sls.runner.shutdown()
+
+
+def summarize(latencies: list[float]) -> dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean': statistics.fmean(latencies),
+        'p50': latencies[len(latencies) // 2],
+        'p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+        'max': latencies[-1],
+    }
+
+
+def format_bytes(count: float) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if count < 1024:
+            return f'{count:.1f} {unit}'
+        count /= 1024
+    return f'{count:.1f} GiB'
+
+
+def print_report(report: dict) -> None:
+    print(f'Submitted {report["logs"]} logs ({format_bytes(report["bytes"])}) in {report["elapsed"]:.3f} s')
+    print(f'  {report["logs_per_sec"]:.2f} logs/s, {format_bytes(report["bytes_per_sec"])}/s')
+    print(f'  peak RSS {format_bytes(report["peak_rss"])} ({format_bytes(report["rss_before"])} before trigger)')
+    print('  results: ' + ', '.join(f'{name}: {count}' for name, count in sorted(report['results'].items())))
+    envelopes = report['envelopes']
+    print(f'  {envelopes["count"]:.0f} envelopes sealed in {envelopes["cpu_time"]:.3f} s CPU, '
+          f'{format_bytes(envelopes["raw_bytes"])} encoded to {format_bytes(envelopes["encoded_bytes"])}')
+    print()
+    print(f'{"helper":<10} {"count":>6} {"mean":>8} {"p50":>8} {"p95":>8} {"max":>8}')
+    for helper, latency in sorted(report['latency'].items()):
+        print(f'{helper:<10} {latency["count"]:>6} ' + ' '.join(f'{latency[key]:>8.4f}' for key in ('mean', 'p50', 'p95', 'max')))
+    print()
+    print(f'{"endpoint":<10} {"requests":>8} {"errors":>6} {"sent":>12} {"decoded":>12}')
+    for endpoint, stats in sorted(report['server']['endpoints'].items()):
+        print(f'{endpoint:<10} {stats["requests"]:>8} {stats["errors"]:>6} {format_bytes(stats["bytes"]):>12} {format_bytes(stats["decoded_bytes"]):>12}')
+    print(f'connections: {report["server"]["connections"]}')
+
+
+def main(args: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Benchmark log submission against a local fake Sentry server')
+    for helper in generate.GENERATORS:
+        parser.add_argument(f'--{helper}', type=int, default=10, metavar='COUNT', help=f'Number of {helper} logs to generate')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='Approximate size of each generated log in bytes')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for generated logs and error injection')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds of latency added to each server response')
+    parser.add_argument('--jitter', type=float, default=0, help='Maximum random seconds added on top of the latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status returned for failed requests')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='Set an option in the [sls] config section')
+    parser.add_argument('--keep', metavar='DIR', help='Generate the tree in DIR and keep it afterwards')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show log output from the submitter')
+    parsed = parser.parse_args(args)
+
+    counts = {helper: getattr(parsed, helper) for helper in generate.GENERATORS}
+    options = dict(option.split('=', 1) for option in parsed.set)
+
+    ctx = multiprocessing.get_context('spawn')
+    conn, child_conn = ctx.Pipe()
+    process = ctx.Process(target=server.serve, args=(child_conn,), kwargs={
+        'latency': parsed.latency,
+        'jitter': parsed.jitter,
+        'error_rate': parsed.error_rate,
+        'error_status': parsed.error_status,
+        'seed': parsed.seed,
+    })
+    process.start()
+
+    with tempfile.TemporaryDirectory(prefix='sls-bench-') as tmpdir:
+        base = parsed.keep or tmpdir
+        os.makedirs(base, exist_ok=True)
+        try:
+            port = conn.recv()
+            setup_tree(base, write_config(base, port, counts, options))
+            sls.logging.reconfigure_logging(level='INFO' if parsed.verbose else 'CRITICAL')
+            written = generate.generate(sls.pending, counts, parsed.size, seed=parsed.seed)
+
+            # The benchmark only talks to the local server
+            sls.util.check_network = lambda: True
+
+            latencies: dict[str, list[float]] = {}
+            envelopes = {'count': 0.0, 'cpu_time': 0.0, 'raw_bytes': 0.0, 'encoded_bytes': 0.0}
+            rss_before = peak_rss()
+            elapsed, submitted = asyncio.run(run_trigger(latencies, envelopes))
+            rss = peak_rss()
+        finally:
+            conn.send('stop')
+            server_stats = conn.recv()
+            process.join()
+
+    results: dict[str, int] = {}
+    for result in submitted.values():
+        name = result.name if isinstance(result, sls.helpers.HelperResult) else type(result).__name__
+        results[name] = results.get(name, 0) + 1
+    total_bytes = sum(written.values())
+    report = {
+        'logs': len(submitted),
+        'bytes': total_bytes,
+        'elapsed': elapsed,
+        'logs_per_sec': len(submitted) / elapsed if elapsed else 0,
+        'bytes_per_sec': total_bytes / elapsed if elapsed else 0,
+        'rss_before': rss_before,
+        'peak_rss': rss,
+        'results': results,
+        'envelopes': envelopes,
+        'latency': {helper: summarize(values) for helper, values in latencies.items()},
+        'server': server_stats,
+    }
+    if parsed.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
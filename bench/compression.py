@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections.abc import Iterable
+from typing import Optional
+
+import steamos_log_submitter.aggregators.sentry as sentry
+
+from .__main__ import format_bytes
+
+__all__ = [
+    'FIXTURES',
+    'bench_codec',
+    'default_codecs',
+    'list_files',
+    'main',
+]
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'helpers')
+
+
+def default_codecs() -> list[tuple[str, int]]:
+    codecs: list[tuple[str, int]] = []
+    for name, codec in sentry.CODECS.items():
+        levels = {codec.fast_level, codec.default_level, codec.levels[-1]}
+        codecs.extend((name, level) for level in sorted(levels))
+    return codecs
+
+
+def parse_codec(value: str) -> tuple[str, int]:
+    name, _, level = value.partition(':')
+    if name not in sentry.CODECS:
+        raise argparse.ArgumentTypeError(f'unknown or unavailable codec {name}')
+    codec = sentry.CODECS[name]
+    try:
+        parsed = int(level) if level else codec.default_level
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid level {level}')
+    if parsed not in codec.levels:
+        raise argparse.ArgumentTypeError(f'level {parsed} out of range for {name}')
+    return name, parsed
+
+
+def list_files(paths: Iterable[str]) -> list[str]:
+    files: list[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names)
+        else:
+            files.append(path)
+    return sorted(f for f in files if os.path.getsize(f))
+
+
+def bench_codec(name: str, level: int, data: list[bytes], *, repeat: int = 1) -> dict[str, float]:
+    codec = sentry.CODECS[name]
+    raw = 0
+    encoded = 0
+    elapsed = 0.0
+    for _ in range(repeat):
+        for item in data:
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            encoder = codec.open(buffer, level)
+            encoder.write(item)
+            encoder.close()
+            elapsed += time.perf_counter() - start
+            raw += len(item)
+            encoded += buffer.tell()
+    return {
+        'raw_bytes': raw,
+        'encoded_bytes': encoded,
+        'ratio': raw / encoded if encoded else 0,
+        'elapsed': elapsed,
+        'bytes_per_sec': raw / elapsed if elapsed else 0,
+    }
+
+
+def main(args: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m bench.compression', description='Compare envelope compression codecs on log fixtures')
+    parser.add_argument('paths', nargs='*', default=[FIXTURES], metavar='PATH', help='Files or directories to compress, defaulting to the test fixtures')
+    parser.add_argument('--codec', action='append', type=parse_codec, metavar='NAME[:LEVEL]', help='Codec and level to compare, may be given more than once')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times to compress each file')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parsed = parser.parse_args(args)
+
+    files = list_files(parsed.paths)
+    data = []
+    for fname in files:
+        with open(fname, 'rb') as f:
+            data.append(f.read())
+
+    results = []
+    for name, level in parsed.codec or default_codecs():
+        results.append((name, level, bench_codec(name, level, data, repeat=max(parsed.repeat, 1))))
+
+    if parsed.json:
+        json.dump({
+            'files': files,
+            'results': [{'codec': name, 'level': level, **result} for name, level, result in results],
+        }, sys.stdout, indent=2)
+        print()
+        return 0
+
+    print(f'Compressed {len(files)} files ({format_bytes(sum(len(item) for item in data))}) {max(parsed.repeat, 1)} times')
+    print()
+    print(f'{"codec":<6} {"level":>5} {"ratio":>7} {"encoded":>12} {"throughput":>14}')
+    for name, level, result in results:
+        print(f'{name:<6} {level:>5} {result["ratio"]:>7.3f} '
+              f'{format_bytes(result["encoded_bytes"] / max(parsed.repeat, 1)):>12} {format_bytes(result["bytes_per_sec"]) + "/s":>14}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
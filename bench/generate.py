@@ -0,0 +1,135 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import io
+import json
+import os
+import random
+import struct
+import time
+import zipfile
+from collections.abc import Callable, Mapping
+
+__all__ = [
+    'GENERATORS',
+    'generate',
+]
+
+DMESG_HEADER = '''<5>[    0.000000] Linux version 6.5.0-valve1-1-neptune (bench@steamos) #1 SMP PREEMPT_DYNAMIC
+<6>[    0.000000] Command line: BOOT_IMAGE=/boot/vmlinuz-linux-neptune console=tty1 rd.luks=0
+'''
+
+DMESG_PANIC = '''<1>[ {ts:11.6f}] BUG: kernel NULL pointer dereference, address: 0000000000000000
+<1>[ {ts:11.6f}] #PF: supervisor read access in kernel mode
+<4>[ {ts:11.6f}] Oops: 0000 [#1] PREEMPT SMP NOPTI
+<4>[ {ts:11.6f}] CPU: 3 PID: {pid} Comm: bench Tainted: G        W          6.5.0-valve1-1-neptune #1
+<4>[ {ts:11.6f}] RIP: 0010:bench_crash_{variant}+0x28/0xff0 [bench]
+<4>[ {ts:11.6f}] RSP: 0018:ffffae6200b43da0 EFLAGS: 00010246
+<4>[ {ts:11.6f}] RAX: 0000000000000000 RBX: 0000000000000000 RCX: 0000000000000000
+<4>[ {ts:11.6f}] Call Trace:
+<4>[ {ts:11.6f}]  <TASK>
+<4>[ {ts:11.6f}]  do_one_initcall+0x45/0x220
+<4>[ {ts:11.6f}]  do_init_module+0x4c/0x200
+<4>[ {ts:11.6f}]  __do_sys_finit_module+0xb4/0x130
+<4>[ {ts:11.6f}]  do_syscall_64+0x5d/0x90
+<4>[ {ts:11.6f}]  entry_SYSCALL_64_after_hwframe+0x72/0xdc
+<4>[ {ts:11.6f}]  </TASK>
+<4>[ {ts:11.6f}] Modules linked in: bench(OE+) amdgpu(E) snd_hda_intel(E)
+<0>[ {ts:11.6f}] Kernel panic - not syncing: Fatal exception
+<0>[ {ts:11.6f}] Kernel Offset: 0x6000000 from 0xffffffff81000000
+'''
+
+MINIDUMP_HEADER = struct.Struct('<IIIIIIQ')
+MINIDUMP_SIGNATURE = 0x504d444d
+MINIDUMP_VERSION = 0xa793
+
+
+def _filler_lines(rng: random.Random, size: int) -> str:
+    lines = []
+    total = 0
+    ts = 0.0
+    while total < size:
+        ts += rng.random()
+        line = f'<6>[ {ts:11.6f}] bench: device {rng.randrange(64)} status {rng.getrandbits(32):08x}\n'
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines)
+
+
+def _timestamp(rng: random.Random) -> str:
+    return time.strftime('%Y%m%d%H%M', time.gmtime(1700000000 + rng.randrange(10000000)))
+
+
+def kdump(rng: random.Random, index: int, size: int) -> tuple[str, bytes]:
+    stamp = _timestamp(rng)
+    dmesg = DMESG_HEADER + _filler_lines(rng, size // 2) + DMESG_PANIC.format(ts=1000.0 + index, pid=rng.randrange(1, 32768), variant=index % 16)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f'dmesg-{stamp}.txt', dmesg)
+        zf.writestr('version', '6.5.0-valve1-1-neptune\n')
+        # Crash dumps compress poorly, so pad the rest out with random data
+        zf.writestr(f'vmcore-{stamp}', rng.randbytes(size // 2), compress_type=zipfile.ZIP_STORED)
+    return f'kdumpst{index}-{stamp}.zip', buffer.getvalue()
+
+
+def minidump(rng: random.Random, index: int, size: int) -> tuple[str, bytes]:
+    header = MINIDUMP_HEADER.pack(MINIDUMP_SIGNATURE, MINIDUMP_VERSION, 0, MINIDUMP_HEADER.size, 0, int(time.time()), 0)
+    appid = rng.choice((0, 570, 730, 1091500, 1245620))
+    return f'bench-{index}-{appid}.dmp', header + rng.randbytes(max(size - len(header), 0))
+
+
+def journal(rng: random.Random, index: int, size: int) -> tuple[str, bytes]:
+    entries = []
+    total = 0
+    while total < size:
+        entry = {
+            '__REALTIME_TIMESTAMP': str(1700000000000000 + rng.randrange(10 ** 12)),
+            '_SYSTEMD_UNIT': f'bench-{index % 8}.service',
+            'PRIORITY': str(rng.randrange(8)),
+            'MESSAGE': f'bench unit {index % 8} failed with status {rng.randrange(256)}: {rng.getrandbits(64):016x}',
+        }
+        entries.append(entry)
+        total += len(json.dumps(entry)) + 2
+    return f'bench-{index % 8}.service {rng.getrandbits(128):032x}.json', json.dumps(entries).encode()
+
+
+def gpu(rng: random.Random, index: int, size: int) -> tuple[str, bytes]:
+    metadata = {
+        'timestamp': 1700000000 + rng.randrange(10000000),
+        'appid': rng.choice((570, 730, 1091500, 1245620)),
+        'executable': f'bench{index % 4}.exe',
+        'comm': f'bench{index % 4}',
+        'kernel': '6.5.0-valve1-1-neptune',
+        'mesa': '23.1.3.170196.radeonsi_3.5.1-1',
+    }
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('metadata.json', json.dumps(metadata))
+        zf.writestr('dmesg.txt', _filler_lines(rng, size // 4))
+        zf.writestr('umr.bin', rng.randbytes(size - size // 4), compress_type=zipfile.ZIP_STORED)
+    return f'gpu-{index}.zip', buffer.getvalue()
+
+
+GENERATORS: dict[str, Callable[[random.Random, int, int], tuple[str, bytes]]] = {
+    'kdump': kdump,
+    'minidump': minidump,
+    'journal': journal,
+    'gpu': gpu,
+}
+
+
+def generate(pending: str, counts: Mapping[str, int], size: int, *, seed: int = 0) -> dict[str, int]:
+    rng = random.Random(seed)
+    written = {}
+    for helper, count in counts.items():
+        os.makedirs(f'{pending}/{helper}', exist_ok=True)
+        total = 0
+        for index in range(count):
+            name, data = GENERATORS[helper](rng, index, size)
+            with open(f'{pending}/{helper}/{name}', 'wb') as f:
+                f.write(data)
+            total += len(data)
+        written[helper] = total
+    return written
@@ -0,0 +1,258 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
+import dataclasses
+import gzip
+import json
+import logging
+import random
+import re
+import uuid
+import zlib
+from multiprocessing.connection import Connection
+from typing import Optional
+
+try:
+    import zstandard  # type: ignore[import-not-found,unused-ignore]
+except ModuleNotFoundError:
+    zstandard = None
+
+__all__ = [
+    'EndpointStats',
+    'FakeSentry',
+    'Upload',
+    'serve',
+]
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    201: 'Created',
+    204: 'No Content',
+    400: 'Bad Request',
+    404: 'Not Found',
+    409: 'Conflict',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    502: 'Bad Gateway',
+    503: 'Service Unavailable',
+}
+
+
+@dataclasses.dataclass
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    bytes: int = 0
+    decoded_bytes: int = 0
+
+
+@dataclasses.dataclass
+class Upload:
+    length: int
+    data: bytearray = dataclasses.field(default_factory=bytearray)
+
+
+class FakeSentry:
+    route_re = re.compile(r'^/api/(?P<project>\d+)/(?P<endpoint>store|envelope|minidump)/')
+    upload_re = re.compile(r'^/upload/(?P<id>[0-9a-f]*)$')
+
+    def __init__(self, *, latency: float = 0, jitter: float = 0, error_rate: float = 0,
+                 error_status: int = 503, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats: dict[str, EndpointStats] = {}
+        self.uploads: dict[str, Upload] = {}
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._server: Optional[asyncio.Server] = None
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return int(self._server.sockets[0].getsockname()[1])
+
+    async def close(self) -> None:
+        if not self._server:
+            return
+        self._server.close()
+        # Clients may keep idle connections open, which would otherwise keep
+        # wait_closed from returning
+        for writer in self._writers:
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _read_body(self, reader: asyncio.StreamReader, headers: dict[str, str]) -> bytes:
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            return b''.join(chunks)
+        length = int(headers.get('content-length', 0))
+        if not length:
+            return b''
+        return await reader.readexactly(length)
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: Optional[dict[str, str]], headers: Optional[dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode() if body is not None else b''
+        lines = [
+            f'HTTP/1.1 {status} {REASONS.get(status, "Unknown")}',
+            f'Content-Length: {len(data)}',
+        ]
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        for key, value in (headers or {}).items():
+            lines.append(f'{key}: {value}')
+        writer.write('\r\n'.join(lines).encode() + b'\r\n\r\n' + data)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                lines = request.decode('latin-1').split('\r\n')
+                method, path, _ = lines[0].split(' ', 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        headers[key.strip().lower()] = value.strip()
+                body = await self._read_body(reader, headers)
+
+                await self._dispatch(writer, method, path, headers, body)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _inject_error(self, stats: EndpointStats) -> Optional[int]:
+        if self.error_rate and self._random.random() < self.error_rate:
+            stats.errors += 1
+            return self.error_status
+        return None
+
+    async def _delay(self) -> None:
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _dispatch_upload(self, writer: asyncio.StreamWriter, method: str, id: str, headers: dict[str, str], body: bytes) -> None:
+        # A minimal tus server, supporting creation and resuming uploads
+        stats = self.stats.setdefault('upload', EndpointStats())
+        stats.requests += 1
+        stats.bytes += len(body)
+        await self._delay()
+        if method == 'POST' and not id:
+            try:
+                length = int(headers['upload-length'])
+            except (KeyError, ValueError):
+                await self._respond(writer, 400, {'detail': 'missing upload length'})
+                return
+            id = uuid.uuid4().hex
+            self.uploads[id] = Upload(length)
+            await self._respond(writer, 201, None, {'Location': f'/upload/{id}', 'Tus-Resumable': '1.0.0'})
+            return
+
+        upload = self.uploads.get(id)
+        if not upload:
+            # Responses to HEAD requests can't have a body
+            await self._respond(writer, 404, None if method == 'HEAD' else {'detail': 'not found'})
+            return
+        if method == 'HEAD':
+            await self._respond(writer, 200, None, {
+                'Upload-Offset': str(len(upload.data)),
+                'Upload-Length': str(upload.length),
+                'Tus-Resumable': '1.0.0',
+            })
+            return
+        if method != 'PATCH':
+            await self._respond(writer, 404, {'detail': 'not found'})
+            return
+
+        status = self._inject_error(stats)
+        if status:
+            await self._respond(writer, status, {'detail': 'injected error'})
+            return
+        if headers.get('upload-offset') != str(len(upload.data)):
+            await self._respond(writer, 409, {'detail': 'offset mismatch'})
+            return
+        if len(upload.data) + len(body) > upload.length:
+            await self._respond(writer, 413, {'detail': 'upload too long'})
+            return
+        upload.data.extend(body)
+        stats.decoded_bytes += len(body)
+        await self._respond(writer, 204, None, {'Upload-Offset': str(len(upload.data)), 'Tus-Resumable': '1.0.0'})
+
+    async def _dispatch(self, writer: asyncio.StreamWriter, method: str, path: str, headers: dict[str, str], body: bytes) -> None:
+        upload_match = self.upload_re.match(path)
+        if upload_match:
+            await self._dispatch_upload(writer, method, upload_match.group('id'), headers, body)
+            return
+
+        match = self.route_re.match(path)
+        if method != 'POST' or not match:
+            await self._respond(writer, 404, {'detail': 'not found'})
+            return
+
+        endpoint = match.group('endpoint')
+        stats = self.stats.setdefault(endpoint, EndpointStats())
+        stats.requests += 1
+        stats.bytes += len(body)
+        encoding = headers.get('content-encoding')
+        if encoding == 'gzip':
+            try:
+                stats.decoded_bytes += len(gzip.decompress(body))
+            except (OSError, EOFError, zlib.error):
+                stats.decoded_bytes += len(body)
+        elif encoding == 'zstd' and zstandard:
+            with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+                stats.decoded_bytes += len(reader.read())
+        else:
+            stats.decoded_bytes += len(body)
+
+        await self._delay()
+
+        status = self._inject_error(stats)
+        if status:
+            extra = {}
+            if status == 429:
+                extra['Retry-After'] = '60'
+            await self._respond(writer, status, {'detail': 'injected error'}, extra)
+            return
+
+        await self._respond(writer, 200, {'id': uuid.uuid4().hex})
+
+
+def serve(conn: 'Connection[object, object]', *, latency: float = 0, jitter: float = 0, error_rate: float = 0,
+          error_status: int = 503, seed: Optional[int] = None) -> None:
+    async def run() -> None:
+        server = FakeSentry(latency=latency, jitter=jitter, error_rate=error_rate, error_status=error_status, seed=seed)
+        conn.send(await server.start())
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        await server.close()
+        conn.send({
+            'connections': server.connections,
+            'endpoints': {name: dataclasses.asdict(stats) for name, stats in server.stats.items()},
+        })
+
+    asyncio.run(run())
@@ -67,8 +67,15 @@ def setup() -> None:
     _setup = True
 
 
+async def _trigger() -> None:
+    try:
+        await runner.trigger()
+    finally:
+        await runner.shutdown()
+
+
 def trigger() -> None:
-    asyncio.run(runner.trigger())
+    asyncio.run(_trigger())
 
 
 setup()
@@ -4,9 +4,36 @@
 # Copyright (c) 2022-2023 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
 import abc
+import asyncio
+import httpx
+import importlib
+import importlib.util
+import logging
+import time
+import urllib.parse
+from collections.abc import AsyncIterator, Iterable
+from types import ModuleType
+from typing import IO, Optional
 
+import steamos_log_submitter as sls
 from steamos_log_submitter.helpers import HelperResult
 
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+TIMEOUT = 30
+# How much of a failed response to keep as the reason for the failure
+REASON_SIZE = 200
+
+# Maps DSN schemes to the modules in this package that submit to them
+DEFAULT_BACKEND = 'sentry'
+BACKENDS = {
+    'file': 'spool',
+    'http': 'sentry',
+    'https': 'sentry',
+}
+
 
 class AggregatorEvent(abc.ABC):
     @abc.abstractmethod
@@ -16,3 +43,155 @@ class AggregatorEvent(abc.ABC):
     @abc.abstractmethod
     async def send(self) -> HelperResult:  # pragma: no cover
         raise NotImplementedError
+
+
+def response_reason(response: httpx.Response) -> str:
+    text = response.text.strip()
+    if len(text) > REASON_SIZE:
+        text = f'{text[:REASON_SIZE]}...'
+    return f'HTTP {response.status_code}: {text}' if text else f'HTTP {response.status_code}'
+
+
+def get_backend(dsn: str, name: Optional[str] = None) -> ModuleType:
+    if not name:
+        name = BACKENDS.get(urllib.parse.urlparse(dsn).scheme, DEFAULT_BACKEND)
+    try:
+        return importlib.import_module(f'{__name__}.{name}')
+    except ModuleNotFoundError as e:
+        if e.name != f'{__name__}.{name}':
+            raise
+        raise ValueError(f'Aggregator backend {name} not found')
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
+
+    async def consume(self, amount: int) -> None:
+        # Take the tokens up front, going into debt if there aren't enough, so
+        # later callers queue up behind this one without anything being held
+        # while it waits
+        self._refill()
+        self._tokens -= amount
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _config_number(key: str, default: float) -> float:
+    try:
+        return float(sls.base_config.get(key) or default)
+    except ValueError:
+        logger.warning(f'Invalid {key} value, ignoring')
+        return default
+
+
+def _create_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=int(_config_number('http-max-connections', 10)),
+                          max_keepalive_connections=int(_config_number('http-max-keepalive', 5)),
+                          keepalive_expiry=_config_number('http-keepalive-expiry', 30))
+    http2 = sls.base_config.get('http2', 'off') == 'on'
+    if http2 and importlib.util.find_spec('h2') is None:
+        logger.warning('HTTP/2 was requested but the h2 module is not installed, falling back to HTTP/1.1')
+        http2 = False
+    return httpx.AsyncClient(timeout=_config_number('http-timeout', TIMEOUT), limits=limits, http2=http2)
+
+
+def client() -> httpx.AsyncClient:
+    global _client, _client_loop
+    # Connections in the pool can only be used from the event loop that
+    # created them, so make a new client if the loop changes
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = _create_client()
+        _client_loop = loop
+    return _client
+
+
+async def close() -> None:
+    global _client, _client_loop
+    if _client is None:
+        return
+    if _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+_limiter: Optional[TokenBucket] = None
+_limiter_rate: Optional[float] = None
+
+
+def limiter() -> Optional[TokenBucket]:
+    global _limiter, _limiter_rate
+    try:
+        rate = float(sls.base_config.get('bandwidth-limit') or 0)
+    except ValueError:
+        logger.warning('Invalid bandwidth limit, ignoring')
+        rate = 0
+    if rate <= 0:
+        _limiter = None
+        _limiter_rate = None
+        return None
+
+    # The bucket is shared between all uploads, so only replace it if the limit
+    # changes
+    if _limiter is None or _limiter_rate != rate:
+        _limiter = TokenBucket(rate, max(rate, CHUNK_SIZE))
+        _limiter_rate = rate
+    return _limiter
+
+
+async def consume(amount: int) -> None:
+    bucket = limiter()
+    if bucket:
+        await bucket.consume(amount)
+
+
+async def _stream(bucket: Optional[TokenBucket], f: IO[bytes]) -> AsyncIterator[bytes]:
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if bucket:
+            await bucket.consume(len(chunk))
+        yield chunk
+
+
+async def _throttle(bucket: TokenBucket, chunks: Iterable[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        await bucket.consume(len(chunk))
+        yield chunk
+
+
+def stream(f: IO[bytes], size: int) -> bytes | AsyncIterator[bytes]:
+    bucket = limiter()
+    f.seek(0)
+    # Bodies this small are kept in memory anyway, so there's nothing to be
+    # gained by streaming them unless they need to be throttled
+    if not bucket and size <= SPOOL_SIZE:
+        return f.read()
+    return _stream(bucket, f)
+
+
+async def post_multipart(client: httpx.AsyncClient, url: str, data: dict[str, str], files: dict[str, IO[bytes]]) -> httpx.Response:
+    bucket = limiter()
+    if not bucket:
+        return await client.post(url, files=files, data=data)
+    # httpx reads multipart bodies synchronously as they're sent, so encode
+    # the body separately and throttle each chunk on its way out instead
+    request = httpx.Request('POST', url, files=files, data=data)
+    assert isinstance(request.stream, httpx.SyncByteStream)
+    headers = {key: value for key, value in request.headers.items() if key in ('content-type', 'content-length')}
+    return await client.post(url, content=_throttle(bucket, request.stream), headers=headers)
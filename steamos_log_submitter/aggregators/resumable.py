@@ -0,0 +1,171 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import base64
+import httpx
+import logging
+import os
+import urllib.parse
+from collections.abc import Callable, Mapping
+from typing import IO, Optional, TypedDict
+
+import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators as aggregators
+from steamos_log_submitter.helpers import HelperResult, set_failure_reason
+
+__all__ = [
+    'ResumableUpload',
+    'UploadState',
+]
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = '1.0.0'
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# Consecutive failed chunks tolerated before giving up until the next attempt
+MAX_RETRIES = 3
+
+
+class UploadState(TypedDict):
+    location: str
+    offset: int
+    size: int
+
+
+class ResumableUpload:
+    # Uploads a file in chunks using the tus resumable upload protocol, see
+    # https://tus.io/protocols/resumable-upload
+    def __init__(self, endpoint: str, path: str, *, state: Optional[UploadState] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, metadata: Optional[Mapping[str, str]] = None,
+                 progress: Optional[Callable[[UploadState], None]] = None):
+        self.endpoint = endpoint
+        self.path = path
+        self.state = state
+        self.chunk_size = chunk_size
+        self.metadata = metadata or {}
+        self.progress = progress
+        self.ua_string = f'SteamOS Log Submitter/{sls.__version__}'
+
+    def _headers(self, **headers: str) -> dict[str, str]:
+        return {
+            'Tus-Resumable': TUS_VERSION,
+            'User-Agent': self.ua_string,
+            **{key.replace('_', '-'): value for key, value in headers.items()},
+        }
+
+    def _report(self, offset: int) -> None:
+        assert self.state
+        self.state['offset'] = offset
+        if self.progress:
+            self.progress(self.state)
+
+    async def _create(self, client: httpx.AsyncClient, size: int) -> Optional[HelperResult]:
+        metadata = ','.join(f'{key} {base64.b64encode(value.encode()).decode()}' for key, value in self.metadata.items())
+        headers = self._headers(Upload_Length=str(size))
+        if metadata:
+            headers['Upload-Metadata'] = metadata
+        response = await client.post(self.endpoint, headers=headers)
+        if response.status_code == 413:
+            logger.error('Failed to create upload, too large')
+            return HelperResult.PERMANENT_ERROR
+        location = response.headers.get('Location')
+        if response.status_code != 201 or not location:
+            logger.error(f'Failed to create upload with status {response.status_code}')
+            set_failure_reason(aggregators.response_reason(response))
+            return HelperResult.TRANSIENT_ERROR
+        self.state = UploadState(location=urllib.parse.urljoin(self.endpoint, location), offset=0, size=size)
+        self._report(0)
+        return None
+
+    async def _offset(self, client: httpx.AsyncClient) -> Optional[int]:
+        assert self.state
+        response = await client.head(self.state['location'], headers=self._headers())
+        if response.status_code in (404, 410):
+            return None
+        response.raise_for_status()
+        try:
+            offset = int(response.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise ValueError('Server did not report a valid upload offset')
+        if not 0 <= offset <= self.state['size']:
+            raise ValueError(f'Server reported out of range upload offset {offset}')
+        return offset
+
+    async def upload(self) -> HelperResult:
+        client = aggregators.client()
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                offset = None
+                if self.state and self.state['size'] == size:
+                    # The server is the authority on how much it has received
+                    offset = await self._offset(client)
+                    if offset is None:
+                        logger.info('Previous upload expired, starting over')
+                if offset is None:
+                    result = await self._create(client, size)
+                    if result is not None:
+                        return result
+                    offset = 0
+                else:
+                    logger.info(f'Resuming upload at {offset} of {size} bytes')
+                    self._report(offset)
+                return await self._upload_chunks(client, f, offset)
+        except (OSError, EOFError) as e:
+            logger.error(f'Failed to read upload: {e}')
+            set_failure_reason(f'Failed to read upload: {e}')
+            return HelperResult.TRANSIENT_ERROR
+        except (httpx.TransportError, httpx.HTTPStatusError, ValueError) as e:
+            logger.warning(f'Upload was interrupted: {e}')
+            set_failure_reason(f'Upload was interrupted: {e}')
+            return HelperResult.TRANSIENT_ERROR
+
+    async def _upload_chunks(self, client: httpx.AsyncClient, f: IO[bytes], offset: int) -> HelperResult:
+        assert self.state
+        failures = 0
+        while offset < self.state['size']:
+            f.seek(offset)
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                raise EOFError('File was truncated while uploading')
+            await aggregators.consume(len(chunk))
+            try:
+                response = await client.patch(self.state['location'], content=chunk, headers=self._headers(
+                    Content_Type='application/offset+octet-stream',
+                    Upload_Offset=str(offset),
+                ))
+            except httpx.TransportError as e:
+                response = None
+                logger.warning(f'Chunk upload failed: {e}')
+
+            if response is not None and response.status_code in (200, 204):
+                new_offset = int(response.headers.get('Upload-Offset', ''))
+                if offset < new_offset <= self.state['size']:
+                    offset = new_offset
+                    failures = 0
+                    self._report(offset)
+                    continue
+                logger.warning(f'Server reported unexpected upload offset {new_offset}')
+            elif response is not None and response.status_code in (404, 410):
+                logger.warning('Upload expired on the server')
+                set_failure_reason('Upload expired on the server')
+                return HelperResult.TRANSIENT_ERROR
+            elif response is not None and response.status_code == 413:
+                logger.error('Failed to upload chunk, too large')
+                return HelperResult.PERMANENT_ERROR
+            elif response is not None and response.status_code != 409:
+                logger.warning(f'Chunk upload failed with status {response.status_code}')
+
+            failures += 1
+            if failures > MAX_RETRIES:
+                set_failure_reason(aggregators.response_reason(response) if response is not None else 'Chunk upload failed')
+                return HelperResult.TRANSIENT_ERROR
+            # Part of the chunk may have made it, so ask where to pick up
+            current = await self._offset(client)
+            if current is None:
+                return HelperResult.TRANSIENT_ERROR
+            offset = current
+            self._report(offset)
+        return HelperResult.OK
@@ -4,65 +4,366 @@
 # Copyright (c) 2023 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
 import datetime
+import email.utils
 import gzip
 import httpx
-import io
 import json
 import logging
 import os
+import tempfile
+import time
 import urllib.parse
 import uuid
-from typing import IO, Optional
+import zlib
+from collections.abc import Callable
+from typing import IO, ClassVar, NamedTuple, Optional, Protocol, Self, TypedDict, Unpack
 
 import steamos_log_submitter as sls
 import steamos_log_submitter.aggregators as aggregators
-from steamos_log_submitter.helpers import HelperResult
+import steamos_log_submitter.dedup
+import steamos_log_submitter.ratelimit
+from steamos_log_submitter.helpers import HelperResult, set_failure_reason
 from steamos_log_submitter.types import JSONEncodable
 
+try:
+    import zstandard  # type: ignore[import-not-found,unused-ignore]
+except ModuleNotFoundError:
+    zstandard = None
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_RETRY_AFTER = 60
+
+COMPRESSED_TYPES = frozenset({
+    'application/gzip',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-gzip',
+    'application/x-xz',
+    'application/zip',
+    'application/zstd',
+})
+COMPRESSED_MAGIC = (
+    b'PK\x03\x04',  # zip
+    b'\x1f\x8b',  # gzip
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'\xfd7zXZ\x00',  # xz
+    b'BZh',  # bzip2
+)
+SAMPLE_SIZE = 64 * 1024
+MIN_SAMPLE_SIZE = 4096
+
+# Sentry's default ingestion limits, applied to the uncompressed payload
+MAX_EVENT_SIZE = 1024 * 1024
+MAX_ATTACHMENT_SIZE = 100 * 1024 * 1024
+MAX_ENVELOPE_SIZE = 100 * 1024 * 1024
+
+Attachment = dict[str, str | bytes | int | IO[bytes]]
+
+
+class PayloadTooLarge(ValueError):
+    pass
+
+
+class SizeLimits(NamedTuple):
+    event: int
+    attachment: int
+    envelope: int
+
+
+def _config_size(key: str, default: int) -> int:
+    value = sls.base_config.get(key)
+    if not value:
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size <= 0:
+        logger.warning(f'Invalid {key} value {value}, ignoring')
+        return default
+    return size
+
+
+def size_limits() -> SizeLimits:
+    return SizeLimits(event=_config_size('max-event-size', MAX_EVENT_SIZE),
+                      attachment=_config_size('max-attachment-size', MAX_ATTACHMENT_SIZE),
+                      envelope=_config_size('max-envelope-size', MAX_ENVELOPE_SIZE))
+
+
+class Encoder(Protocol):
+    def write(self, data: bytes, /) -> int: ...
+    def close(self) -> None: ...
+
+
+class Codec(NamedTuple):
+    encoding: Optional[str]
+    levels: range
+    default_level: int
+    fast_level: int
+    open: Callable[[IO[bytes], int], Encoder]
+
+
+class EventOptions(TypedDict, total=False):
+    envelope_only: bool
+    compression: tuple[str, Optional[int]]
+    dedup: Optional[tuple[float, float]]
+
+
+class _Passthrough:
+    def __init__(self, f: IO[bytes]):
+        self._f = f
+
+    def write(self, data: bytes, /) -> int:
+        return self._f.write(data)
+
+    def close(self) -> None:
+        pass
+
+
+def _open_gzip(f: IO[bytes], level: int) -> Encoder:
+    return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=level)
+
+
+def _open_zstd(f: IO[bytes], level: int) -> Encoder:
+    assert zstandard
+    return zstandard.ZstdCompressor(level=level).stream_writer(f, closefd=False)  # type: ignore[no-any-return,unused-ignore]
+
+
+CODECS: dict[str, Codec] = {
+    'none': Codec(None, range(0, 1), 0, 0, lambda f, level: _Passthrough(f)),
+    'gzip': Codec('gzip', range(0, 10), 9, 1, _open_gzip),
+}
+if zstandard:
+    CODECS['zstd'] = Codec('zstd', range(-7, 23), 3, 1, _open_zstd)
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logger.warning(f'Invalid Retry-After value {value}, ignoring')
+        return DEFAULT_RETRY_AFTER
+    return max(date.timestamp() - time.time(), 0)
+
+
+def is_compressed(sample: bytes, mime_type: Optional[str] = None) -> bool:
+    if mime_type in COMPRESSED_TYPES:
+        return True
+    if sample.startswith(COMPRESSED_MAGIC):
+        return True
+    if len(sample) < MIN_SAMPLE_SIZE:
+        return False
+    # If the fastest zlib level can't shrink a sample, the rest of the data is
+    # unlikely to be worth compressing either
+    return len(zlib.compress(sample, 1)) >= len(sample) * 0.95
+
 
 class SentryEvent(aggregators.AggregatorEvent):
-    def __init__(self, dsn: str):
-        self._raw_envelope: Optional[io.BytesIO] = None
-        self._envelope: Optional[gzip.GzipFile] = None
+    kind: ClassVar[str] = 'event'
+
+    def __init__(self, dsn: str, *, envelope_only: bool = False, compression: tuple[str, Optional[int]] = ('auto', None),
+                 dedup: Optional[tuple[float, float]] = None):
+        self._raw_envelope: Optional[IO[bytes]] = None
+        self._envelope: Optional[Encoder] = None
         self._event_id = uuid.uuid4().hex
+        self._dedup_key: Optional[str] = None
+        self._duplicates = 0
 
         self._event: dict[str, JSONEncodable]
         self._sent_at: str
 
         self.dsn = dsn
+        self.envelope_only = envelope_only
+        self.compression = compression
+        self.dedup = dedup
         self.ua_string = f'SteamOS Log Submitter/{sls.__version__}'
         self.appid: Optional[int] = None
-        self.attachments: list[dict[str, str | bytes]] = []
+        self.attachments: list[Attachment] = []
         self.exceptions: list[dict[str, JSONEncodable]] = []
         self.tags: dict[str, JSONEncodable] = {}
         self.fingerprint: list[str] = []
         self.extra: dict[str, JSONEncodable] = {}
         self.timestamp: Optional[float] = None
-        self.environment: Optional[str] = sls.util.get_steamos_branch()
         self.message: Optional[str] = None
-        self.os_build: Optional[str] = sls.util.get_build_id() if self.environment is not None else None
-        self.version: Optional[str] = sls.util.get_version_id() if self.environment is not None else None
-        self.architecture: str = os.uname().machine
 
-    def add_attachment(self, *attachments: dict[str, str | bytes]) -> None:
+        self._context = sls.util.get_device_context()
+        self.environment: Optional[str] = self._context.branch
+        self.os_build: Optional[str] = self._context.build_id
+        self.version: Optional[str] = self._context.version_id
+        self.architecture: str = self._context.architecture
+
+        self.encoding: Optional[str] = None
+        self.raw_size = 0
+        self.encoded_size = 0
+        self.seal_time = 0.0
+
+    @classmethod
+    def create(cls, dsn: str, backend: Optional[str] = None, **kwargs: Unpack[EventOptions]) -> Self:
+        module = aggregators.get_backend(dsn, backend)
+        event_class = getattr(module, 'events', {}).get(cls.kind)
+        if not isinstance(event_class, type) or not issubclass(event_class, cls):
+            raise ValueError(f'Aggregator backend {module.__name__} does not support {cls.kind} events')
+        return event_class(dsn, **kwargs)
+
+    def add_attachment(self, *attachments: Attachment) -> None:
         self.attachments.extend(attachments)
 
-    def _append_json(self, j: JSONEncodable) -> None:
+    def close(self) -> None:
+        if self._envelope:
+            self._envelope.close()
+        if self._raw_envelope:
+            self._raw_envelope.close()
+            self._raw_envelope = None
+        self._envelope = None
+
+    def _write(self, data: bytes) -> None:
         assert self._envelope
-        self._envelope.write(json.dumps(j).encode())
-        self._envelope.write(b'\n')
+        self._envelope.write(data)
+        self.raw_size += len(data)
+
+    def _append_json(self, j: JSONEncodable) -> None:
+        self._write(json.dumps(j).encode())
+        self._write(b'\n')
 
     def _append_item(self, j: JSONEncodable, item: bytes = b'') -> None:
-        assert self._envelope
         self._append_json(j)
-        self._envelope.write(item)
-        self._envelope.write(b'\n')
+        self._write(item)
+        self._write(b'\n')
+
+    def _append_file(self, j: dict[str, JSONEncodable], f: IO[bytes], length: int, tail: bool = False) -> None:
+        if tail:
+            f.seek(f.seek(0, os.SEEK_END) - length)
+        j['length'] = length
+        self._append_json(j)
+        while length:
+            chunk = f.read(min(length, aggregators.CHUNK_SIZE))
+            if not chunk:
+                raise EOFError('File was truncated while reading attachment')
+            self._write(chunk)
+            length -= len(chunk)
+        self._write(b'\n')
+
+    @staticmethod
+    def _attachment_info(attachment: Attachment, length: int) -> dict[str, JSONEncodable]:
+        attachment_info: dict[str, JSONEncodable] = {
+            'type': 'attachment',
+        }
+        mime_type = attachment.get('mime-type')
+        if isinstance(mime_type, str):
+            attachment_info['content_type'] = mime_type
+        filename = attachment.get('filename')
+        if isinstance(filename, str):
+            attachment_info['filename'] = filename
+        attachment_info['length'] = length
+        return attachment_info
+
+    @staticmethod
+    def _attachment_size(attachment: Attachment) -> int:
+        if 'path' in attachment:
+            assert isinstance(attachment['path'], str)
+            return os.stat(attachment['path']).st_size
+        data = attachment['data']
+        if isinstance(data, bytes):
+            return len(data)
+        assert not isinstance(data, (str, int))
+        start = data.tell()
+        length = data.seek(0, os.SEEK_END) - start
+        data.seek(start)
+        return length
+
+    def _append_attachment(self, attachment: Attachment, length: int, size: int) -> None:
+        # Attachments that are too large keep only their tail, which is
+        # where the interesting parts of a log usually are
+        attachment_info = self._attachment_info(attachment, length)
+        if 'path' in attachment:
+            assert isinstance(attachment['path'], str)
+            with open(attachment['path'], 'rb') as f:
+                self._append_file(attachment_info, f, length, length < size)
+        elif isinstance(attachment['data'], bytes):
+            self._append_item(attachment_info, attachment['data'][size - length:])
+        else:
+            assert not isinstance(attachment['data'], (str, int))
+            self._append_file(attachment_info, attachment['data'], length, length < size)
+
+    def _inspect_attachment(self, attachment: Attachment) -> tuple[int, bool]:
+        mime_type = attachment.get('mime-type')
+        if not isinstance(mime_type, str):
+            mime_type = None
+        if 'path' in attachment:
+            assert isinstance(attachment['path'], str)
+            with open(attachment['path'], 'rb') as f:
+                length = os.fstat(f.fileno()).st_size
+                sample = f.read(SAMPLE_SIZE) if mime_type not in COMPRESSED_TYPES else b''
+        elif isinstance(attachment['data'], bytes):
+            length = len(attachment['data'])
+            sample = attachment['data'][:SAMPLE_SIZE]
+        else:
+            assert not isinstance(attachment['data'], (str, int))
+            data = attachment['data']
+            start = data.tell()
+            length = data.seek(0, os.SEEK_END) - start
+            data.seek(start)
+            sample = data.read(SAMPLE_SIZE) if mime_type not in COMPRESSED_TYPES else b''
+            data.seek(start)
+        return length, is_compressed(sample, mime_type)
+
+    def _get_codec(self) -> tuple[str, Optional[int]]:
+        name, level = self.compression
+        if name == 'zstd' and name not in CODECS:
+            logger.warning('zstd compression was requested but the zstandard module is not installed, falling back to gzip')
+            name = 'gzip'
+        elif name != 'auto' and name not in CODECS:
+            logger.warning(f'Unknown compression {name}, ignoring')
+            name = 'auto'
+        if level is not None and level not in CODECS['gzip' if name == 'auto' else name].levels:
+            logger.warning(f'Invalid {name} compression level {level}, ignoring')
+            level = None
+        return name, level
+
+    def _choose_compression(self, size: int, attachments: list[Attachment]) -> tuple[Codec, int]:
+        name, level = self._get_codec()
+        if name != 'auto':
+            codec = CODECS[name]
+            return codec, codec.default_level if level is None else level
+
+        codec = CODECS['gzip']
+        if level is None:
+            level = codec.default_level
+        compressed = 0
+        for attachment in attachments:
+            length, precompressed = self._inspect_attachment(attachment)
+            size += length
+            if precompressed:
+                compressed += length
+        if not size:
+            return codec, level
+        # Compressing data that's already compressed wastes CPU time for
+        # little to no gain, so back off if most of the envelope is
+        if compressed >= size * 0.9:
+            return CODECS['none'], 0
+        if compressed >= size * 0.5:
+            return codec, min(codec.fast_level, level)
+        return codec, level
+
+    def _open_envelope(self, codec: Codec, level: int) -> None:
+        assert self._raw_envelope
+        self.encoding = codec.encoding
+        self._envelope = codec.open(self._raw_envelope, level)
+
+    def _open_raw_envelope(self) -> IO[bytes]:
+        # Attachments can be large, so only keep small envelopes in memory
+        return tempfile.SpooledTemporaryFile(max_size=aggregators.SPOOL_SIZE)
 
     def _initialize(self) -> None:
-        self._raw_envelope = io.BytesIO()
-        self._envelope = gzip.GzipFile(fileobj=self._raw_envelope, mode='wb')
+        self.close()
+        self._raw_envelope = self._open_raw_envelope()
 
         self._sent_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
 
@@ -72,9 +373,89 @@ class SentryEvent(aggregators.AggregatorEvent):
             'platform': 'native',
         }
 
+    def _envelope_header(self) -> dict[str, JSONEncodable]:
+        return {
+            'dsn': self.dsn,
+            'event_id': self._event_id,
+            'sent_at': self._sent_at,
+        }
+
+    @staticmethod
+    def _event_item(length: int) -> dict[str, JSONEncodable]:
+        return {
+            'type': 'event',
+            'length': length,
+            'content_type': 'application/json',
+        }
+
+    def _envelope_size(self, event_size: int, sizes: list[int], plan: dict[int, Optional[int]]) -> int:
+        size = 0
+        for index, attachment in enumerate(self.attachments):
+            length = plan.get(index, sizes[index])
+            if length is None:
+                continue
+            size += len(json.dumps(self._attachment_info(attachment, length)).encode()) + length + 2
+        if self.envelope_only:
+            size += len(json.dumps(self._event_item(event_size)).encode()) + event_size + 2
+        if size:
+            size += len(json.dumps(self._envelope_header()).encode()) + 1
+        return size
+
+    def _plan_attachments(self, limits: SizeLimits, event_size: int, sizes: list[int],
+                          plan: dict[int, Optional[int]]) -> dict[int, Optional[int]]:
+        plan = dict(plan)
+
+        def truncatable(index: int) -> bool:
+            mime_type = self.attachments[index].get('mime-type')
+            return isinstance(mime_type, str) and mime_type.startswith('text/')
+
+        def priority(index: int) -> int:
+            value = self.attachments[index].get('priority')
+            return value if isinstance(value, int) else 0
+
+        def required(index: int) -> bool:
+            # The event is pointless without these, so they're never trimmed
+            return bool(self.attachments[index].get('required'))
+
+        for index, size in enumerate(sizes):
+            length = plan.get(index, size)
+            if length is not None and length > limits.attachment:
+                if required(index):
+                    raise PayloadTooLarge(f'Attachment {index} is {length} bytes, larger than the limit of {limits.attachment}')
+                plan[index] = limits.attachment if truncatable(index) else None
+
+        # Trim the least important attachments first, and the largest ones if
+        # they're equally important, so as few as possible are lost
+        order = sorted((index for index in range(len(sizes)) if not required(index)),
+                       key=lambda index: (priority(index), -sizes[index], -index))
+        while (excess := self._envelope_size(event_size, sizes, plan) - limits.envelope) > 0:
+            trim = next((index for index in order if plan.get(index, sizes[index])), None)
+            if trim is None:
+                break
+            length = plan.get(trim, sizes[trim])
+            assert length
+            plan[trim] = length - excess if length > excess and truncatable(trim) else None
+        return plan
+
+    def _note_trimmed(self, extra: dict[str, JSONEncodable], sizes: list[int], plan: dict[int, Optional[int]]) -> None:
+        dropped: list[JSONEncodable] = []
+        truncated: dict[str, JSONEncodable] = {}
+        for index, length in sorted(plan.items()):
+            name = self.attachments[index].get('filename')
+            if not isinstance(name, str):
+                name = f'attachment-{index}'
+            if length is None:
+                dropped.append(name)
+            else:
+                truncated[name] = sizes[index] - length
+        if dropped:
+            extra['sls.dropped_attachments'] = dropped
+        if truncated:
+            extra['sls.truncated_attachments'] = truncated
+
     def seal(self, *, minidump: bool = False) -> None:
+        start = time.process_time()
         self._initialize()
-        assert self._envelope
 
         if self.version:
             self._event['release'] = self.version
@@ -100,21 +481,15 @@ class SentryEvent(aggregators.AggregatorEvent):
         if self.os_build:
             tags['os_build'] = self.os_build
 
-        unit_id = sls.util.telemetry_unit_id()
+        unit_id = self._context.unit_id
         if unit_id:
             tags['unit_id'] = unit_id
             self._event['user'] = {
                 'id': unit_id
             }
 
-        try:
-            dmi_info = sls.util.get_dmi_info()
-            if 'product' in dmi_info:
-                tags['product'] = dmi_info['product']
-        except FileNotFoundError:
-            pass
-        except OSError as e:
-            logger.error(f'Failed to get DMI information: {e}')
+        if self._context.product:
+            tags['product'] = self._context.product
 
         if tags:
             self._event['tags'] = tags
@@ -126,98 +501,236 @@ class SentryEvent(aggregators.AggregatorEvent):
         if self.exceptions:
             self._event['exception'] = {'values': list(self.exceptions)}
 
-        if self.attachments:
-            self._append_json({
-                'dsn': self.dsn,
-                'event_id': self._event_id,
-                'sent_at': self._sent_at,
-            })
-
-            for attachment in self.attachments:
-                attachment_info: dict[str, JSONEncodable] = {
-                    'type': 'attachment',
-                    'length': len(attachment['data'])
-                }
-                if 'mime-type' in attachment:
-                    attachment_info['content_type'] = attachment['mime-type']
-                if 'filename' in attachment:
-                    attachment_info['filename'] = attachment['filename']
-                assert isinstance(attachment['data'], bytes)
-                self._append_item(attachment_info, attachment['data'])
-
-        if self._envelope.tell():
-            self._envelope.close()
-        else:
+        limits = size_limits()
+        sizes = [self._attachment_size(attachment) for attachment in self.attachments]
+        plan: dict[int, Optional[int]] = {}
+        # Trimming attachments is noted in the event itself, which can change
+        # its size, so keep going until the plan settles
+        while True:
+            self._note_trimmed(extra, sizes, plan)
+            event = json.dumps(self._event).encode()
+            if len(event) > limits.event:
+                raise PayloadTooLarge(f'Event is {len(event)} bytes, larger than the limit of {limits.event}')
+            event_size = len(event) if self.envelope_only else 0
+            new_plan = self._plan_attachments(limits, event_size, sizes, plan)
+            if new_plan == plan:
+                break
+            plan = new_plan
+        envelope_size = self._envelope_size(event_size, sizes, plan)
+        if envelope_size > limits.envelope:
+            raise PayloadTooLarge(f'Envelope is {envelope_size} bytes, larger than the limit of {limits.envelope}')
+
+        attachments = [(attachment, plan.get(index, sizes[index]), sizes[index]) for index, attachment in enumerate(self.attachments)]
+        kept = [(attachment, length, size) for attachment, length, size in attachments if length is not None]
+        self._open_envelope(*self._choose_compression(event_size, [attachment for attachment, _, _ in kept]))
+        self.raw_size = 0
+
+        if self.envelope_only or kept:
+            self._append_json(self._envelope_header())
+
+        if self.envelope_only:
+            self._append_item(self._event_item(len(event)), event)
+
+        for attachment, length, size in kept:
+            assert length is not None
+            self._append_attachment(attachment, length, size)
+
+        self.encoded_size = 0
+        if self.raw_size:
+            assert self._envelope and self._raw_envelope
             self._envelope.close()
             self._envelope = None
-            self._raw_envelope = None
+            self.encoded_size = self._raw_envelope.tell()
+        else:
+            self.close()
+        self.seal_time = time.process_time() - start
+        if self.raw_size:
+            logger.debug(f'Sealed envelope with {self.encoding or "no"} encoding in {self.seal_time:.3f}s of CPU time, '
+                         f'saving {self.raw_size - self.encoded_size} of {self.raw_size} bytes')
+
+    def _check_duplicate(self) -> bool:
+        if not self.dedup:
+            return True
+        fingerprint = list(self.fingerprint)
+        if self.appid is not None:
+            fingerprint.append(f'appid:{self.appid}')
+        self._dedup_key = sls.dedup.key(fingerprint, self.tags, self.message)
+        if not self._dedup_key:
+            return True
+        window, sample_rate = self.dedup
+        duplicates = sls.dedup.check(self.dsn, self._dedup_key, window, sample_rate)
+        if duplicates is None:
+            return False
+        self._duplicates = duplicates
+        if duplicates:
+            self.extra['sls.duplicates'] = duplicates
+        return True
+
+    def _record_upload(self) -> None:
+        if not self.dedup or not self._dedup_key:
+            return
+        window, _ = self.dedup
+        sls.dedup.record_upload(self.dsn, self._dedup_key, window, self._duplicates)
 
     async def send(self) -> HelperResult:
-        self.seal()
+        # Identical events that were uploaded recently are only counted, to
+        # avoid uploading the same crash over and over
+        if not self._check_duplicate():
+            return HelperResult.OK
+
+        try:
+            self.seal()
+        except PayloadTooLarge as e:
+            logger.error(f'Failed to submit event, too large: {e}')
+            set_failure_reason(f'Too large: {e}')
+            self.close()
+            return HelperResult.PERMANENT_ERROR
+        except (OSError, EOFError) as e:
+            logger.error(f'Failed to read attachment: {e}')
+            set_failure_reason(f'Failed to read attachment: {e}')
+            self.close()
+            return HelperResult.TRANSIENT_ERROR
 
+        try:
+            result = await self._send()
+        finally:
+            self.close()
+        if result == HelperResult.OK:
+            self._record_upload()
+        return result
+
+    def _check_rate_limits(self, response: httpx.Response) -> bool:
+        limits = response.headers.get('X-Sentry-Rate-Limits')
+        if limits:
+            for quota in limits.split(','):
+                retry_after, _, scope = quota.strip().partition(':')
+                categories = scope.split(':', 1)[0]
+                try:
+                    seconds = float(retry_after)
+                except ValueError:
+                    logger.warning(f'Invalid rate limit {quota.strip()}, ignoring')
+                    continue
+                sls.ratelimit.limit(self.dsn, seconds, categories.split(';') if categories else (sls.ratelimit.ALL,))
+        elif response.status_code == 429:
+            sls.ratelimit.limit(self.dsn, parse_retry_after(response.headers.get('Retry-After')))
+        return response.status_code == 429
+
+    async def _send(self) -> HelperResult:
         dsn_parsed = urllib.parse.urlparse(self.dsn)
         store_endpoint = dsn_parsed._replace(path=f'/api{dsn_parsed.path}/store/').geturl()
         envelope_endpoint = dsn_parsed._replace(path=f'/api{dsn_parsed.path}/envelope/').geturl()
 
+        client = aggregators.client()
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
-                store_post = await client.post(store_endpoint, json=self._event, headers={
-                    'User-Agent': self.ua_string
-                })
+            if self.envelope_only:
+                return await self._send_envelope(client, envelope_endpoint)
 
-                if store_post.status_code == 413:
-                    logger.error('Failed to submit event, too large')
-                    return HelperResult.PERMANENT_ERROR
+            store_post = await client.post(store_endpoint, json=self._event, headers={
+                'User-Agent': self.ua_string
+            })
 
-                if store_post.status_code != 200:
-                    logger.error(f'Failed to submit event: {store_post.content.decode()}')
+            if self._check_rate_limits(store_post):
+                return HelperResult.CLASS_ERROR
+
+            if store_post.status_code == 413:
+                logger.error('Failed to submit event, too large')
+                return HelperResult.PERMANENT_ERROR
+
+            if store_post.status_code != 200:
+                logger.error(f'Failed to submit event: {store_post.content.decode()}')
+                set_failure_reason(aggregators.response_reason(store_post))
+                return HelperResult.TRANSIENT_ERROR
+
+            if self._raw_envelope:
+                envelope_post = await self._post_envelope(client, envelope_endpoint)
+                if self._check_rate_limits(envelope_post):
+                    return HelperResult.CLASS_ERROR
+                if envelope_post.status_code != 200:
+                    logger.error(f'Failed to submit attachment: {envelope_post.content.decode()}')
+                    set_failure_reason(aggregators.response_reason(envelope_post))
                     return HelperResult.TRANSIENT_ERROR
-
-                if self._envelope:
-                    assert self._raw_envelope
-                    envelope_post = await client.post(envelope_endpoint, content=self._raw_envelope.getvalue(), headers={
-                        'Content-Type': 'application/x-sentry-envelope',
-                        'Content-Encoding': 'gzip',
-                        'User-Agent': self.ua_string
-                    })
-
-                    if envelope_post.status_code != 200:
-                        logger.error(f'Failed to submit attachment: {envelope_post.content.decode()}')
-                        return HelperResult.TRANSIENT_ERROR
-        except httpx.NetworkError:
+        except httpx.NetworkError as e:
             logger.warning('Network error occurred while submitting log')
+            set_failure_reason(f'Network error: {e}')
+            return HelperResult.TRANSIENT_ERROR
+
+        return HelperResult.OK
+
+    async def _post_envelope(self, client: httpx.AsyncClient, endpoint: str) -> httpx.Response:
+        assert self._raw_envelope
+        size = self._raw_envelope.seek(0, os.SEEK_END)
+        headers = {
+            'Content-Length': str(size),
+            'Content-Type': 'application/x-sentry-envelope',
+            'User-Agent': self.ua_string
+        }
+        if self.encoding:
+            headers['Content-Encoding'] = self.encoding
+        return await client.post(endpoint, content=aggregators.stream(self._raw_envelope, size), headers=headers)
+
+    async def _send_envelope(self, client: httpx.AsyncClient, endpoint: str) -> HelperResult:
+        post = await self._post_envelope(client, endpoint)
+
+        if self._check_rate_limits(post):
+            return HelperResult.CLASS_ERROR
+
+        if post.status_code == 413:
+            logger.error('Failed to submit event, too large')
+            return HelperResult.PERMANENT_ERROR
+
+        if post.status_code != 200:
+            logger.error(f'Failed to submit event: {post.content.decode()}')
+            set_failure_reason(aggregators.response_reason(post))
             return HelperResult.TRANSIENT_ERROR
 
         return HelperResult.OK
 
 
 class MinidumpEvent(SentryEvent):
+    kind = 'minidump'
+
     def _initialize(self) -> None:
         super()._initialize()
         self._event = {}
 
-    async def send_minidump(self, minidump: IO[bytes]) -> bool:
+    async def send_minidump(self, minidump: IO[bytes]) -> HelperResult:
+        if not self._check_duplicate():
+            return HelperResult.OK
+
         self.seal()
+        # Minidumps are uploaded on their own, so the envelope isn't needed
+        self.close()
 
-        metadata: dict[str, JSONEncodable] = {'sentry': json.dumps(self._event)}
+        metadata = {'sentry': json.dumps(self._event)}
 
         try:
-            async with httpx.AsyncClient() as client:
-                post = await client.post(self.dsn, files={'upload_file_minidump': minidump}, data=metadata)
-        except httpx.NetworkError:
+            post = await aggregators.post_multipart(aggregators.client(), self.dsn, metadata, {'upload_file_minidump': minidump})
+        except httpx.NetworkError as e:
             logger.warning('Network error occurred while submitting log')
-            return False
+            set_failure_reason(f'Network error: {e}')
+            return HelperResult.TRANSIENT_ERROR
 
+        if self._check_rate_limits(post):
+            set_failure_reason(aggregators.response_reason(post))
+            return HelperResult.CLASS_ERROR
         if post.status_code == 200:
-            return True
+            self._record_upload()
+            return HelperResult.OK
 
         logger.error(f'Attempting to upload minidump failed with status {post.status_code}')
+        set_failure_reason(aggregators.response_reason(post))
         if post.status_code == 400:
             try:
                 data = post.json()
                 if data.get('detail') == 'invalid minidump':
                     logger.warning('Minidump appears corrupted. Removing to avoid indefinite retrying.')
-                    raise ValueError
+                    return HelperResult.PERMANENT_ERROR
             except json.decoder.JSONDecodeError:
                 pass
-        return False
+        return HelperResult.TRANSIENT_ERROR
+
+
+events: dict[str, type[SentryEvent]] = {
+    SentryEvent.kind: SentryEvent,
+    MinidumpEvent.kind: MinidumpEvent,
+}
@@ -0,0 +1,203 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import argparse
+import asyncio
+import httpx
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import urllib.parse
+from collections.abc import Sequence
+from typing import IO, Optional, Unpack
+
+import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators as aggregators
+from steamos_log_submitter.aggregators.sentry import EventOptions, MinidumpEvent, SentryEvent
+from steamos_log_submitter.helpers import HelperResult, set_failure_reason
+from steamos_log_submitter.types import JSONEncodable
+
+__all__ = [
+    'SpoolEvent',
+    'SpoolMinidumpEvent',
+    'events',
+    'replay',
+    'spool_directory',
+]
+
+logger = logging.getLogger(__name__)
+
+SUFFIXES = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def spool_directory(dsn: str) -> str:
+    parsed = urllib.parse.urlparse(dsn)
+    if parsed.scheme == 'file':
+        return urllib.parse.unquote(parsed.path)
+    return sls.base_config.get('spool-directory') or f'{sls.base}/spool'
+
+
+class SpoolEvent(SentryEvent):
+    def __init__(self, dsn: str, **kwargs: Unpack[EventOptions]):
+        super().__init__(dsn, **kwargs)
+        # Spooled events are replayed as a single envelope
+        self.envelope_only = True
+        self.directory = spool_directory(dsn)
+        self._spool_path: Optional[str] = None
+
+    def _open_raw_envelope(self) -> IO[bytes]:
+        # Write the envelope straight into the spool directory, so it doesn't
+        # need to be copied again once it's sealed
+        os.makedirs(self.directory, exist_ok=True)
+        fd, self._spool_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.directory)
+        return open(fd, 'w+b')
+
+    def close(self) -> None:
+        super().close()
+        if self._spool_path:
+            try:
+                os.unlink(self._spool_path)
+            except FileNotFoundError:
+                pass
+            self._spool_path = None
+
+    async def _send(self) -> HelperResult:
+        assert self._raw_envelope and self._spool_path
+        fname = f'{self.directory}/{self._event_id}.envelope{SUFFIXES.get(self.encoding, "")}'
+        try:
+            self._raw_envelope.flush()
+            os.replace(self._spool_path, fname)
+        except OSError as e:
+            logger.error(f'Failed to spool event: {e}')
+            set_failure_reason(f'Failed to spool event: {e}')
+            return HelperResult.TRANSIENT_ERROR
+        self._spool_path = None
+        logger.debug(f'Spooled event to {fname}')
+        return HelperResult.OK
+
+
+class SpoolMinidumpEvent(MinidumpEvent):
+    def __init__(self, dsn: str, **kwargs: Unpack[EventOptions]):
+        super().__init__(dsn, **kwargs)
+        self.directory = spool_directory(dsn)
+
+    async def send_minidump(self, minidump: IO[bytes]) -> HelperResult:
+        if not self._check_duplicate():
+            return HelperResult.OK
+
+        self.seal()
+        self.close()
+
+        metadata: dict[str, JSONEncodable] = {'dsn': self.dsn, 'sentry': json.dumps(self._event)}
+        fd = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.directory)
+            with open(fd, 'wb') as f:
+                minidump.seek(0)
+                shutil.copyfileobj(minidump, f, aggregators.CHUNK_SIZE)
+            os.replace(tmp, f'{self.directory}/{self._event_id}.dmp')
+            with open(f'{self.directory}/{self._event_id}.json', 'w') as f:
+                json.dump(metadata, f)
+        except OSError as e:
+            logger.error(f'Failed to spool minidump: {e}')
+            set_failure_reason(f'Failed to spool minidump: {e}')
+            if fd is not None:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+            return HelperResult.TRANSIENT_ERROR
+
+        self._record_upload()
+        return HelperResult.OK
+
+
+events: dict[str, type[SentryEvent]] = {
+    SpoolEvent.kind: SpoolEvent,
+    SpoolMinidumpEvent.kind: SpoolMinidumpEvent,
+}
+
+
+async def _replay_envelope(client: httpx.AsyncClient, endpoint: str, fname: str) -> bool:
+    encoding = None
+    for name, suffix in SUFFIXES.items():
+        if suffix and fname.endswith(suffix):
+            encoding = name
+    headers = {
+        'Content-Type': 'application/x-sentry-envelope',
+        'User-Agent': f'SteamOS Log Submitter/{sls.__version__}',
+    }
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    with open(fname, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        headers['Content-Length'] = str(size)
+        post = await client.post(endpoint, content=aggregators.stream(f, size), headers=headers)
+    return post.status_code == 200
+
+
+async def _replay_minidump(client: httpx.AsyncClient, dsn: str, fname: str) -> bool:
+    with open(f'{fname[:-len(".dmp")]}.json') as f:
+        metadata = json.load(f)
+    with open(fname, 'rb') as f:
+        post = await aggregators.post_multipart(client, dsn, {'sentry': metadata['sentry']}, {'upload_file_minidump': f})
+    return post.status_code == 200
+
+
+async def replay(directory: str, dsn: str, minidump_dsn: Optional[str] = None) -> dict[str, bool]:
+    dsn_parsed = urllib.parse.urlparse(dsn)
+    # Events may have been spooled without a real DSN, so authenticate with
+    # the one given instead of relying on the envelope header
+    query = urllib.parse.urlencode({'sentry_key': dsn_parsed.username or ''})
+    endpoint = dsn_parsed._replace(netloc=dsn_parsed.netloc.rpartition('@')[2], path=f'/api{dsn_parsed.path}/envelope/', query=query).geturl()
+    client = aggregators.client()
+    results = {}
+    for fname in sorted(os.listdir(directory)):
+        if fname.startswith('.'):
+            continue
+        path = f'{directory}/{fname}'
+        try:
+            if '.envelope' in fname:
+                results[fname] = await _replay_envelope(client, endpoint, path)
+            elif fname.endswith('.dmp') and minidump_dsn:
+                results[fname] = await _replay_minidump(client, minidump_dsn, path)
+        except (OSError, KeyError, ValueError, httpx.NetworkError) as e:
+            logger.error(f'Failed to replay {fname}: {e}')
+            results[fname] = False
+    return results
+
+
+def main(args: Sequence[str] = sys.argv[1:]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m steamos_log_submitter.aggregators.spool',
+                                     description='Replay spooled events to a Sentry server')
+    parser.add_argument('directory', help='Spool directory to replay')
+    parser.add_argument('dsn', help='DSN to submit envelopes to')
+    parser.add_argument('--minidump-dsn', help='DSN to submit minidumps to, skipped if not given')
+    parsed = parser.parse_args(args)
+
+    async def run() -> dict[str, bool]:
+        try:
+            return await replay(parsed.directory, parsed.dsn, parsed.minidump_dsn)
+        finally:
+            await aggregators.close()
+
+    results = asyncio.run(run())
+    failed = [fname for fname, ok in results.items() if not ok]
+    print(f'Replayed {len(results) - len(failed)} of {len(results)} spooled events')
+    for fname in failed:
+        print(f'Failed: {fname}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
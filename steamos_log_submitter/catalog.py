@@ -0,0 +1,203 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import dataclasses
+import logging
+import os
+import time
+from typing import NamedTuple, Optional
+
+import steamos_log_submitter as sls
+import steamos_log_submitter.inotify
+import steamos_log_submitter.ledger
+
+__all__ = [
+    'LogEntry',
+    'entries',
+    'invalidate',
+    'list_logs',
+    'reset',
+    'stat',
+    'unwatch',
+    'watch',
+]
+
+logger = logging.getLogger(__name__)
+
+# Directory timestamps come from a coarse clock, so a change made shortly after
+# a scan may not move the mtime. Directories that changed this recently are
+# rescanned every time instead of being trusted.
+RACY_NS = 2_000_000_000
+
+WATCH_MASK = (sls.inotify.IN_ATTRIB | sls.inotify.IN_CLOSE_WRITE | sls.inotify.IN_DELETE
+              | sls.inotify.IN_MOVED_FROM | sls.inotify.IN_MOVED_TO)
+
+
+class LogEntry(NamedTuple):
+    name: str
+    size: int
+    mtime: float
+    state: str
+    attempts: int
+
+
+@dataclasses.dataclass
+class _File:
+    inode: int
+    readable: bool
+    stat: Optional[os.stat_result] = None
+
+
+@dataclasses.dataclass
+class _Directory:
+    mtime_ns: Optional[int] = None
+    files: dict[str, _File] = dataclasses.field(default_factory=dict)
+    dirty: set[str] = dataclasses.field(default_factory=set)
+
+
+_directories: dict[str, _Directory] = {}
+_watcher: Optional[sls.inotify.Watcher] = None
+
+
+def _changed(path: str, name: str) -> None:
+    directory = _directories.get(path)
+    if directory:
+        directory.dirty.add(name)
+
+
+def invalidate(path: Optional[str] = None) -> None:
+    for directory_path, directory in _directories.items():
+        if path is None or directory_path == path:
+            directory.mtime_ns = None
+            directory.dirty.update(directory.files)
+
+
+def watch() -> Optional[sls.inotify.Watcher]:
+    global _watcher
+    unwatch()
+    watcher = sls.inotify.Watcher(_changed, WATCH_MASK, overflow=invalidate)
+    try:
+        watcher.start()
+    except OSError as e:
+        logger.warning(f'Failed to watch log directories, falling back to scanning: {e}')
+        return None
+    _watcher = watcher
+    for path in _directories:
+        _watch(path)
+    # Anything could have changed while nothing was watching
+    invalidate()
+    return watcher
+
+
+def unwatch() -> None:
+    global _watcher
+    if _watcher:
+        _watcher.close()
+        _watcher = None
+
+
+def reset() -> None:
+    unwatch()
+    _directories.clear()
+
+
+def _watch(path: str) -> None:
+    if not _watcher or _watcher.watching(path):
+        return
+    try:
+        _watcher.add(path)
+    except OSError as e:
+        logger.debug(f'Failed to watch {path}: {e}')
+
+
+def _watched(path: str) -> bool:
+    return _watcher is not None and _watcher.watching(path)
+
+
+def _sync(path: str) -> _Directory:
+    directory = _directories.get(path)
+    if directory is None:
+        directory = _Directory()
+        _directories[path] = directory
+    # Start watching before scanning so nothing slips in between
+    _watch(path)
+    watched = _watched(path)
+    now = time.time_ns()
+    mtime_ns = os.stat(path).st_mtime_ns
+    if directory.mtime_ns != mtime_ns:
+        files = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                old = directory.files.get(entry.name)
+                if old and old.inode == entry.inode():
+                    files[entry.name] = old
+                else:
+                    files[entry.name] = _File(entry.inode(), False)
+                    directory.dirty.add(entry.name)
+        directory.files = files
+        directory.mtime_ns = mtime_ns if now - mtime_ns > RACY_NS else None
+
+    # Permissions and contents can change without touching the directory, so
+    # without inotify to say otherwise every file has to be checked again
+    names = directory.dirty if watched else directory.files.keys()
+    for name in names:
+        file = directory.files.get(name)
+        if file:
+            file.readable = os.access(f'{path}/{name}', os.R_OK)
+            file.stat = None
+    directory.dirty = set()
+    return directory
+
+
+def list_logs(path: str) -> list[str]:
+    directory = _sync(path)
+    return [name for name, file in directory.files.items() if file.readable]
+
+
+def _stat(path: str, directory: _Directory, name: str) -> Optional[os.stat_result]:
+    file = directory.files.get(name)
+    if file is None:
+        return None
+    if file.stat is None:
+        try:
+            file.stat = os.stat(f'{path}/{name}')
+        except OSError:
+            return None
+    return file.stat
+
+
+def stat(path: str, name: str) -> Optional[os.stat_result]:
+    try:
+        directory = _sync(path)
+    except OSError:
+        return None
+    return _stat(path, directory, name)
+
+
+def entries(category: str, state: str) -> list[LogEntry]:
+    base = {
+        'pending': sls.pending,
+        'failed': sls.failed,
+        'uploaded': sls.uploaded,
+    }[state]
+    path = f'{base}/{category}'
+    try:
+        directory = _sync(path)
+    except OSError:
+        return []
+    logs = []
+    for name in list(directory.files):
+        if not directory.files[name].readable:
+            continue
+        st = _stat(path, directory, name)
+        if st is None:
+            continue
+        attempts = 0
+        if state == 'pending':
+            entry = sls.ledger.get(category, name)
+            if entry:
+                attempts = entry['attempts']
+        logs.append(LogEntry(name, st.st_size, st.st_mtime, state, attempts))
+    return logs
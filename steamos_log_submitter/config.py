@@ -4,11 +4,13 @@
 # Copyright (c) 2022-2023 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
 import configparser
+import io
 import logging
 import pwd
 from typing import Optional
 
 import steamos_log_submitter as sls
+import steamos_log_submitter.writeback as writeback
 from steamos_log_submitter.types import JSONEncodable
 
 __all__ = [
@@ -119,8 +121,14 @@ def reload_config() -> None:
 def write_config() -> None:
     if local_config_path is None:
         raise FileNotFoundError
-    with open(local_config_path, 'w') as f:
+    path = local_config_path
+
+    def write() -> None:
+        f = io.StringIO()
         local_config.write(f)
+        writeback.write_atomic(path, f.getvalue())
+
+    writeback.schedule('config', write)
 
 
 def migrate_key(section: str, key: str) -> bool:
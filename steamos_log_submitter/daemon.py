@@ -17,8 +17,12 @@ from collections.abc import Callable
 from typing import Optional
 
 import steamos_log_submitter as sls
+import steamos_log_submitter.catalog
 import steamos_log_submitter.dbus
+import steamos_log_submitter.inotify
+import steamos_log_submitter.metrics
 import steamos_log_submitter.runner
+import steamos_log_submitter.writeback
 from steamos_log_submitter.constants import DBUS_NAME, DBUS_ROOT
 from steamos_log_submitter.dbus import dbus
 from steamos_log_submitter.types import DBusEncodable
@@ -51,6 +55,8 @@ class Daemon:
     INTERVAL: float = 3600
     WAKEUP_DELAY: float = 10
     APPLIST_UPDATE_INTERVAL: float = 3600 * 24
+    NEW_LOG_DELAY: float = 5
+    NEW_LOG_MAX_DELAY: float = 30
 
     def __init__(self, *, exit_on_shutdown: bool = False):
         self._exit_on_shutdown = exit_on_shutdown
@@ -61,6 +67,11 @@ class Daemon:
         self._trigger_active = False
         self._next_trigger = 0.0
         self._iface: Optional[DaemonInterface] = None
+        self._watcher: Optional[sls.inotify.Watcher] = None
+        self._new_logs: dict[str, set[str]] = {}
+        self._last_new_log = 0.0
+        self._new_log_task: Optional[asyncio.Task[None]] = None
+        self._submitting_new_logs = False
 
     async def _trigger_periodic(self) -> None:
         gc.collect()
@@ -113,6 +124,106 @@ class Daemon:
             for service, iface in helper_module.child_services.items():
                 sls.dbus.system_bus.export(f'{DBUS_ROOT}/helpers/{camel_case}/{service}', iface)
 
+    def _start_watcher(self) -> None:
+        # Share the catalog's watcher instead of watching the same directories
+        # twice
+        self._watcher = sls.catalog.watch()
+        if not self._watcher:
+            logger.error('Failed to start watching for new logs')
+            return
+        self._watcher.listen(self._new_log, sls.inotify.IN_CLOSE_WRITE | sls.inotify.IN_MOVED_TO)
+        for helper in sls.helpers.list_helpers():
+            helper_module = sls.helpers.create_helper(helper)
+            if not helper_module:
+                continue
+            try:
+                self._watcher.add(f'{sls.pending}/{helper_module.name}')
+            except OSError as e:
+                logger.warning(f'Failed to watch for new {helper_module.name} logs: {e}')
+
+    def _new_log(self, path: str, name: str) -> None:
+        if not self._serving:
+            return
+        # The watcher is shared with the catalog, so it also sees lock files
+        # and logs being moved into failed/ and uploaded/
+        if os.path.dirname(path) != sls.pending:
+            return
+        category = os.path.basename(path)
+        helper = sls.helpers.create_helper(category)
+        if not helper or not helper.filter_log(name):
+            return
+        self._new_logs.setdefault(category, set()).add(name)
+        self._last_new_log = time.monotonic()
+        if not self._new_log_task:
+            self._new_log_task = asyncio.create_task(self._submit_new_logs())
+
+    async def _submit_new_logs(self) -> None:
+        # Wait for new files to stop showing up before submitting, but don't
+        # let a steady trickle of files postpone submission indefinitely
+        first = time.monotonic()
+        while True:
+            delay = min(self._last_new_log + self.NEW_LOG_DELAY, first + self.NEW_LOG_MAX_DELAY) - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        while self._trigger_active:
+            await asyncio.sleep(self.NEW_LOG_DELAY)
+
+        logs = self._new_logs
+        self._new_logs = {}
+        if not self._serving or self.inhibited() or not self.enabled():
+            self._new_log_task = None
+            return
+
+        self._submitting_new_logs = True
+        try:
+            pending: dict[str, list[str]] = {}
+            for category, names in logs.items():
+                helper = sls.helpers.create_helper(category)
+                if not helper:
+                    continue
+                present = [name for name in names if os.access(f'{sls.pending}/{category}/{name}', os.F_OK)]
+                if present:
+                    helper.announce(present)
+                    pending[category] = present
+            if pending:
+                logger.info('New logs found, submitting')
+                await sls.runner.submit(pending)
+        except asyncio.CancelledError:
+            # Put the logs back so they can be picked up again later
+            for category, names in logs.items():
+                self._new_logs.setdefault(category, set()).update(names)
+            raise
+        except Exception as e:
+            logger.critical('Unhandled exception while submitting new logs', exc_info=e)
+        finally:
+            self._submitting_new_logs = False
+            self._new_log_task = None
+            if self._new_logs and self._serving and self._suspend == 'inactive':
+                self._new_log_task = asyncio.create_task(self._submit_new_logs())
+
+    async def _cancel_new_logs(self) -> None:
+        task = self._new_log_task
+        if not task:
+            return
+        task.cancel()
+        await asyncio.wait([task])
+        self._new_log_task = None
+
+    async def _cancel_trigger(self) -> None:
+        task = self._async_trigger
+        if not task:
+            return
+        logger.info('Cancelling in-flight trigger')
+        task.cancel()
+        await asyncio.wait([task])
+        self._async_trigger = None
+
+    async def _wait_trigger(self, task: asyncio.Task[None]) -> None:
+        await asyncio.wait([task])
+        if not task.cancelled():
+            task.result()
+
     async def _leave_suspend(self, iface: str, prop: str, value: DBusEncodable) -> None:
         assert isinstance(value, str)
         if value == self._suspend:
@@ -126,11 +237,17 @@ class Daemon:
             await asyncio.sleep(self.WAKEUP_DELAY)
             await self._cancel_periodic()
             await self._update_schedule()
+            if self._new_logs and not self._new_log_task and self._serving:
+                self._new_log_task = asyncio.create_task(self._submit_new_logs())
+        else:
+            await self._cancel_new_logs()
+            await self._cancel_trigger()
 
     async def start(self) -> None:
         if self._serving:
             return
         logger.info('Daemon starting up')
+        sls.writeback.start()
         sls.config.upgrade()
         self._serving = True
 
@@ -153,6 +270,7 @@ class Daemon:
         self._setup_dbus()
 
         await sls.runner.startup()
+        self._start_watcher()
 
         try:
             suspend_target = sls.dbus.DBusObject('org.freedesktop.systemd1', '/org/freedesktop/systemd1/unit/suspend_2etarget')
@@ -164,10 +282,14 @@ class Daemon:
     async def shutdown(self) -> None:
         logger.info('Daemon shutting down')
         self._serving = False
-        if self._async_trigger:
-            await self._async_trigger
-            self._async_trigger = None
+        await self._cancel_new_logs()
+        self._new_logs = {}
+        await self._cancel_trigger()
         await self._cancel_periodic()
+        await sls.runner.shutdown()
+        sls.writeback.stop()
+        self._watcher = None
+        sls.catalog.unwatch()
 
         bus = sls.dbus.system_bus
         if bus:
@@ -196,22 +318,26 @@ class Daemon:
             self._async_trigger = None
             return
         self._trigger_active = True
-        collected, submitted = await sls.runner.trigger()
-        last_trigger = time.time()
-        config['last_trigger'] = last_trigger
-        sls.config.write_config()
-        self._next_trigger = last_trigger + self.INTERVAL
-        task = self._periodic_task
-        if self._serving:
-            self._periodic_task = asyncio.create_task(self._trigger_periodic())
-        if task:
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
-        self._trigger_active = False
-        self._async_trigger = None
+        try:
+            if self._submitting_new_logs and self._new_log_task:
+                await asyncio.wait([self._new_log_task])
+            collected, submitted = await sls.runner.trigger()
+            last_trigger = time.time()
+            config['last_trigger'] = last_trigger
+            sls.config.write_config()
+            self._next_trigger = last_trigger + self.INTERVAL
+            task = self._periodic_task
+            if self._serving:
+                self._periodic_task = asyncio.create_task(self._trigger_periodic())
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        finally:
+            self._trigger_active = False
+            self._async_trigger = None
 
     async def trigger(self, wait: bool = True) -> None:
         if self.inhibited() or not self.enabled():
@@ -223,18 +349,16 @@ class Daemon:
             if not stored_coro:
                 logger.error('Neither async trigger nor periodic trigger active. Who owns the trigger lock?')
                 return
-            await stored_coro
-            assert not self._trigger_active
+            await self._wait_trigger(stored_coro)
             return
         if self._async_trigger:
             if wait:
-                await self._async_trigger
+                await self._wait_trigger(self._async_trigger)
             return
-        coro = self._trigger()
+        # Always run the trigger in its own task so it can be cancelled
+        self._async_trigger = asyncio.create_task(self._trigger())
         if wait:
-            await coro
-        else:
-            self._async_trigger = asyncio.create_task(coro)
+            await self._wait_trigger(self._async_trigger)
 
     def enabled(self) -> bool:
         return sls.base_config.get('enable', 'off') == 'on'
@@ -322,6 +446,10 @@ class DaemonInterface(dbus.service.ServiceInterface):
     def Version(self) -> 's':  # type: ignore[name-defined] # NOQA: F821
         return sls.__version__
 
+    @dbus.service.dbus_property(access=dbus.constants.PropertyAccess.READ)
+    def Metrics(self) -> 'a{sd}':  # type: ignore[valid-type] # NOQA: F821, F722
+        return sls.metrics.snapshot()
+
     @dbus.service.dbus_property()
     @exc_wrap
     def Enabled(self) -> 'b':  # type: ignore[name-defined] # NOQA: F821
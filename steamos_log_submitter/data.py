@@ -6,17 +6,23 @@
 import json
 import logging
 import os
+import sqlite3
 import steamos_log_submitter as sls
+import steamos_log_submitter.writeback as writeback
+from collections.abc import Iterable
 from typing import Optional
 from steamos_log_submitter.types import JSONEncodable
 
 __all__ = [
+    'DataStore',
+    'SqliteDataStore',
     'get_data',
     'write_all',
 ]
 
 datastore: dict[str, 'DataStore'] = {}
 data_root: str
+_db: Optional[tuple[str, sqlite3.Connection]] = None
 
 logger = logging.getLogger(__name__)
 
@@ -27,16 +33,24 @@ class DataStore:
         self._defaults: dict[str, JSONEncodable] = defaults or {}
         self._data: dict[str, JSONEncodable] = {}
         self._dirty = False
+        self._load()
 
+    def _load(self) -> None:
+        self._load_json()
+
+    def _load_json(self) -> bool:
         try:
-            with open(f'{data_root}/{name}.json') as f:
+            with open(f'{data_root}/{self.name}.json') as f:
                 self._data = json.load(f)
         except FileNotFoundError:
             pass
         except OSError as e:
-            logger.warning(f'Could not load data file {name}: {e}')
+            logger.warning(f'Could not load data file {self.name}: {e}')
+            return False
         except (SyntaxError, KeyError) as e:
             logger.warning('Could not load data file', exc_info=e)
+            return False
+        return True
 
     def __getitem__(self, name: str) -> JSONEncodable:
         if name in self._data:
@@ -49,34 +63,126 @@ class DataStore:
         self._data[name] = value
         self._dirty = True
 
+    def __delitem__(self, name: str) -> None:
+        del self._data[name]
+        self._dirty = True
+
     def __contains__(self, name: str) -> bool:
         return name in self._data
 
+    def keys(self) -> Iterable[str]:
+        return self._data.keys()
+
     def get(self, name: str, default: Optional[JSONEncodable] = None) -> Optional[JSONEncodable]:
         try:
             return self[name]
         except KeyError:
             return default
 
-    def write(self) -> None:
+    def write(self, *, sync: bool = False) -> None:
+        if not self._dirty:
+            return
+        key = f'data:{self.name}'
+        if sync:
+            # Write it out now and let the caller handle any errors, instead
+            # of leaving it to be written later
+            writeback.cancel(key)
+            self._write()
+            return
+        writeback.schedule(key, self._write)
+
+    def _write(self) -> None:
         if not self._dirty:
             return
         os.makedirs(data_root, mode=0o750, exist_ok=True)
-        with open(f'{data_root}/{self.name}.json', 'w') as f:
-            json.dump(self._data, f)
+        writeback.write_atomic(f'{data_root}/{self.name}.json', json.dumps(self._data))
         self._dirty = False
 
     def add_defaults(self, defaults: dict[str, JSONEncodable]) -> None:
         self._defaults.update(defaults)
 
 
+class SqliteDataStore(DataStore):
+    # Keeps each store in its own table of a shared database, so writing only
+    # touches the keys that changed
+    def __init__(self, name: str, *, defaults: Optional[dict[str, JSONEncodable]] = {}):
+        self._changed: set[str] = set()
+        super().__init__(name, defaults=defaults)
+
+    @property
+    def _table(self) -> str:
+        return '"{}"'.format(self.name.replace('"', '""'))
+
+    def _load(self) -> None:
+        try:
+            db = _connect()
+            if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.name,)).fetchone():
+                self._data = {key: json.loads(value) for key, value in db.execute(f'SELECT key, value FROM {self._table}')}
+                return
+
+            # Migrate the old JSON file, if any, in the same transaction that
+            # creates the table so a crash can't leave it half imported. If it
+            # can't be read, leave it to be migrated next time instead
+            if not self._load_json():
+                return
+            with db:
+                db.execute(f'CREATE TABLE {self._table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                db.executemany(f'INSERT INTO {self._table} (key, value) VALUES (?, ?)',
+                               ((key, json.dumps(value)) for key, value in self._data.items()))
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f'Could not load data table {self.name}', exc_info=e)
+            return
+        try:
+            os.unlink(f'{data_root}/{self.name}.json')
+            logger.info(f'Migrated data file {self.name} to database')
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f'Could not remove migrated data file {self.name}: {e}')
+
+    def __setitem__(self, name: str, value: JSONEncodable) -> None:
+        super().__setitem__(name, value)
+        self._changed.add(name)
+
+    def __delitem__(self, name: str) -> None:
+        super().__delitem__(name)
+        self._changed.add(name)
+
+    def _write(self) -> None:
+        if not self._dirty:
+            return
+        try:
+            db = _connect()
+            with db:
+                for key in self._changed:
+                    if key in self._data:
+                        db.execute(f'INSERT INTO {self._table} (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                                   (key, json.dumps(self._data[key])))
+                    else:
+                        db.execute(f'DELETE FROM {self._table} WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            raise OSError(f'Could not write data table {self.name}: {e}') from e
+        self._changed = set()
+        self._dirty = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _db
+    path = f'{data_root}/data.sqlite3'
+    if _db is None or _db[0] != path:
+        if _db:
+            _db[1].close()
+        os.makedirs(data_root, mode=0o750, exist_ok=True)
+        db = sqlite3.connect(path)
+        db.execute('PRAGMA journal_mode=WAL')
+        _db = path, db
+    return _db[1]
+
+
 def write_all() -> None:
     os.makedirs(data_root, mode=0o750, exist_ok=True)
     for data in datastore.values():
-        try:
-            data.write()
-        except (OSError, TypeError, RecursionError) as e:
-            logger.error('Failed to write data to disk', exc_info=e)
+        data.write()
 
 
 def get_data(name: str, defaults: Optional[dict[str, JSONEncodable]] = None) -> DataStore:
@@ -86,7 +192,10 @@ def get_data(name: str, defaults: Optional[dict[str, JSONEncodable]] = None) ->
         name = name.split('.', 1)[1]
 
     if name not in datastore:
-        datastore[name] = DataStore(name, defaults=defaults)
+        if sls.base_config.get('data-backend') == 'sqlite':
+            datastore[name] = SqliteDataStore(name, defaults=defaults)
+        else:
+            datastore[name] = DataStore(name, defaults=defaults)
     elif defaults:
         datastore[name].add_defaults(defaults)
     return datastore[name]
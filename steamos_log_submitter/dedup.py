@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import hashlib
+import json
+import logging
+import random
+import time
+from collections.abc import Iterable, Mapping
+from typing import Optional, TypedDict
+
+import steamos_log_submitter as sls
+from steamos_log_submitter.types import JSONEncodable
+
+__all__ = [
+    'check',
+    'clear',
+    'entries',
+    'get',
+    'key',
+    'record_upload',
+    'write',
+]
+
+logger = logging.getLogger(__name__)
+
+# Entries that haven't been seen in this long are forgotten, even if some
+# duplicates were never reported
+MAX_AGE = 7 * 24 * 60 * 60
+
+
+class DedupEntry(TypedDict):
+    first_seen: float
+    last_seen: float
+    last_upload: float
+    suppressed: int
+    total: int
+
+
+def _data() -> sls.data.DataStore:
+    return sls.data.get_data(__name__)
+
+
+def key(fingerprint: Iterable[str], tags: Mapping[str, JSONEncodable], message: Optional[str] = None) -> Optional[str]:
+    fingerprint = sorted(fingerprint)
+    if not fingerprint and not tags and not message:
+        return None
+    blob = json.dumps({'fingerprint': fingerprint, 'tags': tags, 'message': message}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def entries(dsn: str) -> dict[str, DedupEntry]:
+    data = _data().get(dsn)
+    if not isinstance(data, dict):
+        return {}
+    parsed = {}
+    for fingerprint, entry in data.items():
+        if not isinstance(entry, dict):
+            logger.warning(f'Malformed deduplication entry {fingerprint}, ignoring')
+            continue
+        try:
+            parsed[str(fingerprint)] = DedupEntry(
+                first_seen=float(entry['first_seen']),
+                last_seen=float(entry['last_seen']),
+                last_upload=float(entry['last_upload']),
+                suppressed=int(entry['suppressed']),
+                total=int(entry['total']),
+            )
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f'Malformed deduplication entry {fingerprint}, ignoring')
+    return parsed
+
+
+def _store(dsn: str, index: dict[str, DedupEntry], now: float) -> None:
+    index = {fingerprint: entry for fingerprint, entry in index.items() if entry['last_seen'] + MAX_AGE > now}
+    if index:
+        _data()[dsn] = {fingerprint: {
+            'first_seen': entry['first_seen'],
+            'last_seen': entry['last_seen'],
+            'last_upload': entry['last_upload'],
+            'suppressed': entry['suppressed'],
+            'total': entry['total'],
+        } for fingerprint, entry in index.items()}
+    else:
+        clear(dsn)
+
+
+def get(dsn: str, fingerprint: str) -> Optional[DedupEntry]:
+    return entries(dsn).get(fingerprint)
+
+
+def check(dsn: str, fingerprint: str, window: float, sample_rate: float = 0, now: Optional[float] = None) -> Optional[int]:
+    if now is None:
+        now = time.time()
+    index = entries(dsn)
+    entry = index.get(fingerprint)
+    if entry is None:
+        entry = DedupEntry(first_seen=now, last_seen=now, last_upload=0, suppressed=0, total=0)
+    entry['last_seen'] = now
+    index[fingerprint] = entry
+
+    if now - entry['last_upload'] >= window or (sample_rate > 0 and random.random() < sample_rate):
+        _store(dsn, index, now)
+        return entry['suppressed']
+
+    entry['suppressed'] += 1
+    entry['total'] += 1
+    _store(dsn, index, now)
+    logger.info(f'Suppressing duplicate event {fingerprint[:12]}, {entry["suppressed"]} suppressed since last upload')
+    return None
+
+
+def record_upload(dsn: str, fingerprint: str, window: float, reported: int = 0, now: Optional[float] = None) -> None:
+    if now is None:
+        now = time.time()
+    index = entries(dsn)
+    entry = index.get(fingerprint)
+    if entry is None:
+        entry = DedupEntry(first_seen=now, last_seen=now, last_upload=0, suppressed=0, total=0)
+    # Sampled uploads inside the window don't restart it
+    if now - entry['last_upload'] >= window:
+        entry['last_upload'] = now
+    entry['suppressed'] = max(entry['suppressed'] - reported, 0)
+    entry['total'] += 1
+    index[fingerprint] = entry
+    _store(dsn, index, now)
+
+
+def clear(dsn: str) -> None:
+    data = _data()
+    if dsn in data:
+        del data[dsn]
+
+
+def write() -> None:
+    _data().write()
@@ -4,6 +4,7 @@
 # Copyright (c) 2023 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
 import abc
+import contextvars
 import enum
 import importlib
 import logging
@@ -18,13 +19,19 @@ from types import TracebackType
 from typing import Any, ClassVar, Optional, Type
 
 import steamos_log_submitter as sls
+import steamos_log_submitter.catalog
 import steamos_log_submitter.dbus
+import steamos_log_submitter.ledger
 import steamos_log_submitter.lockfile
+import steamos_log_submitter.ratelimit
 from steamos_log_submitter.constants import DBUS_NAME
 from steamos_log_submitter.daemon import DaemonInterface
 from steamos_log_submitter.dbus import dbus
 from steamos_log_submitter.types import JSONEncodable
 
+if typing.TYPE_CHECKING:
+    from steamos_log_submitter.aggregators.sentry import SentryEvent
+
 logger = logging.getLogger(__name__)
 
 
@@ -41,6 +48,19 @@ class HelperResult(enum.Enum):
         return HelperResult(false_code)
 
 
+# Why the log currently being submitted failed, so the retry ledger can
+# record more than just the result code
+_failure_reason: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('failure_reason', default=None)
+
+
+def set_failure_reason(reason: Optional[str]) -> None:
+    _failure_reason.set(reason)
+
+
+def failure_reason() -> Optional[str]:
+    return _failure_reason.get()
+
+
 class HelperInterface(dbus.service.ServiceInterface):
     def __init__(self, helper: Type['Helper']):
         super().__init__(f'{DBUS_NAME}.Helper')
@@ -87,6 +107,19 @@ class HelperInterface(dbus.service.ServiceInterface):
     def ListUploaded(self) -> 'as':  # type: ignore[valid-type] # NOQA: F821, F722
         return list(self.helper.list_uploaded())
 
+    @dbus.service.method()
+    def ListRetries(self) -> 'a{s(uuds)}':  # type: ignore[valid-type] # NOQA: F821, F722
+        retries = {}
+        # Only report logs that are still waiting to be retried, not ones the
+        # ledger hasn't been pruned of yet
+        for log in sls.catalog.entries(self.helper.name, 'pending'):
+            if not log.attempts:
+                continue
+            entry = sls.ledger.get(self.helper.name, log.name)
+            if entry:
+                retries[log.name] = [entry['attempts'], entry['timeouts'], entry['next_attempt'], entry['error']]
+        return retries
+
     @dbus.service.method()
     async def Extract(self, filename: 's', type: 's') -> 'h':  # type: ignore[name-defined] # NOQA: F821
         if filename[0] == '.' or '..' in filename:
@@ -134,6 +167,10 @@ class HelperInterface(dbus.service.ServiceInterface):
 class Helper(abc.ABC):
     defaults: ClassVar[Optional[dict[str, JSONEncodable]]] = None
     valid_extensions: ClassVar[Container[str]] = frozenset()
+    # Lower values are submitted first
+    default_priority: ClassVar[int] = 50
+    # Seconds allowed for submitting a single log, or None for no limit
+    default_timeout: ClassVar[Optional[float]] = 600
 
     __name__: str
     name: str
@@ -178,6 +215,10 @@ class Helper(abc.ABC):
 
     @classmethod
     async def collect(cls) -> list[str]:
+        return cls.announce(cls.list_pending())
+
+    @classmethod
+    def announce(cls, logs: Iterable[str]) -> list[str]:
         last_collected: Optional[float] = None
         newest: Optional[float] = None
         newer: list[str] = []
@@ -188,10 +229,9 @@ class Helper(abc.ABC):
         except ValueError:
             pass
 
-        for log in cls.list_pending():
-            try:
-                stat = os.stat(f'{sls.pending}/{cls.name}/{log}')
-            except OSError:
+        for log in logs:
+            stat = sls.catalog.stat(f'{sls.pending}/{cls.name}', log)
+            if stat is None:
                 cls.logger.warning(f'Failed to stat {log}, ignoring')
                 continue
             mtime = round(stat.st_mtime, 3)
@@ -249,6 +289,90 @@ class Helper(abc.ABC):
         if cls.iface:
             cls.iface.emit_properties_changed({'SubmitEnabled': enabled})
 
+    @classmethod
+    def rate_limited_until(cls) -> Optional[float]:
+        dsn = cls.config.get('dsn')
+        if not dsn:
+            return None
+        return sls.ratelimit.until(dsn)
+
+    @classmethod
+    def backend(cls) -> Optional[str]:
+        return cls.config.get('backend') or sls.base_config.get('backend') or None
+
+    @classmethod
+    def envelope_only(cls) -> bool:
+        return cls.config.get('envelope-only', 'on') == 'on'
+
+    @classmethod
+    def compression(cls) -> tuple[str, Optional[int]]:
+        name = cls.config.get('compression') or sls.base_config.get('compression') or 'auto'
+        name = name.lower()
+        value = cls.config.get('compression-level') or sls.base_config.get('compression-level')
+        if not value:
+            return name, None
+        try:
+            return name, int(value)
+        except ValueError:
+            cls.logger.warning(f'Invalid compression-level value for {cls.name}, ignoring')
+            return name, None
+
+    @classmethod
+    def dedup(cls) -> Optional[tuple[float, float]]:
+        window = cls._get_timeout('dedup-window', None)
+        if window is None:
+            return None
+        try:
+            sample_rate = float(cls.config.get('dedup-sample-rate') or sls.base_config.get('dedup-sample-rate') or 0)
+        except ValueError:
+            cls.logger.warning(f'Invalid dedup-sample-rate value for {cls.name}, ignoring')
+            sample_rate = 0
+        return window, min(max(sample_rate, 0), 1)
+
+    @classmethod
+    def create_event(cls) -> 'SentryEvent':
+        # The aggregators import this module, so this can't be imported above
+        from steamos_log_submitter.aggregators.sentry import SentryEvent
+        return SentryEvent.create(cls.config['dsn'], cls.backend(), envelope_only=cls.envelope_only(), compression=cls.compression(), dedup=cls.dedup())
+
+    @classmethod
+    def concurrency(cls) -> int:
+        try:
+            return max(int(cls.config.get('concurrency') or 1), 1)
+        except ValueError:
+            cls.logger.warning(f'Invalid concurrency value for {cls.name}, ignoring')
+            return 1
+
+    @classmethod
+    def priority(cls) -> int:
+        try:
+            return int(cls.config.get('priority') or cls.default_priority)
+        except ValueError:
+            cls.logger.warning(f'Invalid priority value for {cls.name}, ignoring')
+            return cls.default_priority
+
+    @classmethod
+    def _get_timeout(cls, key: str, default: Optional[float]) -> Optional[float]:
+        value = cls.config.get(key) or sls.base_config.get(key)
+        if not value:
+            return default
+        try:
+            timeout = float(value)
+        except ValueError:
+            cls.logger.warning(f'Invalid {key} value for {cls.name}, ignoring')
+            return default
+        if timeout <= 0:
+            return None
+        return timeout
+
+    @classmethod
+    def timeout(cls) -> Optional[float]:
+        return cls._get_timeout('timeout', cls.default_timeout)
+
+    @classmethod
+    def category_timeout(cls) -> Optional[float]:
+        return cls._get_timeout('category-timeout', None)
+
     @classmethod
     def lock(cls) -> sls.lockfile.Lockfile:
         return sls.lockfile.Lockfile(f'{sls.pending}/{cls.name}/.lock')
@@ -277,13 +401,20 @@ class Helper(abc.ABC):
     @classmethod
     def list_type(cls, base: str) -> Iterable[str]:
         try:
-            return (log for log in os.listdir(f'{base}/{cls.name}') if cls.filter_log(log) and os.access(f'{base}/{cls.name}/{log}', os.R_OK))
+            return (log for log in sls.catalog.list_logs(f'{base}/{cls.name}') if cls.filter_log(log))
         except OSError as e:
             cls.logger.error(f'Encountered error listing logs for {cls.name}: {e}')
             return ()
 
 
+_helpers: Optional[tuple[str, ...]] = None
+_registry: dict[str, Type[Helper]] = {}
+
+
 def create_helper(category: str) -> Optional[Type[Helper]]:
+    helper_class = _registry.get(category)
+    if helper_class:
+        return helper_class
     try:
         helper = importlib.import_module(f'steamos_log_submitter.helpers.{category}')
     except ModuleNotFoundError:
@@ -295,11 +426,23 @@ def create_helper(category: str) -> Optional[Type[Helper]]:
     if not helper.helper.is_setup:
         helper.helper.is_setup = helper.helper._setup()
     assert issubclass(helper.helper, Helper)
-    return typing.cast(Type[Helper], helper.helper)
+    helper_class = typing.cast(Type[Helper], helper.helper)
+    _registry[category] = helper_class
+    return helper_class
 
 
 def list_helpers() -> Iterable[str]:
-    return (helper.name for helper in pkgutil.iter_modules(__path__))
+    global _helpers
+    if _helpers is None:
+        _helpers = tuple(helper.name for helper in pkgutil.iter_modules(__path__))
+    return _helpers
+
+
+def reload_helpers() -> None:
+    global _helpers
+    _helpers = None
+    _registry.clear()
+    importlib.invalidate_caches()
 
 
 def validate_helpers(helpers: Iterable[str]) -> tuple[list[str], list[str]]:
@@ -8,22 +8,20 @@ import os
 import zipfile
 from . import Helper, HelperResult
 
-from steamos_log_submitter.aggregators.sentry import SentryEvent
-
 
 class DevcoredumpHelper(Helper):
     valid_extensions = frozenset({'.zip'})
+    default_priority = 30
 
     @classmethod
     async def submit(cls, fname: str) -> HelperResult:
-        event = SentryEvent(cls.config['dsn'])
+        event = cls.create_event()
+        event.add_attachment({
+            'mime-type': 'application/zip',
+            'filename': os.path.basename(fname),
+            'path': fname
+        })
         try:
-            with open(fname, 'rb') as f:
-                event.add_attachment({
-                    'mime-type': 'application/zip',
-                    'filename': os.path.basename(fname),
-                    'data': f.read()
-                })
             with zipfile.ZipFile(fname) as zf:
                 with zf.open('metadata.json') as f:
                     metadata_json = f.read()
@@ -41,7 +39,8 @@ class DevcoredumpHelper(Helper):
         event.add_attachment({
             'mime-type': 'application/json',
             'filename': 'metadata.json',
-            'data': metadata_json
+            'data': metadata_json,
+            'priority': 10,
         })
 
         if 'timestamp' in metadata:
@@ -10,13 +10,13 @@ from . import Helper, HelperResult
 
 import steamos_log_submitter as sls
 import steamos_log_submitter.dbus
-from steamos_log_submitter.aggregators.sentry import SentryEvent
 from steamos_log_submitter.dbus import dbus
 from steamos_log_submitter.types import JSONEncodable
 
 
 class EarlyoomHelper(Helper):
     valid_extensions = frozenset({'.json'})
+    default_priority = 40
 
     @classmethod
     def handle_log(cls, msg: dbus.Message) -> None:
@@ -39,7 +39,7 @@ class EarlyoomHelper(Helper):
     @classmethod
     async def submit(cls, fname: str) -> HelperResult:
         basename = os.path.basename(fname)
-        event = SentryEvent(cls.config['dsn'])
+        event = cls.create_event()
         try:
             with open(fname, 'rb') as f:
                 log = f.read()
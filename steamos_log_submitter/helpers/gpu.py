@@ -6,18 +6,18 @@
 import json
 import os
 import zipfile
-from steamos_log_submitter.aggregators.sentry import SentryEvent
 from . import Helper, HelperResult
 
 
 class GPUHelper(Helper):
     valid_extensions = frozenset({'.zip'})
+    default_priority = 20
 
     @classmethod
     async def submit(cls, fname: str) -> HelperResult:
         tags = {}
         fingerprint = []
-        event = SentryEvent(cls.config['dsn'])
+        event = cls.create_event()
         try:
             with zipfile.ZipFile(fname) as f:
                 with f.open('metadata.json') as zf:
@@ -25,10 +25,9 @@ class GPUHelper(Helper):
                     event.add_attachment({
                         'mime-type': 'application/json',
                         'filename': 'metadata.json',
-                        'data': metadata
+                        'data': metadata,
+                        'priority': 10,
                     })
-            with open(fname, 'rb') as f:
-                attachment = f.read()
         except zipfile.BadZipFile:
             return HelperResult.PERMANENT_ERROR
         except OSError:
@@ -86,7 +85,7 @@ class GPUHelper(Helper):
         event.add_attachment({
             'mime-type': 'application/zip',
             'filename': os.path.basename(fname),
-            'data': attachment
+            'path': fname
         })
         event.appid = appid
         event.timestamp = timestamp
@@ -8,7 +8,6 @@ import os
 from typing import Optional
 
 import steamos_log_submitter as sls
-from steamos_log_submitter.aggregators.sentry import SentryEvent
 from steamos_log_submitter.types import JSONEncodable
 
 from . import Helper, HelperResult
@@ -204,10 +203,7 @@ class JournalHelper(Helper):
         await cls.collect_inner(False)
         await cls.collect_inner(True)
 
-        try:
-            cls.data.write()
-        except OSError as e:
-            cls.logger.error(f'Failed writing updated cursor information: {e}')
+        cls.data.write()
 
         return await super().collect()
 
@@ -248,7 +244,7 @@ class JournalHelper(Helper):
                 line = bytes(line).decode(errors="replace")
             message.append(line)
 
-        event = SentryEvent(cls.config['dsn'])
+        event = cls.create_event()
         event.add_attachment({
             'mime-type': 'application/json',
             'filename': os.path.basename(fname),
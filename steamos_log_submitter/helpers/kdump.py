@@ -14,12 +14,12 @@ from typing import Optional, TextIO
 from . import Helper, HelperResult
 
 import steamos_log_submitter as sls
-from steamos_log_submitter.aggregators.sentry import SentryEvent
 from steamos_log_submitter.types import JSONEncodable
 
 
 class KdumpHelper(Helper):
     valid_extensions = frozenset({'.zip'})
+    default_priority = 10
     strip_re = re.compile(r'^(?:<\d>)?\[\s*\d+\.\d+\] ')
     frame_re = re.compile(r'(?P<q>\? )?(?:[0-9a-f]{4}:)?(?P<symbol>[_a-zA-Z][_a-zA-Z0-9.]*)\+(?P<offset>0x[0-9a-f]+)/(?P<size>0x[0-9a-f]+)(?: \[(?P<module>[_a-zA-Z0-9]+)(?: [0-9a-f]+)?\])?')
     rsp_re = re.compile(r'RSP: [0-9a-f]{4}:([0-9a-f]{16})')
@@ -174,7 +174,7 @@ class KdumpHelper(Helper):
     async def submit(cls, fname: str) -> HelperResult:
         name, _ = os.path.splitext(os.path.basename(fname))
         stack = []
-        event = SentryEvent(cls.config['dsn'])
+        event = cls.create_event()
         try:
             with zipfile.ZipFile(fname) as f:
                 for zname in f.namelist():
@@ -183,7 +183,8 @@ class KdumpHelper(Helper):
                         event.add_attachment({
                             'mime-type': 'text/plain',
                             'filename': zname,
-                            'data': data
+                            'data': data,
+                            'priority': 10,
                         })
                         if zname.startswith('version'):
                             event.tags['kernel'] = data.decode().strip()
@@ -200,8 +201,6 @@ class KdumpHelper(Helper):
                                     event.message = summary
                                     event.extra = metadata
                                 stack.extend(new_stack)
-            with open(fname, 'rb') as f:
-                attachment = f.read()
         except zipfile.BadZipFile:
             return HelperResult.PERMANENT_ERROR
         except OSError:
@@ -215,7 +214,7 @@ class KdumpHelper(Helper):
         event.add_attachment({
                 'mime-type': 'application/zip',
                 'filename': 'kdump.zip',
-                'data': attachment
+                'path': fname
             })
 
         pruned_stack = []
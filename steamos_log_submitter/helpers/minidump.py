@@ -3,15 +3,18 @@
 #
 # Copyright (c) 2022-2024 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
+import json
 import os
 import minidump.aminidumpfile  # type: ignore[import-untyped]
 import minidump.common_structs  # type: ignore[import-untyped]
 from minidump.exceptions import (  # type: ignore[import-untyped]
     MinidumpException, MinidumpHeaderSignatureMismatchException, MinidumpHeaderFlagsException)
-from typing import Final
+from typing import Final, Optional
 from . import Helper, HelperResult
 
 from steamos_log_submitter.aggregators.sentry import MinidumpEvent
+from steamos_log_submitter.types import JSONEncodable
 import steamos_log_submitter as sls
 
 # Extra stream types
@@ -32,6 +35,11 @@ MD_CRASHPAD_INFO_STREAM: Final[int] = 0x43500001
 
 class MinidumpHelper(Helper):
     valid_extensions = frozenset({'.md', '.dmp'})
+    default_priority = 30
+
+    @classmethod
+    def create_event(cls) -> MinidumpEvent:
+        return MinidumpEvent.create(cls.config['dsn'], cls.backend(), dedup=cls.dedup())
 
     @staticmethod
     def sanitize_environ(env: dict[str, str]) -> None:
@@ -48,24 +56,61 @@ class MinidumpHelper(Helper):
             for key, value in env.items():
                 env[key] = value.replace(user, '${USER}')
 
+    @staticmethod
+    def metadata_path(fname: str) -> str:
+        return os.path.join(os.path.dirname(fname), f'.{os.path.basename(fname)}.json')
+
     @classmethod
-    async def submit(cls, fname: str) -> HelperResult:
-        name, _ = os.path.splitext(os.path.basename(fname))
-        name_parts = name.split('-')
+    def load_metadata(cls, fname: str, stat: os.stat_result) -> Optional[dict[str, JSONEncodable]]:
+        try:
+            with open(cls.metadata_path(fname), 'rb') as f:
+                metadata = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            cls.logger.warning(f'Failed to load cached minidump metadata, ignoring: {e}')
+            return None
+        # Make sure the minidump wasn't replaced since it was parsed
+        if not isinstance(metadata, dict) or metadata.get('size') != stat.st_size or metadata.get('mtime') != stat.st_mtime_ns:
+            return None
+        extra = metadata.get('extra')
+        if not isinstance(extra, dict):
+            return None
+        return extra
 
-        event = MinidumpEvent(cls.config['dsn'])
+    @classmethod
+    def save_metadata(cls, fname: str, stat: os.stat_result, extra: dict[str, JSONEncodable]) -> None:
         try:
-            event.appid = int(name_parts[-1])
-        except ValueError:
-            # Invalid appid
+            with open(cls.metadata_path(fname), 'wb') as f:
+                f.write(json.dumps({'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'extra': extra}).encode())
+        except OSError as e:
+            cls.logger.warning(f'Failed to cache minidump metadata: {e}')
+
+    @classmethod
+    def remove_metadata(cls, fname: str) -> None:
+        try:
+            os.unlink(cls.metadata_path(fname))
+        except FileNotFoundError:
             pass
+        except OSError as e:
+            cls.logger.warning(f'Failed to remove cached minidump metadata: {e}')
 
-        for attr in ('executable', 'comm', 'path', 'build_id', 'pkgname', 'pkgver'):
-            try:
-                event.tags[attr] = os.getxattr(fname, f'user.{attr}').decode(errors='replace')
-            except OSError:
-                cls.logger.warning(f'Failed to get {attr} xattr on minidump.')
+    @classmethod
+    async def collect(cls) -> list[str]:
+        # Clean up cached metadata for minidumps that have gone away
+        try:
+            names = set(os.listdir(f'{sls.pending}/{cls.name}'))
+        except OSError as e:
+            cls.logger.error(f'Encountered error listing logs for {cls.name}: {e}')
+            names = set()
+        for name in names:
+            if name.startswith('.') and name.endswith('.json') and name[1:-len('.json')] not in names:
+                cls.remove_metadata(f'{sls.pending}/{cls.name}/{name[1:-len(".json")]}')
+        return await super().collect()
 
+    @classmethod
+    async def parse_minidump(cls, fname: str) -> dict[str, JSONEncodable]:
+        extra: dict[str, JSONEncodable] = {}
         try:
             mf = await minidump.aminidumpfile.AMinidumpFile.parse(fname)
 
@@ -77,7 +122,7 @@ class MinidumpHelper(Helper):
                     loc = await minidump.common_structs.MINIDUMP_LOCATION_DESCRIPTOR.aparse(mf.file_handle)
                     await mf.file_handle.seek(loc.Rva)
                     cmdline = await mf.file_handle.read(loc.DataSize)
-                    event.extra['cmdline'] = [arg.decode(errors='replace') for arg in cmdline.split(b'\0')]
+                    extra['cmdline'] = [arg.decode(errors='replace') for arg in cmdline.split(b'\0')]
                 elif type_value == MD_LINUX_ENVIRON:
                     loc = await minidump.common_structs.MINIDUMP_LOCATION_DESCRIPTOR.aparse(mf.file_handle)
                     await mf.file_handle.seek(loc.Rva)
@@ -94,7 +139,7 @@ class MinidumpHelper(Helper):
                                 continue
                             env[key.decode(errors='replace')] = value.decode(errors='replace')
                         cls.sanitize_environ(env)
-                        event.extra['environ'] = env
+                        extra['environ'] = env
                 elif type_value == MD_LINUX_MAPS:
                     loc = await minidump.common_structs.MINIDUMP_LOCATION_DESCRIPTOR.aparse(mf.file_handle)
                     await mf.file_handle.seek(loc.Rva)
@@ -106,15 +151,50 @@ class MinidumpHelper(Helper):
                         if len(mapped) < 6:
                             continue
                         mapped_files.append(mapped[5])
-                    packages = sls.util.get_paths_packages(mapped_files)
+                    # pacman can be slow, so don't block the event loop on it
+                    packages = await asyncio.to_thread(sls.util.get_paths_packages, mapped_files)
                     if packages:
-                        event.extra['packages'] = packages
+                        extra['packages'] = packages
         except (MinidumpException, MinidumpHeaderSignatureMismatchException, MinidumpHeaderFlagsException) as e:
             cls.logger.warning(f"Couldn't parse minidump, skipping extra data: {e}")
+        return extra
 
-        cls.logger.debug(f'Uploading minidump {fname}')
+    @classmethod
+    async def submit(cls, fname: str) -> HelperResult:
+        name, _ = os.path.splitext(os.path.basename(fname))
+        name_parts = name.split('-')
+
+        event = cls.create_event()
         try:
-            with open(fname, 'rb') as f:
-                return HelperResult.check(await event.send_minidump(f))
+            event.appid = int(name_parts[-1])
         except ValueError:
-            return HelperResult.PERMANENT_ERROR
+            # Invalid appid
+            pass
+
+        for attr in ('executable', 'comm', 'path', 'build_id', 'pkgname', 'pkgver'):
+            try:
+                event.tags[attr] = os.getxattr(fname, f'user.{attr}').decode(errors='replace')
+            except OSError:
+                cls.logger.warning(f'Failed to get {attr} xattr on minidump.')
+
+        try:
+            stat: Optional[os.stat_result] = os.stat(fname)
+        except OSError:
+            stat = None
+        # Parsing the minidump and looking up packages is slow, so keep the
+        # results around in case the upload needs to be retried
+        extra = cls.load_metadata(fname, stat) if stat else None
+        if extra is None:
+            extra = await cls.parse_minidump(fname)
+            if stat:
+                cls.save_metadata(fname, stat, extra)
+        else:
+            cls.logger.debug(f'Using cached metadata for minidump {fname}')
+        event.extra.update(extra)
+
+        cls.logger.debug(f'Uploading minidump {fname}')
+        with open(fname, 'rb') as f:
+            result = await event.send_minidump(f)
+        if result != HelperResult.TRANSIENT_ERROR:
+            cls.remove_metadata(fname)
+        return result
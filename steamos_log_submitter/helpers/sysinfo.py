@@ -55,6 +55,7 @@ class SysinfoType:
 class SysinfoHelper(Helper):
     version = 1
     valid_extensions = frozenset({'.json'})
+    default_priority = 70
     defaults = {'timestamp': None}
 
     device_types: dict[str, Type[SysinfoType]] = {}
@@ -128,10 +129,7 @@ class SysinfoHelper(Helper):
 
         if not timestamp or new_file:
             cls.data['timestamp'] = now
-            try:
-                cls.data.write()
-            except OSError as e:
-                cls.logger.error(f'Failed writing updated timestamp information: {e}')
+            cls.data.write()
 
         return await super().collect()
 
@@ -6,11 +6,11 @@
 import logging
 import os
 import random
-import shutil
+from typing import ClassVar, Optional
 from . import Helper, HelperResult
 
 import steamos_log_submitter as sls
-from steamos_log_submitter.aggregators.sentry import SentryEvent
+from steamos_log_submitter.aggregators.resumable import DEFAULT_CHUNK_SIZE, ResumableUpload, UploadState
 from steamos_log_submitter.constants import DBUS_NAME
 from steamos_log_submitter.dbus import dbus
 from steamos_log_submitter.types import JSONEncodable
@@ -20,20 +20,110 @@ logger = logging.getLogger(__name__)
 
 class SysreportHelper(Helper):
     valid_extensions = frozenset({'.zip'})
+    default_priority = 90
+    # System reports can be very large and are requested by the user
+    default_timeout = None
     alphabet = '34679ABEHJKLMNPSTUWXYZ'
+    report_iface: ClassVar[Optional['SysreportInterface']] = None
 
     @classmethod
     def _setup(cls) -> bool:
         if not super()._setup():
             return False
-        cls.extra_ifaces.append(SysreportInterface())
+        cls.report_iface = SysreportInterface()
+        cls.extra_ifaces.append(cls.report_iface)
         return True
 
+    @classmethod
+    def dedup(cls) -> None:
+        # Every report was asked for, so none of them should be dropped
+        return None
+
     @classmethod
     def make_id(cls) -> str:
         id = random.choices(cls.alphabet, k=8)
         return ''.join(id[:4]) + '-' + ''.join(id[4:])
 
+    @classmethod
+    def upload_url(cls) -> Optional[str]:
+        return cls.config.get('upload-url') or None
+
+    @classmethod
+    def chunk_size(cls) -> int:
+        try:
+            return max(int(cls.config.get('upload-chunk-size') or DEFAULT_CHUNK_SIZE), 1)
+        except ValueError:
+            cls.logger.warning(f'Invalid upload-chunk-size value for {cls.name}, ignoring')
+            return DEFAULT_CHUNK_SIZE
+
+    @classmethod
+    def report_progress(cls, id: str, sent: int, total: int) -> None:
+        if cls.report_iface:
+            cls.report_iface.Progress(id, sent, total)
+
+    @classmethod
+    def _uploads(cls) -> dict[str, dict[str, JSONEncodable]]:
+        uploads = cls.data.get('uploads')
+        if not isinstance(uploads, dict):
+            return {}
+        return {id: upload for id, upload in uploads.items() if isinstance(upload, dict)}
+
+    @classmethod
+    def _store_upload(cls, id: str, upload: Optional[dict[str, JSONEncodable]]) -> None:
+        uploads = cls._uploads()
+        if upload is not None:
+            uploads[id] = upload
+        elif id in uploads:
+            del uploads[id]
+        else:
+            return
+        cls.data['uploads'] = uploads
+        # The offset needs to survive restarts for the upload to be resumable
+        try:
+            cls.data.write(sync=True)
+        except OSError as e:
+            cls.logger.error(f'Failed to save upload state: {e}')
+
+    @classmethod
+    def _find_upload(cls, path: str) -> Optional[str]:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        source = os.path.realpath(path)
+        for id, upload in cls._uploads().items():
+            if upload.get('source') == source and upload.get('mtime_ns') == mtime_ns:
+                return id
+        return None
+
+    @classmethod
+    def _prune_uploads(cls) -> None:
+        for id in cls._uploads():
+            if not os.access(f'{sls.pending}/{cls.name}/{id}.zip', os.F_OK) and not os.access(f'{sls.failed}/{cls.name}/{id}.zip', os.F_OK):
+                cls._store_upload(id, None)
+
+    @classmethod
+    async def _upload_report(cls, id: str, fname: str, url: str) -> tuple[HelperResult, Optional[str]]:
+        upload = cls._uploads().get(id, {})
+        location = upload.get('location')
+        offset = upload.get('offset')
+        size = upload.get('size')
+        state = None
+        if isinstance(location, str) and isinstance(offset, int) and isinstance(size, int):
+            state = UploadState(location=location, offset=offset, size=size)
+
+        def progress(state: UploadState) -> None:
+            upload['location'] = state['location']
+            upload['offset'] = state['offset']
+            upload['size'] = state['size']
+            cls._store_upload(id, upload)
+            cls.report_progress(id, state['offset'], state['size'])
+
+        uploader = ResumableUpload(url, fname, state=state, chunk_size=cls.chunk_size(),
+                                   metadata={'filename': f'{id}.zip', 'friendly_id': id}, progress=progress)
+        result = await uploader.upload()
+        return result, uploader.state['location'] if uploader.state else None
+
     @classmethod
     async def submit(cls, fname: str) -> HelperResult:
         id, _ = os.path.splitext(os.path.basename(fname))
@@ -42,31 +132,69 @@ class SysreportHelper(Helper):
             'friendly_id': id
         }
 
-        try:
-            with open(fname, 'rb') as f:
-                attachment = f.read()
-        except OSError:
-            return HelperResult.TRANSIENT_ERROR
-
-        event = SentryEvent(cls.config['dsn'])
-        event.add_attachment({
-            'mime-type': 'application/zip',
-            'filename': 'report.zip',
-            'data': attachment
-        })
+        event = cls.create_event()
+        url = cls.upload_url()
+        size = None
+        if url:
+            # Large reports are uploaded separately in chunks so an interrupted
+            # upload doesn't need to start over, and the event links to it
+            result, location = await cls._upload_report(id, fname, url)
+            if result != HelperResult.OK:
+                if result == HelperResult.PERMANENT_ERROR:
+                    cls._store_upload(id, None)
+                return result
+            event.extra['sls.report_url'] = location
+        else:
+            try:
+                size = os.path.getsize(fname)
+            except OSError as e:
+                cls.logger.error(f'Failed to read report {id}: {e}')
+                return HelperResult.TRANSIENT_ERROR
+            cls.report_progress(id, 0, size)
+            event.add_attachment({
+                'mime-type': 'application/zip',
+                'filename': 'report.zip',
+                'path': fname,
+                'required': True,
+            })
         event.tags = tags
         event.message = f'System report {id}'
-        return await event.send()
+        result = await event.send()
+        if result != HelperResult.TRANSIENT_ERROR:
+            cls._store_upload(id, None)
+        if result == HelperResult.OK and size is not None:
+            cls.report_progress(id, size, size)
+        return result
 
     @classmethod
     async def send_report(cls, path: str) -> str | HelperResult:
         if not path.endswith('.zip'):
             return HelperResult.PERMANENT_ERROR
 
-        id = cls.make_id()
+        id = None
+        if cls.upload_url():
+            cls._prune_uploads()
+            id = cls._find_upload(path)
+        try:
+            if id:
+                cls.logger.info(f'Resuming upload of report {id}')
+                new_path = f'{sls.pending}/{cls.name}/{id}.zip'
+                try:
+                    # Reuse the copy from the last attempt, which the upload state refers to
+                    os.replace(f'{sls.failed}/{cls.name}/{id}.zip', new_path)
+                except FileNotFoundError:
+                    sls.util.copy_file(path, new_path)
+            else:
+                id = cls.make_id()
+                new_path = f'{sls.pending}/{cls.name}/{id}.zip'
+                mtime_ns = os.stat(path).st_mtime_ns
+                sls.util.copy_file(path, new_path)
+                if cls.upload_url():
+                    cls._store_upload(id, {'source': os.path.realpath(path), 'mtime_ns': mtime_ns})
+        except ValueError as e:
+            cls.logger.error(f'Refusing to send report: {e}')
+            return HelperResult.PERMANENT_ERROR
         name = f'{id}.zip'
-        new_path = f'{sls.pending}/{cls.name}/{name}'
-        shutil.copyfile(path, new_path)
 
         result = (await sls.runner.submit_category(cls, [name])).get(name)
         if isinstance(result, HelperResult) and result == HelperResult.OK:
@@ -100,3 +228,7 @@ class SysreportInterface(dbus.service.ServiceInterface):
         if isinstance(result, str):
             return result
         sls.helpers.raise_dbus_error(result)
+
+    @dbus.service.signal()
+    def Progress(self, id: str, sent: int, total: int) -> 'stt':  # type: ignore[name-defined] # NOQA: F821
+        return [id, sent, total]
@@ -12,7 +12,6 @@ from collections.abc import Iterable
 from typing import Final, Optional, Self
 
 import steamos_log_submitter as sls
-from steamos_log_submitter.aggregators.sentry import SentryEvent
 from steamos_log_submitter.constants import DBUS_NAME
 from steamos_log_submitter.dbus import dbus
 from steamos_log_submitter.types import DBusEncodable, JSONEncodable
@@ -76,7 +75,7 @@ class TraceHelper(Helper):
     @classmethod
     async def submit(cls, fname: str) -> HelperResult:
         basename = os.path.basename(fname)
-        event = SentryEvent(cls.config['dsn'])
+        event = cls.create_event()
         try:
             with open(fname, 'rb') as f:
                 log = f.read()
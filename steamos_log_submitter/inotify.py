@@ -0,0 +1,155 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
+import ctypes
+import logging
+import os
+import struct
+from collections.abc import Callable
+from typing import Optional
+
+__all__ = [
+    'IN_ATTRIB',
+    'IN_CLOSE_WRITE',
+    'IN_DELETE',
+    'IN_MOVED_FROM',
+    'IN_MOVED_TO',
+    'Watcher',
+]
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT = struct.Struct('iIII')
+
+logger = logging.getLogger(__name__)
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _get_libc() -> ctypes.CDLL:
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+
+def _check(ret: int) -> int:
+    if ret < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return ret
+
+
+class Watcher:
+    def __init__(self, callback: Callable[[str, str], None], mask: int = IN_CLOSE_WRITE | IN_MOVED_TO,
+                 overflow: Optional[Callable[[], None]] = None):
+        self._listeners = [(callback, mask)]
+        self._mask = mask
+        self._overflow = overflow
+        self._fd: Optional[int] = None
+        self._watches: dict[int, str] = {}
+        self._paths: dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        if self._fd is not None:
+            return
+        self._fd = _check(_get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._fd, self._read)
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        if self._loop:
+            self._loop.remove_reader(self._fd)
+            self._loop = None
+        os.close(self._fd)
+        self._fd = None
+        self._watches = {}
+        self._paths = {}
+
+    def listen(self, callback: Callable[[str, str], None], mask: int) -> None:
+        self._listeners.append((callback, mask))
+        if mask & ~self._mask:
+            self._mask |= mask
+            # Adding a watch again replaces its mask, so existing watches pick
+            # up the new events too
+            for path in self.paths:
+                self.add(path)
+
+    def add(self, path: str) -> None:
+        assert self._fd is not None
+        wd = _check(_get_libc().inotify_add_watch(self._fd, os.fsencode(path), self._mask | IN_ONLYDIR))
+        self._watches[wd] = path
+        self._paths[path] = wd
+
+    def remove(self, path: str) -> None:
+        assert self._fd is not None
+        wd = self._paths.pop(path, None)
+        if wd is None:
+            return
+        del self._watches[wd]
+        try:
+            _check(_get_libc().inotify_rm_watch(self._fd, wd))
+        except OSError as e:
+            logger.debug(f'Failed to remove watch on {path}: {e}')
+
+    @property
+    def paths(self) -> list[str]:
+        return list(self._paths)
+
+    def watching(self, path: str) -> bool:
+        return path in self._paths
+
+    def _read(self) -> None:
+        assert self._fd is not None
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error(f'Failed to read inotify events: {e}')
+            return
+
+        offset = 0
+        while offset + _EVENT.size <= len(buffer):
+            wd, mask, _, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('inotify event queue overflowed, some new files may have been missed')
+                if self._overflow:
+                    self._overflow()
+                continue
+            path = self._watches.get(wd)
+            if path is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                self._paths.pop(path, None)
+                continue
+            if not name:
+                continue
+            for callback, listener_mask in self._listeners:
+                if not mask & listener_mask:
+                    continue
+                try:
+                    callback(path, name)
+                except Exception as e:
+                    logger.error(f'Encountered error handling new file {path}/{name}', exc_info=e)
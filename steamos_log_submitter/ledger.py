@@ -0,0 +1,128 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import logging
+import time
+from collections.abc import Container
+from typing import Optional, TypedDict
+
+import steamos_log_submitter as sls
+
+__all__ = [
+    'clear',
+    'eligible',
+    'entries',
+    'get',
+    'prune',
+    'record_failure',
+    'write',
+]
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerEntry(TypedDict):
+    attempts: int
+    timeouts: int
+    last_attempt: float
+    next_attempt: float
+    error: str
+
+
+def _data() -> sls.data.DataStore:
+    return sls.data.get_data(__name__)
+
+
+def _backoff(attempts: int) -> float:
+    try:
+        base = float(sls.base_config.get('retry-backoff') or 900)
+        limit = float(sls.base_config.get('retry-backoff-max') or 86400)
+    except ValueError:
+        logger.warning('Invalid retry backoff configuration, using defaults')
+        base = 900
+        limit = 86400
+    return min(base * (1 << min(max(attempts - 1, 0), 32)), limit)
+
+
+def get(helper: str, log: str) -> Optional[LedgerEntry]:
+    entry = _data().get(f'{helper}/{log}')
+    if not isinstance(entry, dict):
+        return None
+    try:
+        return {
+            'attempts': int(entry['attempts']),
+            'timeouts': int(entry.get('timeouts', 0)),
+            'last_attempt': float(entry['last_attempt']),
+            'next_attempt': float(entry['next_attempt']),
+            'error': str(entry.get('error', '')),
+        }
+    except (KeyError, TypeError, ValueError):
+        logger.warning(f'Malformed retry ledger entry for {helper}/{log}, ignoring')
+        return None
+
+
+def eligible(helper: str, log: str, now: Optional[float] = None) -> bool:
+    entry = get(helper, log)
+    if entry is None:
+        return True
+    if now is None:
+        now = time.time()
+    return entry['next_attempt'] <= now
+
+
+def record_failure(helper: str, log: str, error: str, *, timeout: bool = False) -> LedgerEntry:
+    now = time.time()
+    previous = get(helper, log)
+    attempts = previous['attempts'] + 1 if previous else 1
+    timeouts = previous['timeouts'] if previous else 0
+    if timeout:
+        timeouts += 1
+    entry: LedgerEntry = {
+        'attempts': attempts,
+        'timeouts': timeouts,
+        'last_attempt': now,
+        'next_attempt': now + _backoff(attempts),
+        'error': error,
+    }
+    _data()[f'{helper}/{log}'] = {
+        'attempts': entry['attempts'],
+        'timeouts': entry['timeouts'],
+        'last_attempt': entry['last_attempt'],
+        'next_attempt': entry['next_attempt'],
+        'error': entry['error'],
+    }
+    logger.debug(f'Log {helper}/{log} has failed {attempts} time(s), backing off until {entry["next_attempt"]:.0f}')
+    return entry
+
+
+def clear(helper: str, log: str) -> None:
+    data = _data()
+    if f'{helper}/{log}' in data:
+        del data[f'{helper}/{log}']
+
+
+def entries(helper: str) -> dict[str, LedgerEntry]:
+    prefix = f'{helper}/'
+    logs = {}
+    for key in list(_data().keys()):
+        if not key.startswith(prefix):
+            continue
+        log = key[len(prefix):]
+        entry = get(helper, log)
+        if entry is not None:
+            logs[log] = entry
+    return logs
+
+
+def prune(helper: str, logs: Container[str]) -> None:
+    prefix = f'{helper}/'
+    data = _data()
+    for key in list(data.keys()):
+        if key.startswith(prefix) and key[len(prefix):] not in logs:
+            del data[key]
+
+
+def write() -> None:
+    _data().write()
@@ -3,19 +3,24 @@
 #
 # Copyright (c) 2022 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
+import fcntl
 import logging
 import os
 import time
 from types import TracebackType
 from typing import Optional, TextIO, Type
+import steamos_log_submitter.metrics as metrics
 from steamos_log_submitter.exceptions import LockHeldError, LockNotHeldError
 
 logger = logging.getLogger(__name__)
 
 
 class Lockfile:
-    def __init__(self, path: str):
+    def __init__(self, path: str, timeout: float = 0):
         self._path = path
+        self._timeout = timeout
+        self._locked_at: Optional[float] = None
         self.lockfile: Optional[TextIO] = None
 
     def __enter__(self) -> 'Lockfile':
@@ -26,54 +31,73 @@ class Lockfile:
         self.unlock()
         return not exc_type
 
+    async def __aenter__(self) -> 'Lockfile':
+        await self.acquire(self._timeout)
+        return self
+
+    async def __aexit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
+        self.unlock()
+        return not exc_type
+
+    def _try_lock(self) -> bool:
+        while True:
+            lockfile = open(self._path, 'a+')
+            try:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lockfile.close()
+                return False
+            except BaseException:
+                lockfile.close()
+                raise
+            # The previous holder unlinks the lock before releasing it, so make
+            # sure what we locked is still the lockfile and not an orphan
+            try:
+                pathstat = os.stat(self._path)
+            except FileNotFoundError:
+                pathstat = None
+            lockstat = os.fstat(lockfile.fileno())
+            if pathstat and (lockstat.st_ino, lockstat.st_dev) == (pathstat.st_ino, pathstat.st_dev):
+                break
+            lockfile.close()
+
+        # Anything left in the file is from a holder that has gone away, since
+        # the kernel drops the lock with its last open file
+        lockfile.truncate(0)
+        # Store the /proc info on this lock in the file for easy lookup
+        lockfile.write(f'/proc/{os.getpid()}/fd/{lockfile.fileno()}')
+        lockfile.flush()
+        self.lockfile = lockfile
+        self._locked_at = time.monotonic()
+        return True
+
     def lock(self) -> None:
         logger.debug(f'Attempting to get lock on {self._path}')
         if self.lockfile:
             logger.debug(f'Lock on {self._path} already held, bailing out')
             return
-        while not self.lockfile:
-            try:
-                self.lockfile = open(self._path, 'x')
-            except FileExistsError:
-                # The lock exists...let's figure out if it's stale
-                logger.debug(f'Lockfile {self._path} already exists, testing staleness')
-                try:
-                    lockfile = open(self._path, 'r')
-                except FileNotFoundError:
-                    # The lock was just deleted
-                    continue
-                lockinfo = None
-                for _ in range(3):
-                    # There is a slight race condition if the lock has been opened
-                    # but the file info hasn't been written yet--let's try a few
-                    # times to get that info before giving up
-                    lockinfo = lockfile.read()
-                    if lockinfo:
-                        break
-                    time.sleep(0.01)
-                lockfile.close()
-                if lockinfo is None:
-                    # Couldn't get info about the lock...let's assume it's held
-                    logger.warning(f'Failed to read lockfile {self._path}, assuming held')
-                    raise LockHeldError
-                if lockinfo.startswith('/proc/'):
-                    pathstat = os.stat(self._path)
-                    try:
-                        lockstat = os.stat(lockinfo.strip())
-                        if (lockstat.st_ino, lockstat.st_dev) == (pathstat.st_ino, pathstat.st_dev):
-                            # The lock is currently held
-                            raise LockHeldError(f'Lock on {self._path} is already held')
-                    except (FileNotFoundError, PermissionError):
-                        pass
-                # The lock is stale, clean it up
-                logger.debug(f'Lockfile {self._path} appears to be stale, taking it')
-                self.lockfile = open(self._path, 'w')
-
-        # Store the /proc info on this lock in the file for easy lookup
-        self.lockfile.write(f'/proc/{os.getpid()}/fd/{self.lockfile.fileno()}')
-        self.lockfile.flush()
+        if not self._try_lock():
+            metrics.increment('lockfile.contended')
+            raise LockHeldError(f'Lock on {self._path} is already held')
         logger.debug(f'Lock on {self._path} obtained')
 
+    async def acquire(self, timeout: Optional[float] = None, *, delay: float = 0.01, max_delay: float = 0.5) -> None:
+        # flock has no way to be woken up asynchronously, so poll instead of
+        # blocking the event loop while waiting
+        start = time.monotonic()
+        try:
+            while True:
+                try:
+                    self.lock()
+                    return
+                except LockHeldError:
+                    if timeout is not None and time.monotonic() - start + delay > timeout:
+                        raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        finally:
+            metrics.observe('lockfile.wait', time.monotonic() - start)
+
     def unlock(self) -> None:
         if not self.lockfile:
             raise LockNotHeldError(f'Lock on {self._path} not held')
@@ -81,6 +105,9 @@ class Lockfile:
         os.unlink(self._path)
         self.lockfile.close()
         self.lockfile = None
+        if self._locked_at is not None:
+            metrics.observe('lockfile.held', time.monotonic() - self._locked_at)
+            self._locked_at = None
         logger.debug(f'Lock on {self._path} released')
 
 
@@ -102,3 +129,10 @@ class LockRetry:
     def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
         self.lock.unlock()
         return not exc_type
+
+    async def __aenter__(self) -> None:
+        await self.lock.acquire((self._attempts - 1) * self._delay, delay=self._delay, max_delay=self._delay)
+
+    async def __aexit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
+        self.lock.unlock()
+        return not exc_type
@@ -0,0 +1,38 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+
+__all__ = [
+    'get',
+    'increment',
+    'observe',
+    'reset',
+    'snapshot',
+]
+
+# Metrics only live as long as the daemon does, so they're kept in memory
+_values: dict[str, float] = {}
+
+
+def increment(name: str, amount: float = 1) -> None:
+    _values[name] = _values.get(name, 0) + amount
+
+
+def observe(name: str, seconds: float) -> None:
+    increment(f'{name}.count')
+    increment(f'{name}.seconds', seconds)
+    _values[f'{name}.max'] = max(_values.get(f'{name}.max', 0), seconds)
+
+
+def get(name: str) -> float:
+    return _values.get(name, 0)
+
+
+def snapshot() -> dict[str, float]:
+    return dict(_values)
+
+
+def reset() -> None:
+    _values.clear()
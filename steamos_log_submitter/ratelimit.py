@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import logging
+import time
+from collections.abc import Iterable
+from typing import Optional
+
+import steamos_log_submitter as sls
+
+__all__ = [
+    'ALL',
+    'CATEGORIES',
+    'clear',
+    'limit',
+    'until',
+    'write',
+]
+
+logger = logging.getLogger(__name__)
+
+# An empty category applies to every category
+ALL = ''
+CATEGORIES = ('error', 'attachment')
+
+
+def _data() -> sls.data.DataStore:
+    return sls.data.get_data(__name__)
+
+
+def _limits(dsn: str) -> dict[str, float]:
+    limits = _data().get(dsn)
+    if not isinstance(limits, dict):
+        return {}
+    parsed = {}
+    for category, expiry in limits.items():
+        try:
+            parsed[str(category)] = float(expiry)
+        except (TypeError, ValueError):
+            logger.warning(f'Malformed rate limit for category {category}, ignoring')
+    return parsed
+
+
+def until(dsn: str, categories: Iterable[str] = CATEGORIES, now: Optional[float] = None) -> Optional[float]:
+    if now is None:
+        now = time.time()
+    limits = _limits(dsn)
+    expiry = max((limits.get(category, 0) for category in (ALL, *categories)), default=0)
+    if expiry <= now:
+        return None
+    return expiry
+
+
+def limit(dsn: str, seconds: float, categories: Iterable[str] = (ALL,)) -> None:
+    now = time.time()
+    limits = {category: expiry for category, expiry in _limits(dsn).items() if expiry > now}
+    for category in categories:
+        limits[category] = max(limits.get(category, 0), now + seconds)
+        logger.warning(f'Rate limited for {seconds:.0f} seconds on category {category or "all"}')
+    _data()[dsn] = limits
+
+
+def clear(dsn: str) -> None:
+    data = _data()
+    if dsn in data:
+        del data[dsn]
+
+
+def write() -> None:
+    _data().write()
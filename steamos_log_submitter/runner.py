@@ -6,12 +6,17 @@
 import asyncio
 import logging
 import os
-from collections.abc import Iterable
-from typing import Type
+from collections.abc import Iterable, Mapping
+from typing import NamedTuple, Optional, Type
 
 import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators
+import steamos_log_submitter.catalog
+import steamos_log_submitter.dedup
 import steamos_log_submitter.helpers
-from steamos_log_submitter.lockfile import LockHeldError
+import steamos_log_submitter.ledger as ledger
+import steamos_log_submitter.ratelimit
+from steamos_log_submitter.lockfile import LockHeldError, LockNotHeldError
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +24,7 @@ logger = logging.getLogger(__name__)
 async def collect_category(helper: Type[sls.helpers.Helper]) -> list[str]:
     logger.info(f'Collecting logs for {helper.name}')
     try:
-        with helper.lock():
+        async with helper.lock():
             return await helper.collect()
     except LockHeldError:
         # Another process is currently working on this directory
@@ -56,38 +61,227 @@ async def collect() -> list[str]:
     return logs
 
 
-async def submit_category(helper: Type[sls.helpers.Helper], logs: Iterable[str]) -> dict[str, sls.helpers.HelperResult | Exception]:
-    submitted: dict[str, sls.helpers.HelperResult | Exception] = {}
+async def submit_log(helper: Type[sls.helpers.Helper], log: str) -> sls.helpers.HelperResult:
+    logger.debug(f'Found log {helper.name}/{log}')
+    sls.helpers.set_failure_reason(None)
+    result = await helper.submit(f'{sls.pending}/{helper.name}/{log}')
+    if result == sls.helpers.HelperResult.OK:
+        logger.debug(f'Succeeded in submitting {helper.name}/{log}')
+        os.replace(f'{sls.pending}/{helper.name}/{log}', f'{sls.uploaded}/{helper.name}/{log}')
+    else:
+        logger.warning(f'Failed to submit log {helper.name}/{log} with code {result}')
+    if result == sls.helpers.HelperResult.PERMANENT_ERROR:
+        os.replace(f'{sls.pending}/{helper.name}/{log}', f'{sls.failed}/{helper.name}/{log}')
+    if result == sls.helpers.HelperResult.TRANSIENT_ERROR:
+        ledger.record_failure(helper.name, log, sls.helpers.failure_reason() or result.name)
+    elif result != sls.helpers.HelperResult.CLASS_ERROR:
+        ledger.clear(helper.name, log)
+    return result
+
+
+class _Entry(NamedTuple):
+    priority: int
+    size: int
+    seq: int
+    helper: Type[sls.helpers.Helper]
+    log: str
+
+
+def byte_budget() -> Optional[int]:
     try:
-        with helper.lock():
-            for log in logs:
-                if log.startswith('.'):
-                    continue
-                logger.debug(f'Found log {helper.name}/{log}')
-                try:
-                    result = await helper.submit(f'{sls.pending}/{helper.name}/{log}')
-                    submitted[log] = result
-                    if result == sls.helpers.HelperResult.OK:
-                        logger.debug(f'Succeeded in submitting {helper.name}/{log}')
-                        os.replace(f'{sls.pending}/{helper.name}/{log}', f'{sls.uploaded}/{helper.name}/{log}')
-                    else:
-                        logger.warning(f'Failed to submit log {helper.name}/{log} with code {result}')
-                    if result == sls.helpers.HelperResult.PERMANENT_ERROR:
-                        os.replace(f'{sls.pending}/{helper.name}/{log}', f'{sls.failed}/{helper.name}/{log}')
-                    elif result == sls.helpers.HelperResult.CLASS_ERROR:
+        budget = int(sls.base_config.get('byte-budget') or 0)
+    except ValueError:
+        logger.warning('Invalid byte budget, ignoring')
+        return None
+    if budget <= 0:
+        return None
+    return budget
+
+
+class Scheduler:
+    def __init__(self, concurrency: Optional[int] = None, budget: Optional[int] = None):
+        if concurrency is None:
+            try:
+                concurrency = int(sls.base_config.get('concurrency') or 4)
+            except ValueError:
+                logger.warning('Invalid global concurrency value, ignoring')
+                concurrency = 4
+        self.concurrency = max(concurrency, 1)
+        self.budget = budget
+        self.submitted: dict[tuple[str, str], sls.helpers.HelperResult | Exception] = {}
+        self.deferred: list[tuple[str, str]] = []
+        self._remaining = budget
+        self._queue: list[_Entry] = []
+        self._helpers: dict[str, Type[sls.helpers.Helper]] = {}
+        self._limits: dict[str, int] = {}
+        self._timeouts: dict[str, Optional[float]] = {}
+        self._deadlines: dict[str, Optional[float]] = {}
+        self._active: dict[str, int] = {}
+        self._locks: dict[str, sls.lockfile.Lockfile] = {}
+        self._class_errors: set[str] = set()
+        self._condition = asyncio.Condition()
+
+    def add(self, helper: Type[sls.helpers.Helper], logs: Iterable[str]) -> None:
+        if helper.name not in self._helpers:
+            self._helpers[helper.name] = helper
+            self._limits[helper.name] = helper.concurrency()
+            self._timeouts[helper.name] = helper.timeout()
+            self._active[helper.name] = 0
+        priority = helper.priority()
+        for log in logs:
+            if log.startswith('.'):
+                continue
+            stat = sls.catalog.stat(f'{sls.pending}/{helper.name}', log)
+            size = stat.st_size if stat else 0
+            self._queue.append(_Entry(priority, size, len(self._queue), helper, log))
+
+    def _over_budget(self, entry: _Entry) -> bool:
+        return self._remaining is not None and entry.size > self._remaining
+
+    def _out_of_time(self, entry: _Entry) -> bool:
+        deadline = self._deadlines.get(entry.helper.name)
+        return deadline is not None and deadline <= asyncio.get_running_loop().time()
+
+    def _deadline(self, entry: _Entry) -> Optional[float]:
+        deadline = self._deadlines.get(entry.helper.name)
+        timeout = self._timeouts[entry.helper.name]
+        if timeout is not None:
+            bucket = sls.aggregators.limiter()
+            if bucket:
+                # Time spent waiting on the bandwidth limit, which is shared
+                # with everything else being submitted, shouldn't count
+                timeout += entry.size * self.concurrency / bucket.rate
+            log_deadline = asyncio.get_running_loop().time() + timeout
+            if deadline is None or log_deadline < deadline:
+                deadline = log_deadline
+        return deadline
+
+    def _next(self) -> Optional[_Entry]:
+        limited = {name for name, helper in self._helpers.items() if helper.rate_limited_until() is not None}
+        for entry in [entry for entry in self._queue if entry.helper.name in limited]:
+            logger.info(f'Deferring {entry.helper.name}/{entry.log} to next trigger, {entry.helper.name} is rate limited')
+            self.deferred.append((entry.helper.name, entry.log))
+            self._queue.remove(entry)
+        for entry in [entry for entry in self._queue if self._over_budget(entry)]:
+            logger.info(f'Deferring {entry.helper.name}/{entry.log} to next trigger, byte budget exceeded')
+            self.deferred.append((entry.helper.name, entry.log))
+            self._queue.remove(entry)
+        for entry in [entry for entry in self._queue if self._out_of_time(entry)]:
+            logger.info(f'Deferring {entry.helper.name}/{entry.log} to next trigger, out of time for {entry.helper.name}')
+            self.deferred.append((entry.helper.name, entry.log))
+            self._queue.remove(entry)
+        i = 0
+        while i < len(self._queue):
+            entry = self._queue[i]
+            name = entry.helper.name
+            if self._active[name] >= self._limits[name]:
+                i += 1
+                continue
+            if name not in self._locks and not self._lock(entry.helper):
+                self._queue = [entry for entry in self._queue if entry.helper.name != name]
+                continue
+            if self._remaining is not None:
+                self._remaining = max(self._remaining - entry.size, 0)
+            return self._queue.pop(i)
+        self._unlock_idle()
+        return None
+
+    def _lock(self, helper: Type[sls.helpers.Helper]) -> bool:
+        # Only hold a helper's lock while its logs are being submitted, so other
+        # submissions for it aren't locked out for the whole queue
+        lock = helper.lock()
+        try:
+            lock.lock()
+        except LockHeldError:
+            # Another process is currently working on this directory
+            logger.warning(f'Lock already held trying to submit logs for {helper.name}')
+            return False
+        except Exception as e:
+            logger.error(f'Encountered error submitting logs for {helper.name}', exc_info=e)
+            return False
+        self._locks[helper.name] = lock
+        timeout = helper.category_timeout()
+        self._deadlines[helper.name] = asyncio.get_running_loop().time() + timeout if timeout is not None else None
+        return True
+
+    def _unlock(self, name: str) -> None:
+        try:
+            self._locks.pop(name).unlock()
+        except LockNotHeldError as e:
+            logger.warning(f'Lock for {name} went missing: {e}')
+
+    def _unlock_idle(self) -> None:
+        busy = {entry.helper.name for entry in self._queue}
+        for name in list(self._locks):
+            if name not in busy and not self._active[name]:
+                self._unlock(name)
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._condition:
+                while True:
+                    self._queue = [entry for entry in self._queue if entry.helper.name not in self._class_errors]
+                    if not self._queue:
+                        self._unlock_idle()
+                        return
+                    next_entry = self._next()
+                    if next_entry:
                         break
-                except Exception as e:
-                    logger.error(f'Encountered error submitting log {helper.name}/{log}', exc_info=e)
-                    submitted[log] = e
-    except LockHeldError:
-        # Another process is currently working on this directory
-        logger.warning(f'Lock already held trying to submit logs for {helper.name}')
-    except Exception as e:
-        logger.error(f'Encountered error submitting logs for {helper.name}', exc_info=e)
-    return submitted
+                    if not self._queue:
+                        return
+                    await self._condition.wait()
+                entry = next_entry
+                self._active[entry.helper.name] += 1
+            try:
+                async with asyncio.timeout_at(self._deadline(entry)):
+                    result = await submit_log(entry.helper, entry.log)
+                self.submitted[entry.helper.name, entry.log] = result
+                if result == sls.helpers.HelperResult.CLASS_ERROR:
+                    self._class_errors.add(entry.helper.name)
+            except TimeoutError:
+                logger.warning(f'Timed out submitting log {entry.helper.name}/{entry.log}')
+                self.submitted[entry.helper.name, entry.log] = sls.helpers.HelperResult.TRANSIENT_ERROR
+                ledger.record_failure(entry.helper.name, entry.log, 'Timed out', timeout=True)
+            except Exception as e:
+                logger.error(f'Encountered error submitting log {entry.helper.name}/{entry.log}', exc_info=e)
+                self.submitted[entry.helper.name, entry.log] = e
+                ledger.record_failure(entry.helper.name, entry.log, f'{type(e).__name__}: {e}')
+            finally:
+                async with self._condition:
+                    self._active[entry.helper.name] -= 1
+                    self._unlock_idle()
+                    self._condition.notify_all()
+
+    async def run(self) -> dict[tuple[str, str], sls.helpers.HelperResult | Exception]:
+        try:
+            self._queue.sort()
+            workers = min(self.concurrency, len(self._queue))
+            if workers:
+                await asyncio.gather(*(self._worker() for _ in range(workers)))
+        finally:
+            for name in list(self._locks):
+                self._unlock(name)
+            ledger.write()
+            sls.ratelimit.write()
+            sls.dedup.write()
+        return self.submitted
+
 
+async def submit_category(helper: Type[sls.helpers.Helper], logs: Iterable[str]) -> dict[str, sls.helpers.HelperResult | Exception]:
+    scheduler = Scheduler(helper.concurrency())
+    scheduler.add(helper, logs)
+    submitted = await scheduler.run()
+    results = {log: result for (_, log), result in submitted.items()}
+    for _, log in scheduler.deferred:
+        # Nothing was attempted, so let the caller know it can try again later
+        if helper.rate_limited_until() is not None:
+            results[log] = sls.helpers.HelperResult.CLASS_ERROR
+        else:
+            results[log] = sls.helpers.HelperResult.TRANSIENT_ERROR
+    return results
 
-async def submit() -> dict[str, sls.helpers.HelperResult | Exception]:
+
+async def submit(only: Optional[Mapping[str, Iterable[str]]] = None) -> dict[str, sls.helpers.HelperResult | Exception]:
     if sls.base_config.get('submit', 'on') != 'on':
         return {}
     logger.info('Starting log submission')
@@ -95,33 +289,43 @@ async def submit() -> dict[str, sls.helpers.HelperResult | Exception]:
         logger.info('Network is offline, bailing out')
         return {}
 
-    tasks = []
-    submitted: dict[str, sls.helpers.HelperResult | Exception] = {}
-    for category in sls.helpers.list_helpers():
+    scheduler = Scheduler(budget=byte_budget())
+    for category in (only.keys() if only is not None else sls.helpers.list_helpers()):
         helper = sls.helpers.create_helper(category)
         if not helper:
             continue
 
         if not helper.enabled() or not helper.submit_enabled():
             continue
+        limited = helper.rate_limited_until()
+        if limited is not None:
+            logger.info(f'{category} is rate limited until {limited:.0f}, skipping')
+            continue
+
         logger.info(f'Submitting logs for {category}')
-        logs = helper.list_pending()
+        if only is not None:
+            # Only look at the specified logs instead of rescanning the directory
+            pending = [log for log in only[category] if helper.filter_log(log) and os.access(f'{sls.pending}/{category}/{log}', os.R_OK)]
+        else:
+            try:
+                pending = list(helper.list_pending())
+            except Exception as e:
+                logger.error(f'Encountered error listing logs for {category}', exc_info=e)
+                continue
+            ledger.prune(helper.name, pending)
+        logs = [log for log in pending if ledger.eligible(helper.name, log)]
 
         if not logs:
-            logger.info('No logs found, skipping')
+            if pending:
+                logger.info('All pending logs are backing off, skipping')
+            else:
+                logger.info('No logs found, skipping')
             continue
 
-        async def submit_fn(helper: Type[sls.helpers.Helper], logs: Iterable[str]) -> dict[str, sls.helpers.HelperResult | Exception]:
-            submitted = await submit_category(helper, logs)
-            return {f'{helper.name}/{log}': result for log, result in submitted.items()}
-
-        tasks.append(asyncio.create_task(submit_fn(helper, logs)))
-    if tasks:
-        done, _ = await asyncio.wait(tasks)
-        for task in done:
-            submitted.update(task.result())
+        scheduler.add(helper, logs)
+    submitted = await scheduler.run()
     logger.info('Finished log submission')
-    return submitted
+    return {f'{helper}/{log}': result for (helper, log), result in submitted.items()}
 
 
 async def trigger() -> tuple[list[str], dict[str, sls.helpers.HelperResult | Exception]]:
@@ -153,3 +357,7 @@ async def startup() -> None:
     if tasks:
         done, _ = await asyncio.wait(tasks)
     logger.info('Finished starting up helpers')
+
+
+async def shutdown() -> None:
+    await sls.aggregators.close()
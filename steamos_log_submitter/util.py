@@ -6,6 +6,7 @@
 import asyncio
 import elftools.elf
 import elftools.common.exceptions
+import fcntl
 import grp
 import hashlib
 import httpx
@@ -16,26 +17,33 @@ import io
 import os
 import pwd
 import re
+import shutil
 import sqlite3
+import stat
 import subprocess
 import time
 import typing
 from elftools.elf.elffile import ELFFile
 from types import TracebackType
-from typing import Iterable, Optional, Type, Union
+from typing import Iterable, NamedTuple, Optional, Type, Union
 
 import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators
+import steamos_log_submitter.metrics
 from steamos_log_submitter.types import JSONEncodable
 
 logger = logging.getLogger(__name__)
 
 __all__ = [
+    'DeviceContext',
     'camel_case',
     'check_network',
+    'copy_file',
     'drop_root',
     'get_app_name',
     'get_appid',
     'get_build_id',
+    'get_device_context',
     'get_dmi_info',
     'get_exe_build_id',
     'get_file_key',
@@ -44,6 +52,7 @@ __all__ = [
     'get_pid_stat',
     'get_steamos_branch',
     'get_version_id',
+    'invalidate_device_context',
     'read_file',
     'read_journal',
     'snake_case',
@@ -320,6 +329,74 @@ def read_file(path: str, binary: bool = False) -> Union[bytes, str, None]:
         return None
 
 
+# Not exported by the fcntl module before Python 3.12
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+
+
+def _copy_file(source: str, src: io.BufferedReader, st: os.stat_result, dest: str) -> str:
+    # Hard links share ownership and permissions with the source, so only link
+    # files that nobody else can change out from under us
+    if st.st_uid == os.geteuid() and not os.path.islink(source):
+        try:
+            os.link(source, dest, follow_symlinks=False)
+            linked = os.stat(dest)
+            if (linked.st_dev, linked.st_ino) == (st.st_dev, st.st_ino):
+                return 'link'
+            # The source was replaced after it was opened
+            os.unlink(dest)
+        except FileExistsError:
+            raise
+        except OSError:
+            pass
+
+    with open(dest, 'xb') as dst:
+        try:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+
+            copied = 0
+            try:
+                while copied < st.st_size:
+                    count = os.copy_file_range(src.fileno(), dst.fileno(), st.st_size - copied, copied, copied)
+                    if not count:
+                        break
+                    copied += count
+                if copied == st.st_size:
+                    return 'copy_file_range'
+            except OSError:
+                pass
+
+            dst.seek(0)
+            dst.truncate()
+            src.seek(0)
+            shutil.copyfileobj(src, dst, sls.aggregators.CHUNK_SIZE)
+            return 'copy'
+        except BaseException:
+            os.unlink(dest)
+            raise
+
+
+def copy_file(source: str, dest: str) -> str:
+    start = time.perf_counter()
+    # Don't block if the source turns out to be a FIFO
+    fd = os.open(source, os.O_RDONLY | os.O_NONBLOCK)
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode):
+        os.close(fd)
+        raise ValueError(f'{source} is not a regular file')
+    with open(fd, 'rb') as src:
+        strategy = _copy_file(source, src, st, dest)
+    elapsed = time.perf_counter() - start
+    logger.debug(f'Copied {st.st_size} bytes from {source} to {dest} with {strategy} in {elapsed:.3f}s')
+    sls.metrics.increment(f'copy_file.{strategy}')
+    sls.metrics.increment('copy_file.bytes', st.st_size)
+    sls.metrics.observe('copy_file', elapsed)
+    return strategy
+
+
 def get_exe_build_id(path: str) -> Optional[str]:
     try:
         with open(path, 'rb') as progf:
@@ -370,24 +447,23 @@ async def update_app_list() -> bool:
     ua_string = f'SteamOS Log Submitter/{sls.__version__}'
 
     logger.debug('Updating app list')
-    async with httpx.AsyncClient() as client:
-        try:
-            get = await client.get('https://api.steampowered.com/ISteamApps/GetAppList/v2/?format=json', headers={
-                'User-Agent': ua_string
-            })
-        except httpx.HTTPError as e:
-            logger.warning('Exception occurred while fetching app list', exc_info=e)
-            return False
+    try:
+        get = await sls.aggregators.client().get('https://api.steampowered.com/ISteamApps/GetAppList/v2/?format=json', headers={
+            'User-Agent': ua_string
+        })
+    except httpx.HTTPError as e:
+        logger.warning('Exception occurred while fetching app list', exc_info=e)
+        return False
 
-        if get.status_code != 200:
-            logger.warning(f'Failed to fetch app list with status code {get.status_code}')
-            return False
+    if get.status_code != 200:
+        logger.warning(f'Failed to fetch app list with status code {get.status_code}')
+        return False
 
-        try:
-            applist_raw = get.json()["applist"]["apps"]
-        except (KeyError, json.decoder.JSONDecodeError) as e:
-            logger.warning('Failed to parse app list', exc_info=e)
-            return False
+    try:
+        applist_raw = get.json()["applist"]["apps"]
+    except (KeyError, json.decoder.JSONDecodeError) as e:
+        logger.warning('Failed to parse app list', exc_info=e)
+        return False
 
     db = sqlite3.connect(f'{sls.data.data_root}/applist.sqlite3')
     cursor = db.cursor()
@@ -407,19 +483,26 @@ async def update_app_list() -> bool:
     return True
 
 
+_app_db: Optional[tuple[str, sqlite3.Connection]] = None
+
+
 def get_app_name(appid: int) -> Optional[str]:
-    try:
-        db = sqlite3.connect(f'{sls.data.data_root}/applist.sqlite3')
-    except sqlite3.OperationalError as e:
-        logger.warning(f'Failed to open app list database: {e}')
-        return None
+    global _app_db
+    path = f'{sls.data.data_root}/applist.sqlite3'
+    if _app_db is None or _app_db[0] != path:
+        try:
+            _app_db = path, sqlite3.connect(path, check_same_thread=False)
+        except sqlite3.OperationalError as e:
+            logger.warning(f'Failed to open app list database: {e}')
+            return None
 
-    cursor = db.cursor()
     try:
-        cursor.execute('SELECT name FROM applist WHERE appid = :appid', {'appid': appid})
+        # Use fetchall so the cursor doesn't hold a read lock that would
+        # block the app list from being updated
+        rows = _app_db[1].execute('SELECT name FROM applist WHERE appid = :appid', {'appid': appid}).fetchall()
     except sqlite3.OperationalError:
         return None
-    row = cursor.fetchone()
+    row = rows[0] if rows else None
     if row is None:
         return None
     return typing.cast(str, row[0])
@@ -580,3 +663,69 @@ def get_dmi_info() -> dict[str, str]:
             info['vendor'] = sys_vendor
             info['product'] = products[sys_vendor][board_name]
     return info
+
+
+class DeviceContext(NamedTuple):
+    branch: Optional[str]
+    build_id: Optional[str]
+    version_id: Optional[str]
+    architecture: str
+    product: Optional[str]
+    unit_id: Optional[str]
+
+
+# These change when the OS is updated or the branch is switched
+DEVICE_CONTEXT_PATHS = ('/etc/os-release', '/var/lib/steamos-branch')
+
+_device_context: Optional[DeviceContext] = None
+_device_context_key: Optional[tuple[object, ...]] = None
+
+
+def _create_device_context() -> DeviceContext:
+    branch = get_steamos_branch()
+    product = None
+    try:
+        product = get_dmi_info().get('product')
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f'Failed to get DMI information: {e}')
+
+    return DeviceContext(branch=branch,
+                         build_id=get_build_id() if branch is not None else None,
+                         version_id=get_version_id() if branch is not None else None,
+                         architecture=os.uname().machine,
+                         product=product,
+                         unit_id=telemetry_unit_id())
+
+
+def _device_context_stat(path: str) -> Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def get_device_context() -> DeviceContext:
+    global _device_context, _device_context_key
+    try:
+        loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None:
+        return _create_device_context()
+
+    # Only cache the context for the life of the event loop, so that e.g.
+    # each run of the daemon computes it afresh
+    key = (loop, *(_device_context_stat(path) for path in DEVICE_CONTEXT_PATHS))
+    if _device_context is None or _device_context_key != key:
+        _device_context = _create_device_context()
+        _device_context_key = key
+    return _device_context
+
+
+def invalidate_device_context() -> None:
+    global _device_context, _device_context_key
+    _device_context = None
+    _device_context_key = None
@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
+import logging
+import os
+import tempfile
+from collections.abc import Callable
+from typing import Optional
+
+import steamos_log_submitter.metrics as metrics
+
+__all__ = [
+    'cancel',
+    'flush',
+    'schedule',
+    'start',
+    'stop',
+    'write_atomic',
+]
+
+logger = logging.getLogger(__name__)
+
+DELAY = 2.0
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_delay = DELAY
+_handle: Optional[asyncio.TimerHandle] = None
+_pending: dict[str, Callable[[], None]] = {}
+
+
+def write_atomic(path: str, data: str | bytes) -> None:
+    directory, name = os.path.split(path)
+    try:
+        st: Optional[os.stat_result] = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    fd, tmp = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory or '.')
+    try:
+        with open(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fchmod(f.fileno(), st.st_mode & 0o7777 if st else 0o644)
+            if st and os.geteuid() == 0:
+                # Don't let the replacement change who owns the file
+                os.fchown(f.fileno(), st.st_uid, st.st_gid)
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    # The rename isn't durable until the directory itself is synced
+    fd = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def start(delay: float = DELAY) -> None:
+    global _loop
+    global _delay
+    _loop = asyncio.get_running_loop()
+    _delay = delay
+
+
+def stop() -> None:
+    global _loop
+    flush()
+    _loop = None
+
+
+def _write(key: str, write: Callable[[], None]) -> None:
+    try:
+        write()
+    except Exception as e:
+        logger.error(f'Failed to write {key}', exc_info=e)
+    else:
+        metrics.increment('writeback.writes')
+
+
+def schedule(key: str, write: Callable[[], None]) -> None:
+    global _handle
+    if _loop is None or _loop.is_closed():
+        # Nothing will be around to flush later, so write immediately
+        _write(key, write)
+        return
+    if key in _pending:
+        metrics.increment('writeback.coalesced')
+    _pending[key] = write
+    if _handle is None:
+        _handle = _loop.call_later(_delay, flush)
+
+
+def cancel(key: str) -> None:
+    _pending.pop(key, None)
+
+
+def flush() -> None:
+    global _handle
+    if _handle:
+        _handle.cancel()
+        _handle = None
+    while _pending:
+        key = next(iter(_pending))
+        _write(key, _pending.pop(key))
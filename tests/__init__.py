@@ -131,6 +131,7 @@ def patch_module(mock_config, monkeypatch):
         return original_import_module(name, package)
     monkeypatch.setattr(importlib, 'import_module', import_module)
     monkeypatch.setattr(steamos_log_submitter.helpers, 'list_helpers', lambda: ['test'])
+    monkeypatch.setattr(steamos_log_submitter.helpers, '_registry', {})
 
     return TestHelper
 
@@ -147,6 +148,12 @@ def helper_directory(monkeypatch, patch_module):
     monkeypatch.setattr(sls, 'pending', pending)
     monkeypatch.setattr(sls, 'uploaded', uploaded)
     monkeypatch.setattr(sls, 'failed', failed)
+    if sls.data.data_root == f'{sls.base}/data':
+        # Don't clobber the system data if data_directory isn't in use
+        monkeypatch.setattr(sls.data, 'data_root', f'{d.name}/data')
+        for dat in sls.data.datastore.values():
+            monkeypatch.setattr(dat, '_data', {})
+            monkeypatch.setattr(dat, '_dirty', False)
 
     def list_helpers():
         return list(os.listdir(f'{d.name}/pending'))  # NOQA: F821 # flake8 bug
@@ -154,6 +161,7 @@ def helper_directory(monkeypatch, patch_module):
 
     yield d.name
 
+    sls.catalog.reset()
     del d
 
 
@@ -217,6 +225,11 @@ def data_directory(monkeypatch):
     del d
 
 
+@pytest.fixture
+def online(monkeypatch):
+    monkeypatch.setattr(sls.util, 'check_network', lambda: True)
+
+
 @pytest.fixture
 def drop_root():
     if os.geteuid() != 0:
@@ -8,10 +8,11 @@ import json
 import os
 import pytest
 import tempfile
+import steamos_log_submitter as sls
 import steamos_log_submitter.util as util
 from steamos_log_submitter.helpers import HelperResult
 from steamos_log_submitter.helpers.minidump import MinidumpHelper as helper
-from .. import custom_dsn
+from .. import awaitable, custom_dsn, unreachable
 from .. import mock_config, open_shim  # NOQA: F401
 
 dsn = custom_dsn('helpers.minidump')
@@ -157,3 +158,64 @@ async def test_environ_sanitization():
         'MAIL': '/var/spool/mail/${USER}',
         'PAGER': 'less',
     }
+
+
+@pytest.mark.asyncio
+async def test_metadata_cached(monkeypatch):
+    responses = [500, 200]
+
+    async def post(*args, **kwargs):
+        data = json.loads(kwargs['data']['sentry'])
+        assert data['extra']['cmdline'] == ['hl2']
+        assert data['tags']['appid'] == 220
+        return httpx.Response(responses.pop(0))
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', post)
+    monkeypatch.setattr(helper, 'parse_minidump', awaitable(lambda fname: {'cmdline': ['hl2']}))
+
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        fname = f'{d}/hl2-220.dmp'
+        with open(fname, 'wb') as f:
+            f.write(b'MDMP')
+        assert await helper.submit(fname) == HelperResult.TRANSIENT_ERROR
+        assert os.path.exists(helper.metadata_path(fname))
+
+        monkeypatch.setattr(helper, 'parse_minidump', unreachable)
+        assert await helper.submit(fname) == HelperResult.OK
+        assert not os.path.exists(helper.metadata_path(fname))
+
+
+@pytest.mark.asyncio
+async def test_metadata_stale(monkeypatch):
+    async def post(*args, **kwargs):
+        data = json.loads(kwargs['data']['sentry'])
+        assert data['extra']['cmdline'] == ['hl2']
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', post)
+    monkeypatch.setattr(helper, 'parse_minidump', awaitable(lambda fname: {'cmdline': ['hl2']}))
+
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        fname = f'{d}/hl2-220.dmp'
+        with open(fname, 'wb') as f:
+            f.write(b'MDMP')
+        helper.save_metadata(fname, os.stat(fname), {'cmdline': ['portal']})
+        with open(fname, 'ab') as f:
+            f.write(b'\0')
+        assert await helper.submit(fname) == HelperResult.OK
+
+        with open(helper.metadata_path(fname), 'wb') as f:
+            f.write(b'{')
+        assert helper.load_metadata(fname, os.stat(fname)) is None
+
+
+@pytest.mark.asyncio
+async def test_metadata_pruned(monkeypatch):
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        monkeypatch.setattr(sls, 'pending', d)
+        os.mkdir(f'{d}/minidump')
+        for name in ('kept.dmp', '.kept.dmp.json', '.gone.dmp.json'):
+            with open(f'{d}/minidump/{name}', 'w'):
+                pass
+        await helper.collect()
+        assert sorted(os.listdir(f'{d}/minidump')) == ['.kept.dmp.json', 'kept.dmp']
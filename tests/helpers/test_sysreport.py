@@ -3,15 +3,18 @@
 #
 # Copyright (c) 2024 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
+import httpx
 import pytest
+import pytest_asyncio
 import os
 import tempfile
 import steamos_log_submitter as sls
 import steamos_log_submitter.aggregators.sentry as sentry
+from bench.server import FakeSentry
 from steamos_log_submitter.dbus import dbus
 from steamos_log_submitter.helpers import HelperResult
 from steamos_log_submitter.helpers.sysreport import SysreportHelper as helper
-from .. import awaitable, always_raise, custom_dsn, setup_categories
+from .. import awaitable, always_raise, custom_dsn, setup_categories, unreachable
 from .. import helper_directory, mock_config, patch_module  # NOQA: F401
 from ..daemon import dbus_daemon
 from ..dbus import mock_dbus, MockDBusObject  # NOQA: F401
@@ -34,6 +37,14 @@ async def test_send_failures(helper_directory):
         pass
 
 
+@pytest.mark.asyncio
+async def test_send_not_regular(helper_directory):
+    setup_categories(['sysreport'])
+    with tempfile.TemporaryDirectory(suffix='.zip') as d:
+        assert await helper.send_report(d) == HelperResult.PERMANENT_ERROR
+    assert not os.listdir(f'{sls.pending}/{helper.name}')
+
+
 @pytest.mark.asyncio
 async def test_move_failed(helper_directory, monkeypatch):
     monkeypatch.setattr(sls, 'base', helper_directory)
@@ -61,6 +72,13 @@ async def test_submit_missing_file(monkeypatch):
     await daemon.shutdown()
 
 
+@pytest.mark.asyncio
+async def test_submit_vanished(helper_directory, monkeypatch):
+    monkeypatch.setattr(sentry.SentryEvent, 'send', unreachable)
+    setup_categories(['sysreport'])
+    assert await helper.submit(f'{sls.pending}/sysreport/XXXX-XXXX.zip') == HelperResult.TRANSIENT_ERROR
+
+
 @pytest.mark.asyncio
 async def test_transient_error(helper_directory, monkeypatch):
     monkeypatch.setattr(sls, 'base', helper_directory)
@@ -83,6 +101,22 @@ async def test_transient_error(helper_directory, monkeypatch):
     assert not os.access(f'{sls.pending}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
     assert os.access(f'{sls.failed}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
 
+    await daemon.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_rate_limited(helper_directory, mock_config, monkeypatch):
+    monkeypatch.setattr(sls, 'base', helper_directory)
+    monkeypatch.setattr(helper, 'alphabet', 'X')
+    monkeypatch.setattr(helper, 'submit', unreachable)
+    monkeypatch.setattr(helper, 'rate_limited_until', lambda: 60)
+    setup_categories(['sysreport'])
+
+    zip = tempfile.NamedTemporaryFile(suffix='.zip')
+    assert await helper.send_report(zip.name) == HelperResult.CLASS_ERROR
+    assert not os.access(f'{sls.pending}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
+    assert os.access(f'{sls.failed}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
+
 
 @pytest.mark.asyncio
 async def test_permanent_error(helper_directory, monkeypatch):
@@ -106,6 +140,8 @@ async def test_permanent_error(helper_directory, monkeypatch):
     assert not os.access(f'{sls.pending}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
     assert os.access(f'{sls.failed}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
 
+    await daemon.shutdown()
+
 
 @pytest.mark.asyncio
 async def test_other_error(helper_directory, monkeypatch):
@@ -129,6 +165,8 @@ async def test_other_error(helper_directory, monkeypatch):
     assert not os.access(f'{sls.pending}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
     assert os.access(f'{sls.failed}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
 
+    await daemon.shutdown()
+
 
 @pytest.mark.asyncio
 async def test_ok(helper_directory, monkeypatch):
@@ -147,6 +185,24 @@ async def test_ok(helper_directory, monkeypatch):
     assert not os.access(f'{sls.pending}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
     assert os.access(f'{sls.uploaded}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
 
+    await daemon.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_too_large(helper_directory, mock_config, monkeypatch):
+    monkeypatch.setattr(httpx.AsyncClient, 'post', unreachable)
+    monkeypatch.setattr(sls, 'base', helper_directory)
+    monkeypatch.setattr(helper, 'alphabet', 'X')
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'max-attachment-size', '1000')
+    setup_categories(['sysreport'])
+
+    zip = tempfile.NamedTemporaryFile(suffix='.zip')
+    zip.write(os.urandom(5000))
+    zip.flush()
+    assert await helper.send_report(zip.name) == HelperResult.PERMANENT_ERROR
+    assert os.access(f'{sls.failed}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
+
 
 @pytest.mark.asyncio
 async def test_metadata(helper_directory, monkeypatch):
@@ -166,3 +222,99 @@ async def test_metadata(helper_directory, monkeypatch):
 
     zip = tempfile.NamedTemporaryFile(suffix='.zip')
     assert await helper.send_report(zip.name) == 'XXXX-XXXX'
+
+
+@pytest_asyncio.fixture
+async def upload_server(mock_config):
+    server = FakeSentry()
+    port = await server.start()
+    mock_config.set('helpers.sysreport', 'upload-url', f'http://127.0.0.1:{port}/upload/')
+    mock_config.set('helpers.sysreport', 'upload-chunk-size', '1000')
+    yield server
+    await sls.aggregators.close()
+    await server.close()
+
+
+def fail_patch_after(monkeypatch, chunks):
+    patch = httpx.AsyncClient.patch
+    sent = 0
+
+    async def flaky_patch(self, url, **kwargs):
+        nonlocal sent
+        if sent >= chunks:
+            raise httpx.ConnectError('Wi-Fi dropped')
+        sent += 1
+        return await patch(self, url, **kwargs)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'patch', flaky_patch)
+
+
+@pytest.mark.asyncio
+async def test_chunked_upload(helper_directory, upload_server, monkeypatch):
+    events = []
+    progress = []
+
+    async def send(self):
+        events.append(self)
+        return HelperResult.OK
+
+    monkeypatch.setattr(sentry.SentryEvent, 'send', send)
+    monkeypatch.setattr(helper, 'report_progress', lambda *args: progress.append(args))
+    setup_categories(['sysreport'])
+    report = os.urandom(4500)
+    with open(f'{sls.pending}/sysreport/XXXX-XXXX.zip', 'wb') as f:
+        f.write(report)
+
+    assert await helper.submit(f'{sls.pending}/sysreport/XXXX-XXXX.zip') == HelperResult.OK
+    upload, = upload_server.uploads.values()
+    assert upload.data == report
+    event, = events
+    assert not event.attachments
+    assert event.extra['sls.report_url'].startswith('http://127.0.0.1:')
+    assert progress == [('XXXX-XXXX', offset, 4500) for offset in (0, 1000, 2000, 3000, 4000, 4500)]
+    assert 'XXXX-XXXX' not in helper._uploads()
+
+
+@pytest.mark.asyncio
+async def test_chunked_upload_resume(helper_directory, upload_server, monkeypatch):
+    monkeypatch.setattr(sentry.SentryEvent, 'send', awaitable(lambda self: HelperResult.OK))
+    setup_categories(['sysreport'])
+    report = os.urandom(4500)
+    with open(f'{sls.pending}/sysreport/XXXX-XXXX.zip', 'wb') as f:
+        f.write(report)
+
+    with monkeypatch.context() as m:
+        fail_patch_after(m, 2)
+        assert await helper.submit(f'{sls.pending}/sysreport/XXXX-XXXX.zip') == HelperResult.TRANSIENT_ERROR
+    assert helper._uploads()['XXXX-XXXX']['offset'] == 2000
+    with open(f'{sls.data.data_root}/helpers.sysreport.json') as f:
+        assert '"offset": 2000' in f.read()
+
+    assert await helper.submit(f'{sls.pending}/sysreport/XXXX-XXXX.zip') == HelperResult.OK
+    upload, = upload_server.uploads.values()
+    assert upload.data == report
+    # Nothing that made it the first time was sent again
+    assert upload_server.stats['upload'].decoded_bytes == len(report)
+
+
+@pytest.mark.asyncio
+async def test_send_report_resume(helper_directory, upload_server, monkeypatch):
+    monkeypatch.setattr(sls, 'base', helper_directory)
+    monkeypatch.setattr(sentry.SentryEvent, 'send', awaitable(lambda self: HelperResult.OK))
+    setup_categories(['sysreport'])
+
+    zip = tempfile.NamedTemporaryFile(suffix='.zip')
+    zip.write(os.urandom(3500))
+    zip.flush()
+    with monkeypatch.context() as m:
+        m.setattr(helper, 'alphabet', 'X')
+        fail_patch_after(m, 1)
+        assert await helper.send_report(zip.name) == HelperResult.TRANSIENT_ERROR
+    assert os.access(f'{sls.failed}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
+
+    monkeypatch.setattr(helper, 'alphabet', 'Y')
+    assert await helper.send_report(zip.name) == 'XXXX-XXXX'
+    assert not os.access(f'{sls.failed}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
+    assert os.access(f'{sls.uploaded}/{helper.name}/XXXX-XXXX.zip', os.F_OK)
+    assert upload_server.stats['upload'].decoded_bytes == 3500
+    assert helper.data.get('uploads') == {}
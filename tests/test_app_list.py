@@ -108,3 +108,18 @@ async def test_update_app_list(count_hits, data_directory, monkeypatch):
     assert sls.util.get_app_name(69) == 'Left 4 Dead 3'
     assert sls.util.get_app_name(420) == 'Alien Swarm 2'
     assert sls.util.get_app_name(666) is None
+
+
+def test_get_app_name_reuses_db(data_directory, monkeypatch):
+    connect = sqlite3.connect
+    connections = []
+
+    def fake_connect(*args, **kwargs):
+        db = connect(*args, **kwargs)
+        connections.append(db)
+        return db
+
+    monkeypatch.setattr(sqlite3, 'connect', fake_connect)
+    for _ in range(3):
+        assert sls.util.get_app_name(69) is None
+    assert len(connections) == 1
@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import httpx
+import os
+import pytest
+import tempfile
+import steamos_log_submitter as sls
+import steamos_log_submitter.helpers as helpers
+from steamos_log_submitter.runner import shutdown, submit
+from bench import compression, generate, server
+from . import mock_config  # NOQA: F401
+
+
+@pytest.fixture
+def bench_directory(monkeypatch):
+    d = tempfile.TemporaryDirectory(prefix='sls-')
+    monkeypatch.setattr(sls, 'pending', f'{d.name}/pending')
+    monkeypatch.setattr(sls, 'uploaded', f'{d.name}/uploaded')
+    monkeypatch.setattr(sls, 'failed', f'{d.name}/failed')
+    monkeypatch.setattr(sls.data, 'data_root', f'{d.name}/data')
+    for dat in sls.data.datastore.values():
+        monkeypatch.setattr(dat, '_data', {})
+        monkeypatch.setattr(dat, '_dirty', False)
+    monkeypatch.setattr(helpers, 'list_helpers', lambda: list(generate.GENERATORS))
+    for helper in generate.GENERATORS:
+        for directory in (sls.pending, sls.uploaded, sls.failed):
+            os.makedirs(f'{directory}/{helper}')
+
+    yield d.name
+
+    del d
+
+
+@pytest.mark.asyncio
+async def test_server_routes():
+    sentry = server.FakeSentry(seed=0)
+    port = await sentry.start()
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f'http://127.0.0.1:{port}/api/1/store/', json={'event_id': '0'})
+        assert response.status_code == 200
+        assert 'id' in response.json()
+        response = await client.post(f'http://127.0.0.1:{port}/api/1/envelope/', content=b'envelope')
+        assert response.status_code == 200
+        response = await client.post(f'http://127.0.0.1:{port}/api/1/unknown/', content=b'')
+        assert response.status_code == 404
+    assert sentry.stats['store'].requests == 1
+    assert sentry.stats['envelope'].requests == 1
+    assert sentry.stats['envelope'].bytes == len(b'envelope')
+    assert sentry.connections == 1
+    await sentry.close()
+
+
+@pytest.mark.asyncio
+async def test_server_errors():
+    sentry = server.FakeSentry(error_rate=1, error_status=429)
+    port = await sentry.start()
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f'http://127.0.0.1:{port}/api/1/store/', json={})
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '60'
+    assert sentry.stats['store'].errors == 1
+    await sentry.close()
+
+
+@pytest.mark.asyncio
+async def test_generated_tree(bench_directory, mock_config, monkeypatch):
+    sentry = server.FakeSentry()
+    port = await sentry.start()
+    monkeypatch.setattr(sls.util, 'check_network', lambda: True)
+    for helper in generate.GENERATORS:
+        mock_config.add_section(f'helpers.{helper}')
+    mock_config.set('helpers.kdump', 'dsn', f'http://bench@127.0.0.1:{port}/5')
+    mock_config.set('helpers.journal', 'dsn', f'http://bench@127.0.0.1:{port}/4')
+    mock_config.set('helpers.journal', 'envelope-only', 'off')
+    mock_config.set('helpers.gpu', 'dsn', f'http://bench@127.0.0.1:{port}/3')
+    mock_config.set('helpers.minidump', 'dsn', f'http://127.0.0.1:{port}/api/2/minidump/?sentry_key=bench')
+
+    written = generate.generate(sls.pending, {helper: 2 for helper in generate.GENERATORS}, 4096)
+    assert set(written) == set(generate.GENERATORS)
+    submitted = await submit()
+
+    assert len(submitted) == 8
+    assert all(result == helpers.HelperResult.OK for result in submitted.values())
+    assert sentry.stats['minidump'].requests == 2
+    assert sentry.stats['store'].requests == 2
+    assert sentry.stats['envelope'].requests == 6
+    assert sentry.connections < len(submitted)
+    await shutdown()
+    await sentry.close()
+
+
+def test_compression_fixtures():
+    files = compression.list_files([compression.FIXTURES])
+    assert files
+    assert all(os.path.getsize(fname) for fname in files)
+
+    data = [b'headcrab zombie\n' * 1024, os.urandom(4096)]
+    passthrough = compression.bench_codec('none', 0, data)
+    assert passthrough['raw_bytes'] == passthrough['encoded_bytes'] == len(data[0]) + len(data[1])
+    fast = compression.bench_codec('gzip', 1, data, repeat=2)
+    assert fast['raw_bytes'] == passthrough['raw_bytes'] * 2
+    assert fast['ratio'] > 1
+    assert ('gzip', 9) in compression.default_codecs()
@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
+import os
+import pytest
+import time
+import steamos_log_submitter as sls
+import steamos_log_submitter.catalog as catalog
+import steamos_log_submitter.ledger as ledger
+from . import count_hits, data_directory, helper_directory, mock_config, patch_module  # NOQA: F401
+
+
+def age(path, seconds=60):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def size(path, name):
+    st = catalog.stat(path, name)
+    assert st
+    return st.st_size
+
+
+async def wait_for(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_list(helper_directory):
+    path = f'{sls.pending}/test'
+    os.mkdir(path)
+    assert catalog.list_logs(path) == []
+    for name in ('a', 'b'):
+        with open(f'{path}/{name}', 'w'):
+            pass
+    assert sorted(catalog.list_logs(path)) == ['a', 'b']
+    os.unlink(f'{path}/a')
+    assert catalog.list_logs(path) == ['b']
+
+
+def test_list_missing(helper_directory):
+    with pytest.raises(FileNotFoundError):
+        catalog.list_logs(f'{sls.pending}/test')
+    assert catalog.stat(f'{sls.pending}/test', 'a') is None
+
+
+def test_unchanged_directory(helper_directory, count_hits, monkeypatch):
+    path = f'{sls.pending}/test'
+    os.mkdir(path)
+    with open(f'{path}/a', 'w'):
+        pass
+    age(path)
+    scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: count_hits() or scandir(path))
+
+    assert catalog.list_logs(path) == ['a']
+    assert count_hits.hits == 1
+    assert catalog.list_logs(path) == ['a']
+    assert count_hits.hits == 1
+
+    with open(f'{path}/b', 'w'):
+        pass
+    assert sorted(catalog.list_logs(path)) == ['a', 'b']
+    assert count_hits.hits == 2
+
+
+def test_racy_directory(helper_directory, count_hits, monkeypatch):
+    path = f'{sls.pending}/test'
+    os.mkdir(path)
+    scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: count_hits() or scandir(path))
+
+    # Recently modified directories might change without the mtime moving
+    catalog.list_logs(path)
+    catalog.list_logs(path)
+    assert count_hits.hits == 2
+
+
+def test_stat_unwatched(helper_directory):
+    path = f'{sls.pending}/test'
+    os.mkdir(path)
+    with open(f'{path}/a', 'w') as f:
+        f.write('text')
+    age(path)
+    assert size(path, 'a') == 4
+    with open(f'{path}/a', 'a') as f:
+        f.write('text')
+    assert size(path, 'a') == 8
+    assert catalog.stat(path, 'b') is None
+
+
+@pytest.mark.asyncio
+async def test_stat_watched(helper_directory, monkeypatch):
+    path = f'{sls.pending}/test'
+    os.mkdir(path)
+    with open(f'{path}/a', 'w') as f:
+        f.write('text')
+    age(path)
+    catalog.watch()
+    try:
+        assert size(path, 'a') == 4
+        stat = os.stat
+        monkeypatch.setattr(os, 'stat', lambda path, **kwargs: pytest.fail(path) if path.endswith('/a') else stat(path, **kwargs))
+        assert size(path, 'a') == 4
+        monkeypatch.setattr(os, 'stat', stat)
+
+        with open(f'{path}/a', 'a') as f:
+            f.write('text')
+        await wait_for(lambda: size(path, 'a') == 8)
+        assert size(path, 'a') == 8
+    finally:
+        catalog.unwatch()
+
+
+@pytest.mark.asyncio
+async def test_rewatch(helper_directory):
+    path = f'{sls.pending}/test'
+    os.mkdir(path)
+    with open(f'{path}/a', 'w') as f:
+        f.write('text')
+    age(path)
+    catalog.watch()
+    try:
+        assert size(path, 'a') == 4
+        catalog.unwatch()
+        # Changes made while nothing is watching get picked up afterwards
+        with open(f'{path}/a', 'a') as f:
+            f.write('text')
+        catalog.watch()
+        assert size(path, 'a') == 8
+    finally:
+        catalog.unwatch()
+
+
+def test_entries(helper_directory, data_directory, mock_config):
+    os.mkdir(f'{sls.pending}/test')
+    os.mkdir(f'{sls.failed}/test')
+    with open(f'{sls.pending}/test/a', 'w') as f:
+        f.write('text')
+    with open(f'{sls.failed}/test/b', 'w') as f:
+        f.write('headcrab')
+    ledger.record_failure('test', 'a', 'TRANSIENT_ERROR')
+
+    entry, = catalog.entries('test', 'pending')
+    assert entry.name == 'a'
+    assert entry.size == 4
+    assert entry.state == 'pending'
+    assert entry.attempts == 1
+    assert entry.mtime == os.stat(f'{sls.pending}/test/a').st_mtime
+
+    entry, = catalog.entries('test', 'failed')
+    assert entry.name == 'b'
+    assert entry.size == 8
+    assert entry.state == 'failed'
+    assert entry.attempts == 0
+
+    assert catalog.entries('test', 'uploaded') == []
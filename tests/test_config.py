@@ -5,11 +5,14 @@
 # Maintainer: Vicki Pfau <vi@endrift.com>
 import builtins
 import configparser
-import io
 import os
 import pwd
+import pytest
+import tempfile
 import steamos_log_submitter as sls
 import steamos_log_submitter.config as config
+import steamos_log_submitter.metrics as metrics
+import steamos_log_submitter.writeback as writeback
 from . import CustomConfig
 from . import always_raise, fake_pwuid  # NOQA: F401
 
@@ -107,35 +110,50 @@ def test_local_contains(monkeypatch):
 
 
 def test_write_setting(monkeypatch):
-    class MockIO(io.StringIO):
-        def close(self):
-            self.finalvalue = self.getvalue()
-            super(MockIO, self).close()
-
-    def fake_open(io):
-        def ret(path, mode):
-            return io
-        return ret
-
-    first = MockIO()
-    second = MockIO()
-
-    testconf = configparser.ConfigParser(delimiters='=')
-    monkeypatch.setattr(config, 'local_config', testconf)
-    monkeypatch.setattr(config, 'local_config_path', 'cfg')
-    section = config.ConfigSection('test')
-
-    monkeypatch.setattr(builtins, 'open', fake_open(first))
-    config.write_config()
-    assert not first.finalvalue
-
-    monkeypatch.setattr(builtins, 'open', fake_open(second))
-    section['nothing'] = '1'
-    config.write_config()
-    assert second.finalvalue == """[test]
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        testconf = configparser.ConfigParser(delimiters='=')
+        monkeypatch.setattr(config, 'local_config', testconf)
+        monkeypatch.setattr(config, 'local_config_path', f'{d}/cfg')
+        section = config.ConfigSection('test')
+
+        config.write_config()
+        with open(f'{d}/cfg') as f:
+            assert not f.read()
+
+        section['nothing'] = '1'
+        config.write_config()
+        with open(f'{d}/cfg') as f:
+            assert f.read() == """[test]
 nothing = 1
 
 """
+        assert os.listdir(d) == ['cfg']
+
+
+@pytest.mark.asyncio
+async def test_write_debounced(monkeypatch):
+    metrics.reset()
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        testconf = configparser.ConfigParser(delimiters='=')
+        monkeypatch.setattr(config, 'local_config', testconf)
+        monkeypatch.setattr(config, 'local_config_path', f'{d}/cfg')
+        section = config.ConfigSection('test')
+
+        writeback.start()
+        try:
+            for i in range(3):
+                section['nothing'] = str(i)
+                config.write_config()
+            assert not os.access(f'{d}/cfg', os.F_OK)
+        finally:
+            writeback.stop()
+        with open(f'{d}/cfg') as f:
+            assert f.read() == """[test]
+nothing = 2
+
+"""
+        assert metrics.get('writeback.coalesced') == 2
+        assert metrics.get('writeback.writes') == 1
 
 
 def test_get_config_out_of_scope():
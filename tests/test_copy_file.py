@@ -0,0 +1,101 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import fcntl
+import os
+import pytest
+import tempfile
+import steamos_log_submitter as sls
+
+
+@pytest.fixture
+def copy_directory(monkeypatch):
+    monkeypatch.setattr(sls.metrics, '_values', {})
+    d = tempfile.TemporaryDirectory(prefix='sls-')
+    with open(f'{d.name}/source.zip', 'wb') as f:
+        f.write(b'PK\x03\x04' + os.urandom(4096))
+    yield d.name
+    del d
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def fail(*args, **kwargs):
+    raise OSError('not supported')
+
+
+def test_link(copy_directory):
+    assert sls.util.copy_file(f'{copy_directory}/source.zip', f'{copy_directory}/dest.zip') == 'link'
+    assert os.stat(f'{copy_directory}/dest.zip').st_ino == os.stat(f'{copy_directory}/source.zip').st_ino
+    assert sls.metrics.get('copy_file.link') == 1
+    assert sls.metrics.get('copy_file.bytes') == 4100
+    assert sls.metrics.get('copy_file.count') == 1
+
+
+def test_link_other_owner(copy_directory, monkeypatch):
+    monkeypatch.setattr(os, 'geteuid', lambda: os.getuid() + 1)
+    monkeypatch.setattr(fcntl, 'ioctl', fail)
+    assert sls.util.copy_file(f'{copy_directory}/source.zip', f'{copy_directory}/dest.zip') == 'copy_file_range'
+    assert os.stat(f'{copy_directory}/dest.zip').st_ino != os.stat(f'{copy_directory}/source.zip').st_ino
+    assert read(f'{copy_directory}/dest.zip') == read(f'{copy_directory}/source.zip')
+
+
+def test_reflink(copy_directory, monkeypatch):
+    ioctls = []
+    monkeypatch.setattr(os, 'link', fail)
+    monkeypatch.setattr(fcntl, 'ioctl', lambda *args: ioctls.append(args))
+    assert sls.util.copy_file(f'{copy_directory}/source.zip', f'{copy_directory}/dest.zip') == 'reflink'
+    (_, request, _), = ioctls
+    assert request == sls.util.FICLONE
+
+
+def test_copy_file_range(copy_directory, monkeypatch):
+    monkeypatch.setattr(os, 'link', fail)
+    monkeypatch.setattr(fcntl, 'ioctl', fail)
+    assert sls.util.copy_file(f'{copy_directory}/source.zip', f'{copy_directory}/dest.zip') == 'copy_file_range'
+    assert read(f'{copy_directory}/dest.zip') == read(f'{copy_directory}/source.zip')
+
+
+def test_byte_copy(copy_directory, monkeypatch):
+    monkeypatch.setattr(os, 'link', fail)
+    monkeypatch.setattr(fcntl, 'ioctl', fail)
+    # Some filesystems copy nothing instead of failing
+    monkeypatch.setattr(os, 'copy_file_range', lambda *args: 0)
+    assert sls.util.copy_file(f'{copy_directory}/source.zip', f'{copy_directory}/dest.zip') == 'copy'
+    assert read(f'{copy_directory}/dest.zip') == read(f'{copy_directory}/source.zip')
+    assert sls.metrics.get('copy_file.copy') == 1
+
+
+def test_symlink_not_linked(copy_directory, monkeypatch):
+    monkeypatch.setattr(fcntl, 'ioctl', fail)
+    os.symlink(f'{copy_directory}/source.zip', f'{copy_directory}/symlink.zip')
+    assert sls.util.copy_file(f'{copy_directory}/symlink.zip', f'{copy_directory}/dest.zip') == 'copy_file_range'
+    assert not os.path.islink(f'{copy_directory}/dest.zip')
+
+
+def test_not_regular(copy_directory):
+    os.mkdir(f'{copy_directory}/directory.zip')
+    os.mkfifo(f'{copy_directory}/fifo.zip')
+    for name in ('directory.zip', 'fifo.zip'):
+        with pytest.raises(ValueError):
+            sls.util.copy_file(f'{copy_directory}/{name}', f'{copy_directory}/dest.zip')
+    assert not os.path.exists(f'{copy_directory}/dest.zip')
+
+
+def test_exists(copy_directory, monkeypatch):
+    monkeypatch.setattr(fcntl, 'ioctl', fail)
+    with open(f'{copy_directory}/dest.zip', 'wb') as f:
+        f.write(b'crowbar')
+    with pytest.raises(FileExistsError):
+        sls.util.copy_file(f'{copy_directory}/source.zip', f'{copy_directory}/dest.zip')
+    assert read(f'{copy_directory}/dest.zip') == b'crowbar'
+
+
+def test_missing(copy_directory):
+    with pytest.raises(FileNotFoundError):
+        sls.util.copy_file(f'{copy_directory}/missing.zip', f'{copy_directory}/dest.zip')
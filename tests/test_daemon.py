@@ -177,6 +177,22 @@ async def test_helper_submit_enabled(count_hits, helper_directory, mock_config,
     await daemon.shutdown()
 
 
+@pytest.mark.asyncio
+async def test_helper_list_retries(helper_directory, monkeypatch):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': 'abc'})
+    entry = sls.ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+    sls.ledger.record_failure('test', 'gone', 'TRANSIENT_ERROR')
+
+    daemon, bus = await dbus_daemon(monkeypatch)
+    helper = sls.dbus.DBusObject(bus, f'{sls.constants.DBUS_ROOT}/helpers/Test')
+    iface = await helper.interface(f'{sls.constants.DBUS_NAME}.Helper')
+
+    assert await iface.list_retries() == {'log': [1, 0, entry['next_attempt'], 'TRANSIENT_ERROR']}
+
+    await daemon.shutdown()
+
+
 @pytest.mark.asyncio
 async def test_helper_extract(helper_directory, monkeypatch):
     setup_categories(['test'])
@@ -279,6 +295,18 @@ async def test_inhibited(mock_config, monkeypatch):
     await daemon.shutdown()
 
 
+@pytest.mark.asyncio
+async def test_metrics(mock_config, monkeypatch):
+    monkeypatch.setattr(sls.metrics, '_values', {})
+    daemon, bus = await dbus_daemon(monkeypatch)
+    manager = sls.dbus.DBusObject(bus, f'{sls.constants.DBUS_ROOT}/Manager')
+    props = manager.properties(f'{sls.constants.DBUS_NAME}.Manager')
+    assert await props['Metrics'] == {}
+    sls.metrics.observe('copy_file', 0.5)
+    assert await props['Metrics'] == {'copy_file.count': 1, 'copy_file.seconds': 0.5, 'copy_file.max': 0.5}
+    await daemon.shutdown()
+
+
 @pytest.mark.asyncio
 async def test_get_log_level(mock_config, monkeypatch):
     mock_config.add_section('logging')
@@ -970,3 +998,160 @@ async def test_last_collected_timestamp(helper_directory, mock_config, monkeypat
     assert time.time() - typing.cast(int, await props['LastCollected']) <= 2
 
     await daemon.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_new_log_submitted(count_hits, helper_directory, mock_config, monkeypatch, patch_module):
+    setup_categories(['test'])
+    count_hits.ret = sls.helpers.HelperResult.OK
+    patch_module.submit = awaitable(count_hits)
+    monkeypatch.setattr(sls.util, 'check_network', lambda: True)
+    monkeypatch.setattr(sls.daemon.Daemon, 'NEW_LOG_DELAY', 0.05)
+
+    daemon, bus = await dbus_daemon(monkeypatch)
+    await daemon.enable(True)
+    setup_logs(helper_directory, {'test/log': '', 'test/.hidden': ''})
+    await asyncio.sleep(0.02)
+    assert count_hits.hits == 0
+    await asyncio.sleep(0.1)
+    assert count_hits.hits == 1
+    assert os.access(f'{sls.uploaded}/test/log', os.F_OK)
+    assert os.access(f'{sls.pending}/test/.hidden', os.F_OK)
+    assert patch_module.config.get('newest') is not None
+
+    await daemon.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_new_log_debounce(count_hits, helper_directory, mock_config, monkeypatch, patch_module):
+    setup_categories(['test'])
+    submitted = []
+
+    async def submit(only=None):
+        submitted.append({category: sorted(logs) for category, logs in only.items()})
+        return {}
+
+    monkeypatch.setattr(sls.runner, 'submit', submit)
+    monkeypatch.setattr(sls.daemon.Daemon, 'NEW_LOG_DELAY', 0.05)
+
+    daemon, bus = await dbus_daemon(monkeypatch)
+    await daemon.enable(True)
+    for i in range(3):
+        setup_logs(helper_directory, {f'test/log{i}': ''})
+        await asyncio.sleep(0.02)
+    assert not submitted
+    await asyncio.sleep(0.1)
+    assert submitted == [{'test': ['log0', 'log1', 'log2']}]
+
+    await daemon.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_new_log_ignored(count_hits, helper_directory, mock_config, monkeypatch, patch_module):
+    setup_categories(['test'])
+    monkeypatch.setattr(sls.runner, 'submit', awaitable(count_hits))
+    monkeypatch.setattr(sls.daemon.Daemon, 'NEW_LOG_DELAY', 0.05)
+
+    daemon, bus = await dbus_daemon(monkeypatch)
+    await daemon.enable(True)
+    setup_logs(helper_directory, {'test/.lock': ''})
+    os.makedirs(f'{sls.uploaded}/test', exist_ok=True)
+    daemon._new_log(f'{sls.uploaded}/test', 'log')
+    await asyncio.sleep(0.02)
+    assert daemon._new_log_task is None
+    assert not daemon._new_logs
+    await asyncio.sleep(0.1)
+    assert count_hits.hits == 0
+
+    await daemon.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_new_log_disabled(count_hits, helper_directory, mock_config, monkeypatch, patch_module):
+    setup_categories(['test'])
+    monkeypatch.setattr(sls.runner, 'submit', awaitable(count_hits))
+    monkeypatch.setattr(sls.daemon.Daemon, 'NEW_LOG_DELAY', 0.05)
+
+    daemon, bus = await dbus_daemon(monkeypatch)
+    setup_logs(helper_directory, {'test/log': ''})
+    await asyncio.sleep(0.1)
+    assert count_hits.hits == 0
+
+    await daemon.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_new_log_shutdown(count_hits, helper_directory, mock_config, monkeypatch, patch_module):
+    setup_categories(['test'])
+    monkeypatch.setattr(sls.runner, 'submit', awaitable(count_hits))
+    monkeypatch.setattr(sls.daemon.Daemon, 'NEW_LOG_DELAY', 0.05)
+
+    daemon, bus = await dbus_daemon(monkeypatch)
+    await daemon.enable(True)
+    setup_logs(helper_directory, {'test/log': ''})
+    await asyncio.sleep(0.02)
+    await daemon.shutdown()
+    assert daemon._new_log_task is None
+    assert daemon._watcher is None
+    await asyncio.sleep(0.05)
+    assert count_hits.hits == 0
+
+
+@pytest.mark.asyncio
+async def test_shutdown_cancels_trigger(count_hits, mock_config, monkeypatch):
+    cancelled = False
+
+    async def trigger():
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        count_hits()
+        return [], []
+
+    daemon, bus = await dbus_daemon(monkeypatch)
+    monkeypatch.setattr(sls.runner, 'trigger', trigger)
+    await daemon.enable(True)
+    await daemon.trigger(wait=False)
+    await asyncio.sleep(0.01)
+    assert daemon._trigger_active
+
+    start = time.time()
+    await daemon.shutdown()
+    assert time.time() - start < 0.5
+    assert cancelled
+    assert count_hits.hits == 0
+    assert not daemon._trigger_active
+    assert daemon._async_trigger is None
+
+
+@pytest.mark.asyncio
+async def test_suspend_cancels_trigger(count_hits, mock_dbus, mock_config, monkeypatch):
+    target = MockDBusObject('org.freedesktop.systemd1', '/org/freedesktop/systemd1/unit/suspend_2etarget', mock_dbus)
+    target.properties['org.freedesktop.systemd1.Unit'] = {
+        'ActiveState': 'inactive'
+    }
+    props = MockDBusProperties(target, 'org.freedesktop.systemd1.Unit')
+
+    async def trigger():
+        await asyncio.sleep(1)
+        count_hits()
+        return [], []
+
+    monkeypatch.setattr(sls.runner, 'trigger', trigger)
+    daemon = sls.daemon.Daemon()
+    daemon.WAKEUP_DELAY = 0.01
+    await daemon.start()
+    await daemon.enable(True)
+    waiter = asyncio.create_task(daemon.trigger(wait=True))
+    await asyncio.sleep(0.01)
+    assert daemon._trigger_active
+
+    props['ActiveState'] = 'active'
+    await asyncio.sleep(0.02)
+    assert daemon._suspend == 'active'
+    assert not daemon._trigger_active
+    assert waiter.done()
+    assert count_hits.hits == 0
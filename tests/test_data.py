@@ -3,12 +3,15 @@
 #
 # Copyright (c) 2023 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
+import builtins
 import json
 import os
 import pytest
+import sqlite3
 import time
 import steamos_log_submitter.data as data
-from . import data_directory  # NOQA: F401
+import steamos_log_submitter.writeback as writeback
+from . import always_raise, count_hits, data_directory, mock_config  # NOQA: F401
 
 
 @pytest.fixture(autouse=True)
@@ -172,3 +175,166 @@ def test_names(data_directory):
 
     d = data.get_data('steamos_log_submitter')
     assert d is data.datastore['sls']
+
+
+def test_delete_key(data_directory):
+    d = data.get_data('test')
+    d['foo'] = 1
+    d['bar'] = 2
+    d.write()
+    assert set(d.keys()) == {'foo', 'bar'}
+
+    del d['foo']
+    assert 'foo' not in d
+    assert set(d.keys()) == {'bar'}
+    d.write()
+    with open(f'{data_directory}/test.json') as f:
+        assert json.load(f) == {"bar": 2}
+
+
+@pytest.mark.asyncio
+async def test_write_debounced(data_directory):
+    d = data.get_data('test')
+    writeback.start()
+    try:
+        d['foo'] = 1
+        d.write()
+        d['foo'] = 2
+        d.write()
+        assert not os.access(f'{data_directory}/test.json', os.F_OK)
+    finally:
+        writeback.stop()
+    assert not d._dirty
+    assert os.listdir(data_directory) == ['test.json']
+    with open(f'{data_directory}/test.json') as f:
+        assert json.load(f) == {'foo': 2}
+
+
+@pytest.mark.asyncio
+async def test_write_sync(data_directory, count_hits, monkeypatch):
+    d = data.get_data('test')
+    writeback.start()
+    try:
+        d['foo'] = 1
+        d.write()
+        d['foo'] = 2
+        d.write(sync=True)
+        with open(f'{data_directory}/test.json') as f:
+            assert json.load(f) == {'foo': 2}
+        monkeypatch.setattr(d, '_write', count_hits)
+    finally:
+        writeback.stop()
+    # Nothing is left to be written later
+    assert count_hits.hits == 0
+
+
+def test_write_error(data_directory, monkeypatch):
+    d = data.get_data('test')
+    d['foo'] = 1
+    monkeypatch.setattr(os, 'replace', always_raise(OSError))
+    d.write()
+    assert d._dirty
+    with pytest.raises(OSError):
+        d.write(sync=True)
+
+
+@pytest.fixture
+def sqlite_backend(mock_config):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'data-backend', 'sqlite')
+
+
+def reopen(name):
+    del data.datastore[name]
+    return data.get_data(name)
+
+
+def test_sqlite_write(data_directory, sqlite_backend):
+    d = data.get_data('test', defaults={'baz': 3})
+    assert type(d) is data.SqliteDataStore
+    assert d['baz'] == 3
+    d['foo'] = 1
+    d['bar'] = {'crowbar': [1, 2]}
+    d.write()
+    assert not os.access(f'{data_directory}/test.json', os.F_OK)
+
+    d = reopen('test')
+    assert d['foo'] == 1
+    assert d['bar'] == {'crowbar': [1, 2]}
+    assert 'baz' not in d
+
+    del d['foo']
+    d['bar'] = 2
+    d.write()
+    d = reopen('test')
+    assert set(d.keys()) == {'bar'}
+    assert d['bar'] == 2
+
+    db = sqlite3.connect(f'{data_directory}/data.sqlite3')
+    assert db.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+    db.close()
+
+
+def test_sqlite_changed_keys(data_directory, sqlite_backend):
+    d = data.get_data('test')
+    for i in range(10):
+        d[f'key{i}'] = i
+    d.write()
+
+    statements: list[str] = []
+    data._connect().set_trace_callback(statements.append)
+    try:
+        d['key5'] = 'headcrab'
+        d.write()
+        d.write()
+    finally:
+        data._connect().set_trace_callback(None)
+    assert len([statement for statement in statements if 'key5' in statement]) == 1
+    assert not [statement for statement in statements if 'key4' in statement]
+    assert reopen('test')['key5'] == 'headcrab'
+
+
+def test_sqlite_separate_tables(data_directory, sqlite_backend):
+    d1 = data.get_data('test')
+    d2 = data.get_data('helpers.test')
+    d1['foo'] = 1
+    d2['foo'] = 2
+    data.write_all()
+    assert reopen('test')['foo'] == 1
+    assert reopen('helpers.test')['foo'] == 2
+
+
+def test_sqlite_migrate(data_directory, sqlite_backend):
+    with open(f'{data_directory}/test.json', 'w') as f:
+        json.dump({'foo': 1, 'bar': 'baz'}, f)
+    d = data.get_data('test')
+    assert d['foo'] == 1
+    assert d['bar'] == 'baz'
+    assert not os.access(f'{data_directory}/test.json', os.F_OK)
+
+    d = reopen('test')
+    assert d['foo'] == 1
+    assert d['bar'] == 'baz'
+
+
+def test_sqlite_migrate_unreadable(data_directory, sqlite_backend, monkeypatch):
+    with open(f'{data_directory}/test.json', 'w') as f:
+        json.dump({'foo': 1}, f)
+    with monkeypatch.context() as m:
+        m.setattr(builtins, 'open', always_raise(PermissionError))
+        d = data.get_data('test')
+        assert 'foo' not in d
+    assert os.access(f'{data_directory}/test.json', os.F_OK)
+
+    assert reopen('test')['foo'] == 1
+    assert not os.access(f'{data_directory}/test.json', os.F_OK)
+
+
+def test_sqlite_migrated_table_wins(data_directory, sqlite_backend):
+    d = data.get_data('test')
+    d['foo'] = 1
+    d.write()
+    # A leftover JSON file from an interrupted migration is ignored
+    with open(f'{data_directory}/test.json', 'w') as f:
+        json.dump({'foo': 2}, f)
+    assert reopen('test')['foo'] == 1
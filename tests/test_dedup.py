@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import httpx
+import pytest
+import random
+import time
+import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators.sentry as sentry
+import steamos_log_submitter.dedup as dedup
+import steamos_log_submitter.helpers as helpers
+from . import data_directory  # NOQA: F401
+
+DSN = 'https://fake@dsn/0'
+
+
+def test_key():
+    assert dedup.key([], {}) is None
+    key = dedup.key(['comm:hl2', 'appid:220'], {'executable': 'hl2'})
+    assert key == dedup.key(['appid:220', 'comm:hl2'], {'executable': 'hl2'})
+    assert key != dedup.key(['appid:220', 'comm:hl2'], {'executable': 'hl2', 'build_id': '0'})
+    assert key != dedup.key(['appid:220', 'comm:hl2'], {'executable': 'hl2'}, 'crash')
+
+
+def test_window(data_directory):
+    now = time.time()
+    assert dedup.check(DSN, 'key', 60, now=now) == 0
+    dedup.record_upload(DSN, 'key', 60, now=now)
+    assert dedup.check(DSN, 'key', 60, now=now + 10) is None
+    assert dedup.check(DSN, 'key', 60, now=now + 20) is None
+    assert dedup.check(DSN, 'other', 60, now=now + 20) == 0
+    entry = dedup.get(DSN, 'key')
+    assert entry
+    assert entry['suppressed'] == 2
+
+    assert dedup.check(DSN, 'key', 60, now=now + 61) == 2
+    dedup.record_upload(DSN, 'key', 60, 2, now=now + 61)
+    entry = dedup.get(DSN, 'key')
+    assert entry
+    assert entry['suppressed'] == 0
+    assert entry['total'] == 4
+    assert entry['last_upload'] == now + 61
+    assert entry['first_seen'] == now
+
+
+def test_sample_rate(data_directory, monkeypatch):
+    now = time.time()
+    dedup.record_upload(DSN, 'key', 60, now=now)
+    monkeypatch.setattr(random, 'random', lambda: 0.25)
+    assert dedup.check(DSN, 'key', 60, 0.2, now=now + 1) is None
+    assert dedup.check(DSN, 'key', 60, 0.5, now=now + 2) == 1
+    dedup.record_upload(DSN, 'key', 60, 1, now=now + 2)
+    # Sampled uploads don't restart the window
+    entry = dedup.get(DSN, 'key')
+    assert entry
+    assert entry['last_upload'] == now
+
+
+def test_expired_pruned(data_directory):
+    now = time.time()
+    dedup.record_upload(DSN, 'old', 60, now=now - dedup.MAX_AGE - 1)
+    dedup.record_upload(DSN, 'new', 60, now=now)
+    assert set(dedup.entries(DSN)) == {'new'}
+
+
+def test_malformed(data_directory):
+    sls.data.get_data('steamos_log_submitter.dedup')[DSN] = {'key': {'suppressed': 'many'}, 'other': 'entry'}
+    assert dedup.entries(DSN) == {}
+    assert dedup.check(DSN, 'key', 60) == 0
+    sls.data.get_data('steamos_log_submitter.dedup')[DSN] = 'entries'
+    assert dedup.entries(DSN) == {}
+
+
+@pytest.mark.asyncio
+async def test_sentry_storm(data_directory, monkeypatch):
+    posted = []
+
+    async def fake_response(self, url, **kwargs):
+        posted.append(kwargs)
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+
+    def make_event():
+        event = sentry.SentryEvent(DSN, dedup=(60, 0))
+        event.appid = 220
+        event.fingerprint = ['comm:hl2']
+        event.tags = {'executable': 'hl2'}
+        return event
+
+    assert await make_event().send() == helpers.HelperResult.OK
+    assert len(posted) == 1
+    for _ in range(3):
+        assert await make_event().send() == helpers.HelperResult.OK
+    assert len(posted) == 1
+
+    entry, = dedup.entries(DSN).values()
+    assert entry['suppressed'] == 3
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert await make_event().send() == helpers.HelperResult.OK
+    assert len(posted) == 2
+    assert posted[1]['json']['extra']['sls.duplicates'] == 3
+    entry, = dedup.entries(DSN).values()
+    assert entry['suppressed'] == 0
+    assert entry['total'] == 5
+
+
+@pytest.mark.asyncio
+async def test_sentry_failure_not_recorded(data_directory, monkeypatch):
+    async def fake_response(self, url, **kwargs):
+        return httpx.Response(500)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    for _ in range(2):
+        event = sentry.SentryEvent(DSN, dedup=(60, 0))
+        event.fingerprint = ['comm:hl2']
+        assert await event.send() == helpers.HelperResult.TRANSIENT_ERROR
+    entry, = dedup.entries(DSN).values()
+    assert entry['total'] == 0
+    assert entry['suppressed'] == 0
+
+
+@pytest.mark.asyncio
+async def test_minidump_storm(data_directory, monkeypatch):
+    posted = []
+
+    async def fake_response(self, url, **kwargs):
+        posted.append(kwargs)
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    for _ in range(2):
+        event = sentry.MinidumpEvent(DSN, dedup=(60, 0))
+        event.tags = {'executable': 'hl2', 'build_id': 'abcd'}
+        with open(__file__, 'rb') as f:
+            assert await event.send_minidump(f) == helpers.HelperResult.OK
+    assert len(posted) == 1
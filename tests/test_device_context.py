@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import os
+import pytest
+import tempfile
+import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators.sentry as sentry
+from . import count_hits  # NOQA: F401
+
+
+@pytest.fixture
+def fake_context(monkeypatch, count_hits):
+    def branch():
+        count_hits()
+        return 'rel'
+
+    monkeypatch.setattr(sls.util, 'get_steamos_branch', branch)
+    monkeypatch.setattr(sls.util, 'get_build_id', lambda: '20220202.202')
+    monkeypatch.setattr(sls.util, 'get_version_id', lambda: '3.4')
+    monkeypatch.setattr(sls.util, 'telemetry_unit_id', lambda: 'unit')
+    monkeypatch.setattr(sls.util, 'get_dmi_info', lambda: {'vendor': 'Valve', 'product': 'Jupiter'})
+    return count_hits
+
+
+@pytest.mark.asyncio
+async def test_cached(fake_context):
+    context = sls.util.get_device_context()
+    assert context.branch == 'rel'
+    assert context.build_id == '20220202.202'
+    assert context.version_id == '3.4'
+    assert context.product == 'Jupiter'
+    assert context.unit_id == 'unit'
+    assert context.architecture == os.uname().machine
+
+    for _ in range(50):
+        event = sentry.SentryEvent('https://fake@dsn/0')
+        event.seal()
+        event.close()
+    assert sls.util.get_device_context() is context
+    assert fake_context.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidate(fake_context):
+    context = sls.util.get_device_context()
+    sls.util.invalidate_device_context()
+    assert sls.util.get_device_context() is not context
+    assert fake_context.hits == 2
+
+
+@pytest.mark.asyncio
+async def test_os_update(fake_context, monkeypatch):
+    with tempfile.NamedTemporaryFile() as f:
+        monkeypatch.setattr(sls.util, 'DEVICE_CONTEXT_PATHS', (f.name,))
+        context = sls.util.get_device_context()
+        assert sls.util.get_device_context() is context
+        os.utime(f.name, ns=(0, 0))
+        assert sls.util.get_device_context() is not context
+    assert fake_context.hits == 2
+
+
+def test_no_loop(fake_context):
+    sls.util.get_device_context()
+    sls.util.get_device_context()
+    assert fake_context.hits == 2
+
+
+@pytest.mark.asyncio
+async def test_non_steamos(fake_context, monkeypatch):
+    monkeypatch.setattr(sls.util, 'get_steamos_branch', lambda: None)
+    context = sls.util.get_device_context()
+    assert context.build_id is None
+    assert context.version_id is None
+
+
+@pytest.mark.asyncio
+async def test_dmi_error(fake_context, monkeypatch):
+    def dmi_info():
+        raise PermissionError
+
+    monkeypatch.setattr(sls.util, 'get_dmi_info', dmi_info)
+    assert sls.util.get_device_context().product is None
@@ -6,6 +6,7 @@
 import asyncio
 import importlib
 import os
+import pkgutil
 import pytest
 import shutil
 import time
@@ -72,6 +73,67 @@ def test_list_filtering(patch_module):
     assert patch_module.filter_log('xyz.json') is True
 
 
+def test_envelope_only(mock_config, patch_module):
+    assert patch_module.envelope_only()
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'envelope-only', 'off')
+    assert not patch_module.envelope_only()
+
+
+def test_backend(mock_config, patch_module):
+    assert patch_module.backend() is None
+    mock_config.add_section('sls')
+    mock_config.add_section('helpers.test')
+    mock_config.set('sls', 'backend', 'spool')
+    assert patch_module.backend() == 'spool'
+    mock_config.set('helpers.test', 'backend', 'sentry')
+    assert patch_module.backend() == 'sentry'
+
+
+def test_compression(mock_config, patch_module):
+    assert patch_module.compression() == ('auto', None)
+    mock_config.add_section('sls')
+    mock_config.add_section('helpers.test')
+    mock_config.set('sls', 'compression', 'gzip')
+    assert patch_module.compression() == ('gzip', None)
+    mock_config.set('helpers.test', 'compression', 'ZSTD')
+    mock_config.set('helpers.test', 'compression-level', '19')
+    assert patch_module.compression() == ('zstd', 19)
+    mock_config.set('helpers.test', 'compression-level', 'max')
+    assert patch_module.compression() == ('zstd', None)
+
+
+def test_dedup(mock_config, patch_module):
+    assert patch_module.dedup() is None
+    mock_config.add_section('sls')
+    mock_config.add_section('helpers.test')
+    mock_config.set('sls', 'dedup-window', '3600')
+    assert patch_module.dedup() == (3600, 0)
+    mock_config.set('helpers.test', 'dedup-window', '600')
+    mock_config.set('helpers.test', 'dedup-sample-rate', '0.1')
+    assert patch_module.dedup() == (600, 0.1)
+    mock_config.set('helpers.test', 'dedup-sample-rate', '2')
+    assert patch_module.dedup() == (600, 1)
+    mock_config.set('helpers.test', 'dedup-sample-rate', 'often')
+    assert patch_module.dedup() == (600, 0)
+    mock_config.set('helpers.test', 'dedup-window', '0')
+    assert patch_module.dedup() is None
+
+
+def test_create_event(mock_config, patch_module):
+    mock_config.add_section('sls')
+    mock_config.add_section('helpers.test')
+    mock_config.set('sls', 'dedup-window', '3600')
+    mock_config.set('helpers.test', 'dsn', 'https://fake@dsn/0')
+    mock_config.set('helpers.test', 'compression', 'gzip')
+    mock_config.set('helpers.test', 'envelope-only', 'off')
+    event = patch_module.create_event()
+    assert event.dsn == 'https://fake@dsn/0'
+    assert event.compression == ('gzip', None)
+    assert not event.envelope_only
+    assert event.dedup == (3600, 0)
+
+
 def test_invalid_helper_module(patch_module):
     assert helpers.create_helper('test') is not None
     assert helpers.create_helper('foo') is None
@@ -86,10 +148,33 @@ def test_invalid_broken_module(monkeypatch):
         return original_import_module(name, package)
     monkeypatch.setattr(importlib, 'import_module', import_module)
     monkeypatch.setattr(helpers, 'list_helpers', lambda: ['test'])
+    monkeypatch.setattr(helpers, '_registry', {})
 
     assert helpers.create_helper('test') is None
 
 
+def test_helper_registry(count_hits, monkeypatch):
+    monkeypatch.setattr(helpers, '_helpers', None)
+    monkeypatch.setattr(helpers, '_registry', {})
+    iter_modules = pkgutil.iter_modules
+    import_module = importlib.import_module
+    monkeypatch.setattr(pkgutil, 'iter_modules', lambda path: count_hits() or iter_modules(path))
+    monkeypatch.setattr(importlib, 'import_module', lambda name: count_hits() or import_module(name))
+
+    assert 'kdump' in helpers.list_helpers()
+    assert 'kdump' in helpers.list_helpers()
+    assert count_hits.hits == 1
+    kdump = helpers.create_helper('kdump')
+    assert kdump is not None
+    assert helpers.create_helper('kdump') is kdump
+    assert count_hits.hits == 2
+
+    helpers.reload_helpers()
+    assert 'kdump' in helpers.list_helpers()
+    assert helpers.create_helper('kdump') is kdump
+    assert count_hits.hits == 4
+
+
 @pytest.mark.asyncio
 async def test_collect_new_logs(helper_directory, mock_config, patch_module):
     patch_module.valid_extensions = {'.bin'}
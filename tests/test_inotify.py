@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
+import os
+import pytest
+import tempfile
+
+import steamos_log_submitter.inotify as inotify
+
+
+async def wait_for(events, count):
+    for _ in range(100):
+        if len(events) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_new_file():
+    events = []
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        watcher = inotify.Watcher(lambda path, name: events.append((path, name)))
+        watcher.start()
+        watcher.add(d)
+        try:
+            with open(f'{d}/log', 'w') as f:
+                f.write('text')
+            await wait_for(events, 1)
+            assert events == [(d, 'log')]
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_undecodable_name():
+    events = []
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        watcher = inotify.Watcher(lambda path, name: events.append((path, name)))
+        watcher.start()
+        watcher.add(d)
+        try:
+            with open(os.fsencode(d) + b'/log\xff', 'w') as f:
+                f.write('text')
+            await wait_for(events, 1)
+            assert events == [(d, os.fsdecode(b'log\xff'))]
+            assert os.access(f'{d}/{events[0][1]}', os.F_OK)
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_moved_file():
+    events = []
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        os.mkdir(f'{d}/watched')
+        with open(f'{d}/log', 'w') as f:
+            f.write('text')
+        watcher = inotify.Watcher(lambda path, name: events.append((path, name)))
+        watcher.start()
+        watcher.add(f'{d}/watched')
+        try:
+            os.rename(f'{d}/log', f'{d}/watched/log')
+            await wait_for(events, 1)
+            assert events == [(f'{d}/watched', 'log')]
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_open_no_event():
+    events = []
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        watcher = inotify.Watcher(lambda path, name: events.append((path, name)))
+        watcher.start()
+        watcher.add(d)
+        try:
+            with open(f'{d}/log', 'w') as f:
+                f.write('text')
+                await asyncio.sleep(0.05)
+                assert not events
+            await wait_for(events, 1)
+            assert events == [(d, 'log')]
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_remove_watch():
+    events = []
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        watcher = inotify.Watcher(lambda path, name: events.append((path, name)))
+        watcher.start()
+        watcher.add(d)
+        assert watcher.paths == [d]
+        watcher.remove(d)
+        assert watcher.paths == []
+        try:
+            with open(f'{d}/log', 'w') as f:
+                f.write('text')
+            await asyncio.sleep(0.05)
+            assert not events
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_missing_directory():
+    watcher = inotify.Watcher(lambda path, name: None)
+    watcher.start()
+    try:
+        with pytest.raises(FileNotFoundError):
+            watcher.add('/nonexistent')
+    finally:
+        watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_callback_error():
+    events = []
+
+    def callback(path, name):
+        events.append(name)
+        raise RuntimeError
+
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        watcher = inotify.Watcher(callback)
+        watcher.start()
+        watcher.add(d)
+        try:
+            for name in ('a', 'b'):
+                with open(f'{d}/{name}', 'w') as f:
+                    f.write('text')
+            await wait_for(events, 2)
+            assert events == ['a', 'b']
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_listen():
+    written = []
+    deleted = []
+    with tempfile.TemporaryDirectory(prefix='sls-') as d:
+        watcher = inotify.Watcher(lambda path, name: written.append(name))
+        watcher.start()
+        watcher.add(d)
+        # Directories that are already watched start reporting the new events
+        watcher.listen(lambda path, name: deleted.append(name), inotify.IN_DELETE)
+        try:
+            with open(f'{d}/log', 'w') as f:
+                f.write('text')
+            os.unlink(f'{d}/log')
+            await wait_for(deleted, 1)
+            assert written == ['log']
+            assert deleted == ['log']
+        finally:
+            watcher.close()
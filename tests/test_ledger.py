@@ -0,0 +1,180 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import json
+import os
+import pytest
+import time
+import typing
+import steamos_log_submitter as sls
+import steamos_log_submitter.helpers as helpers
+import steamos_log_submitter.ledger as ledger
+from steamos_log_submitter.runner import submit
+from steamos_log_submitter.types import JSONEncodable
+from . import awaitable, setup_categories, setup_logs
+from . import count_hits, data_directory, helper_directory, mock_config, online, patch_module  # NOQA: F401
+
+
+def test_backoff(data_directory, mock_config):
+    assert ledger.eligible('test', 'log')
+    entry = ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+    assert entry['attempts'] == 1
+    assert entry['next_attempt'] - entry['last_attempt'] == 900
+    assert not ledger.eligible('test', 'log')
+    assert ledger.eligible('test', 'log', now=entry['next_attempt'])
+
+    entry = ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+    assert entry['attempts'] == 2
+    assert entry['next_attempt'] - entry['last_attempt'] == 1800
+
+
+def test_backoff_config(data_directory, mock_config):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'retry-backoff', '10')
+    mock_config.set('sls', 'retry-backoff-max', '25')
+    delays = []
+    for _ in range(4):
+        entry = ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+        delays.append(entry['next_attempt'] - entry['last_attempt'])
+    assert delays == [10, 20, 25, 25]
+
+
+def test_clear(data_directory, mock_config):
+    ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+    ledger.record_failure('test', 'log2', 'TRANSIENT_ERROR')
+    ledger.record_failure('test2', 'log', 'TRANSIENT_ERROR')
+    assert set(ledger.entries('test')) == {'log', 'log2'}
+    ledger.clear('test', 'log')
+    assert set(ledger.entries('test')) == {'log2'}
+    assert set(ledger.entries('test2')) == {'log'}
+
+
+def test_prune(data_directory, mock_config):
+    ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+    ledger.record_failure('test', 'log2', 'TRANSIENT_ERROR')
+    ledger.record_failure('test2', 'log', 'TRANSIENT_ERROR')
+    ledger.prune('test', ['log2'])
+    assert set(ledger.entries('test')) == {'log2'}
+    assert set(ledger.entries('test2')) == {'log'}
+
+
+def test_malformed(data_directory, mock_config):
+    sls.data.get_data('steamos_log_submitter.ledger')['test/log'] = 'garbage'
+    assert ledger.get('test', 'log') is None
+    assert ledger.eligible('test', 'log')
+
+
+@pytest.mark.asyncio
+async def test_transient_recorded(helper_directory, online, patch_module, count_hits):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+    count_hits.ret = helpers.HelperResult.TRANSIENT_ERROR
+
+    patch_module.submit = awaitable(count_hits)
+    await submit()
+    assert count_hits.hits == 1
+
+    entry = ledger.get('test', 'log')
+    assert entry
+    assert entry['attempts'] == 1
+    assert entry['error'] == 'TRANSIENT_ERROR'
+    with open(f'{sls.data.data_root}/ledger.json') as f:
+        assert 'test/log' in json.load(f)
+
+    await submit()
+    assert count_hits.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_reason_recorded(helper_directory, online, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+
+    async def fake_submit(fname):
+        helpers.set_failure_reason('HTTP 502: Bad Gateway')
+        return helpers.HelperResult.TRANSIENT_ERROR
+
+    patch_module.submit = fake_submit
+    await submit()
+
+    entry = ledger.get('test', 'log')
+    assert entry
+    assert entry['error'] == 'HTTP 502: Bad Gateway'
+
+
+@pytest.mark.asyncio
+async def test_exception_recorded(helper_directory, online, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+
+    async def fake_submit(fname):
+        raise RuntimeError('oops')
+
+    patch_module.submit = fake_submit
+    await submit()
+
+    entry = ledger.get('test', 'log')
+    assert entry
+    assert entry['error'] == 'RuntimeError: oops'
+
+
+@pytest.mark.asyncio
+async def test_retry_after_backoff(helper_directory, online, patch_module, count_hits):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+    count_hits.ret = helpers.HelperResult.TRANSIENT_ERROR
+
+    patch_module.submit = awaitable(count_hits)
+    await submit()
+    assert count_hits.hits == 1
+
+    entry = ledger.get('test', 'log')
+    assert entry
+    entry['next_attempt'] = time.time() - 1
+    sls.data.get_data('steamos_log_submitter.ledger')['test/log'] = typing.cast(dict[str, JSONEncodable], entry)
+    count_hits.ret = helpers.HelperResult.OK
+    await submit()
+    assert count_hits.hits == 2
+    assert ledger.get('test', 'log') is None
+    assert os.access(f'{sls.uploaded}/test/log', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_permanent_cleared(helper_directory, online, patch_module, count_hits):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+    ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+    entry = ledger.get('test', 'log')
+    assert entry
+    entry['next_attempt'] = 0
+    sls.data.get_data('steamos_log_submitter.ledger')['test/log'] = typing.cast(dict[str, JSONEncodable], entry)
+    count_hits.ret = helpers.HelperResult.PERMANENT_ERROR
+
+    patch_module.submit = awaitable(count_hits)
+    await submit()
+    assert count_hits.hits == 1
+    assert ledger.get('test', 'log') is None
+
+
+@pytest.mark.asyncio
+async def test_stale_pruned(helper_directory, online, patch_module, count_hits):
+    setup_categories(['test'])
+    ledger.record_failure('test', 'gone', 'TRANSIENT_ERROR')
+
+    patch_module.submit = awaitable(count_hits)
+    await submit()
+    assert ledger.get('test', 'gone') is None
+
+
+def test_timeouts_counted(data_directory, mock_config):
+    entry = ledger.record_failure('test', 'log', 'Timed out', timeout=True)
+    assert entry['attempts'] == 1
+    assert entry['timeouts'] == 1
+    entry = ledger.record_failure('test', 'log', 'TRANSIENT_ERROR')
+    assert entry['attempts'] == 2
+    assert entry['timeouts'] == 1
+    entry = ledger.record_failure('test', 'log', 'Timed out', timeout=True)
+    assert entry['attempts'] == 3
+    assert entry['timeouts'] == 2
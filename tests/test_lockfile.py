@@ -3,10 +3,12 @@
 #
 # Copyright (c) 2022 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
 import builtins
 import os
 import pytest
 import time
+import steamos_log_submitter.metrics as metrics
 from steamos_log_submitter.lockfile import Lockfile, LockHeldError, LockNotHeldError, LockRetry
 
 
@@ -335,19 +337,15 @@ def test_very_slow_lockinfo(lockfile, monkeypatch):
 
 def test_contended_retry(lockfile, monkeypatch):
     attempt = 0
-    real_open = open
     lock_a = Lockfile(lockfile)
 
-    def open_fake(fname, mode):
+    def sleep(delay):
         nonlocal attempt
-        if mode == 'x':
-            attempt += 1
-            if attempt == 3:
-                lock_a.unlock()
-                raise FileExistsError
-        return real_open(fname, mode)
+        attempt += 1
+        if attempt == 2:
+            lock_a.unlock()
 
-    monkeypatch.setattr(builtins, 'open', open_fake)
+    monkeypatch.setattr(time, 'sleep', sleep)
 
     lock_b = Lockfile(lockfile)
 
@@ -359,9 +357,10 @@ def test_contended_retry(lockfile, monkeypatch):
     lock_a.lock()
     assert lock_a.lockfile
     assert not lock_b.lockfile
-    with LockRetry(lock_b, 2):
-        assert attempt == 4
-    assert attempt == 4
+    with LockRetry(lock_b, 3):
+        assert attempt == 2
+        assert lock_b.lockfile
+    assert attempt == 2
     assert not lock_a.lockfile
     assert not lock_b.lockfile
 
@@ -385,3 +384,81 @@ def test_contended_retry_fail(lockfile):
             pass
         assert lock_a.lockfile
         assert not lock_b.lockfile
+
+
+def test_orphaned_lock(lockfile, monkeypatch):
+    lock_a = Lockfile(lockfile)
+    lock_b = Lockfile(lockfile)
+    real_open = open
+
+    def open_fake(fname, mode):
+        # Release the lock right after it gets opened, leaving it orphaned
+        f = real_open(fname, mode)
+        if lock_a.lockfile:
+            lock_a.unlock()
+        return f
+
+    lock_a.lock()
+    monkeypatch.setattr(builtins, 'open', open_fake)
+    with lock_b:
+        assert lock_b.lockfile
+        assert os.fstat(lock_b.lockfile.fileno()).st_ino == os.stat(lockfile).st_ino
+
+
+@pytest.mark.asyncio
+async def test_acquire(lockfile):
+    metrics.reset()
+    lock_a = Lockfile(lockfile)
+    lock_b = Lockfile(lockfile)
+
+    async def release():
+        await asyncio.sleep(0.05)
+        lock_a.unlock()
+
+    lock_a.lock()
+    task = asyncio.create_task(release())
+    await lock_b.acquire(1)
+    await task
+    assert lock_b.lockfile
+    lock_b.unlock()
+
+    assert metrics.get('lockfile.wait.count') == 1
+    assert metrics.get('lockfile.wait.seconds') >= 0.05
+    assert metrics.get('lockfile.held.count') == 2
+    assert metrics.get('lockfile.contended') >= 1
+
+
+@pytest.mark.asyncio
+async def test_acquire_timeout(lockfile):
+    lock_a = Lockfile(lockfile)
+    lock_b = Lockfile(lockfile, timeout=0.05)
+
+    with lock_a:
+        start = time.monotonic()
+        with pytest.raises(LockHeldError):
+            async with lock_b:
+                assert False
+        assert time.monotonic() - start < 0.5
+        assert not lock_b.lockfile
+
+        with pytest.raises(LockHeldError):
+            await lock_b.acquire(0)
+
+    async with lock_b:
+        assert lock_b.lockfile
+    assert not os.access(lockfile, os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_async_retry(lockfile):
+    lock_a = Lockfile(lockfile)
+    lock_b = Lockfile(lockfile)
+
+    with lock_a:
+        with pytest.raises(LockHeldError):
+            async with LockRetry(lock_b, 2, 0.01):
+                assert False
+
+    async with LockRetry(lock_b, 2, 0.01):
+        assert lock_b.lockfile
+    assert not lock_b.lockfile
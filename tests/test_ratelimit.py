@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import email.utils
+import httpx
+import json
+import pytest
+import time
+import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators.sentry as sentry
+import steamos_log_submitter.helpers as helpers
+import steamos_log_submitter.ratelimit as ratelimit
+from steamos_log_submitter.runner import submit
+from . import awaitable, setup_categories, setup_logs, unreachable
+from . import count_hits, data_directory, helper_directory, mock_config, online, patch_module  # NOQA: F401
+
+DSN = 'https://fake@dsn/0'
+
+
+def test_limit(data_directory):
+    assert ratelimit.until(DSN) is None
+    ratelimit.limit(DSN, 60, ['error'])
+    expiry = ratelimit.until(DSN)
+    assert expiry is not None
+    assert expiry == pytest.approx(time.time() + 60, abs=1)
+    assert ratelimit.until(DSN, ['attachment']) is None
+    assert ratelimit.until(DSN, now=expiry) is None
+    assert ratelimit.until('https://other@dsn/1') is None
+
+    ratelimit.limit(DSN, 120)
+    assert ratelimit.until(DSN, ['attachment']) == pytest.approx(time.time() + 120, abs=1)
+
+    ratelimit.clear(DSN)
+    assert ratelimit.until(DSN) is None
+
+
+def test_expired_pruned(data_directory):
+    ratelimit.limit(DSN, -1, ['error'])
+    ratelimit.limit(DSN, 60, ['attachment'])
+    limits = sls.data.get_data('steamos_log_submitter.ratelimit')[DSN]
+    assert isinstance(limits, dict)
+    assert set(limits) == {'attachment'}
+
+
+def test_malformed(data_directory):
+    sls.data.get_data('steamos_log_submitter.ratelimit')[DSN] = {'': 'soon', 'error': time.time() + 60}
+    assert ratelimit.until(DSN) is not None
+    sls.data.get_data('steamos_log_submitter.ratelimit')[DSN] = 'soon'
+    assert ratelimit.until(DSN) is None
+
+
+def test_parse_retry_after():
+    assert sentry.parse_retry_after('30') == 30
+    assert sentry.parse_retry_after(None) == sentry.DEFAULT_RETRY_AFTER
+    assert sentry.parse_retry_after('whenever') == sentry.DEFAULT_RETRY_AFTER
+    date = email.utils.formatdate(time.time() + 90, usegmt=True)
+    assert sentry.parse_retry_after(date) == pytest.approx(90, abs=2)
+
+
+@pytest.mark.asyncio
+async def test_sentry_headers(data_directory, monkeypatch):
+    async def fake_response(self, url, **kwargs):
+        return httpx.Response(429, headers={'X-Sentry-Rate-Limits': '60:error;transaction:organization, 3600:attachment:key, bogus'})
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent(DSN, envelope_only=True)
+    assert await event.send() == helpers.HelperResult.CLASS_ERROR
+    assert ratelimit.until(DSN, ['error']) == pytest.approx(time.time() + 60, abs=1)
+    assert ratelimit.until(DSN, ['attachment']) == pytest.approx(time.time() + 3600, abs=1)
+    assert ratelimit.until(DSN, ['transaction']) is not None
+    assert ratelimit.until(DSN, ['session']) is None
+
+
+@pytest.mark.asyncio
+async def test_sentry_headers_success(data_directory, monkeypatch):
+    async def fake_response(self, url, **kwargs):
+        return httpx.Response(200, headers={'X-Sentry-Rate-Limits': '60::organization'})
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent(DSN, envelope_only=True)
+    assert await event.send() == helpers.HelperResult.OK
+    assert ratelimit.until(DSN, ['session']) is not None
+
+
+@pytest.mark.asyncio
+async def test_sentry_retry_after(data_directory, monkeypatch):
+    async def fake_response(self, url, **kwargs):
+        return httpx.Response(429, headers={'Retry-After': '120'})
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent(DSN)
+    assert await event.send() == helpers.HelperResult.CLASS_ERROR
+    assert ratelimit.until(DSN) == pytest.approx(time.time() + 120, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_minidump_retry_after(data_directory, monkeypatch):
+    async def fake_response(self, url, **kwargs):
+        return httpx.Response(429)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.MinidumpEvent(DSN)
+    with open(__file__, 'rb') as f:
+        assert await event.send_minidump(f) == helpers.HelperResult.CLASS_ERROR
+    assert ratelimit.until(DSN) == pytest.approx(time.time() + sentry.DEFAULT_RETRY_AFTER, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_submit_skipped(helper_directory, mock_config, online, patch_module, monkeypatch):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'dsn', DSN)
+    ratelimit.limit(DSN, 60)
+
+    monkeypatch.setattr(patch_module, 'list_pending', unreachable)
+    patch_module.submit = unreachable
+    assert await submit() == {}
+    with open(f'{sls.data.data_root}/ratelimit.json') as f:
+        assert DSN in json.load(f)
+
+
+@pytest.mark.asyncio
+async def test_submit_deferred(helper_directory, mock_config, online, patch_module, count_hits):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {f'test/log{i}': '' for i in range(4)})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'dsn', DSN)
+
+    def limited(fname):
+        count_hits()
+        ratelimit.limit(DSN, 60)
+        return helpers.HelperResult.TRANSIENT_ERROR
+
+    patch_module.submit = awaitable(limited)
+    submitted = await submit()
+    assert count_hits.hits == 1
+    assert len(submitted) == 1
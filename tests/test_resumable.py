@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import os
+import pytest
+import pytest_asyncio
+import tempfile
+import steamos_log_submitter.aggregators as aggregators
+from bench.server import FakeSentry
+from steamos_log_submitter.aggregators.resumable import ResumableUpload, UploadState
+from steamos_log_submitter.helpers import HelperResult
+
+
+@pytest_asyncio.fixture
+async def server():
+    server = FakeSentry(seed=0)
+    await server.start()
+    yield server
+    await aggregators.close()
+    await server.close()
+
+
+@pytest.fixture
+def report():
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(os.urandom(10000))
+        f.flush()
+        yield f.name
+
+
+def endpoint(server):
+    return f'http://127.0.0.1:{server._server.sockets[0].getsockname()[1]}/upload/'
+
+
+@pytest.mark.asyncio
+async def test_flaky_server(server, report):
+    server.error_rate = 0.3
+    states: list[UploadState] = []
+    upload = ResumableUpload(endpoint(server), report, chunk_size=1000, metadata={'filename': 'report.zip'},
+                             progress=lambda state: states.append(state.copy()))
+    assert await upload.upload() == HelperResult.OK
+    assert server.stats['upload'].errors > 0
+    data, = server.uploads.values()
+    with open(report, 'rb') as f:
+        assert data.data == f.read()
+    assert states[-1]['offset'] == 10000
+    assert [state['offset'] for state in states] == sorted(state['offset'] for state in states)
+
+
+@pytest.mark.asyncio
+async def test_server_down(server, report):
+    server.error_rate = 1
+    upload = ResumableUpload(endpoint(server), report, chunk_size=1000)
+    assert await upload.upload() == HelperResult.TRANSIENT_ERROR
+    assert upload.state and upload.state['offset'] == 0
+
+
+@pytest.mark.asyncio
+async def test_expired(server, report):
+    upload = ResumableUpload(endpoint(server), report, chunk_size=4000)
+    assert await upload.upload() == HelperResult.OK
+    assert upload.state
+    location = upload.state['location']
+    server.uploads.clear()
+
+    upload = ResumableUpload(endpoint(server), report, state={'location': location, 'offset': 4000, 'size': 10000})
+    assert await upload.upload() == HelperResult.OK
+    assert upload.state
+    assert upload.state['location'] != location
+    assert len(server.uploads[upload.state['location'].rsplit('/', 1)[1]].data) == 10000
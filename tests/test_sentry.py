@@ -3,13 +3,18 @@
 #
 # Copyright (c) 2023 Valve Software
 # Maintainer: Vicki Pfau <vi@endrift.com>
+import asyncio
 import gzip
 import httpx
 import os
 import pytest
 import json
+import tempfile
+import time
 import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators as aggregators
 import steamos_log_submitter.aggregators.sentry as sentry
+import steamos_log_submitter.helpers as helpers
 from . import mock_config, open_shim  # NOQA: F401
 from . import unreachable
 
@@ -35,6 +40,22 @@ async def test_bad_start(monkeypatch):
     assert await event.send() == HelperResult.TRANSIENT_ERROR
 
 
+@pytest.mark.asyncio
+async def test_failure_reason(monkeypatch):
+    async def fake_response(self, url, **kwargs):
+        return httpx.Response(503, text='headcrab ' * 100)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    helpers.set_failure_reason(None)
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    assert await event.send() == HelperResult.TRANSIENT_ERROR
+    reason = helpers.failure_reason()
+    assert reason
+    assert reason.startswith('HTTP 503: headcrab headcrab')
+    assert reason.endswith('...')
+    assert len(reason) == len('HTTP 503: ') + aggregators.REASON_SIZE + 3
+
+
 @pytest.mark.asyncio
 async def test_dsn_parsing(monkeypatch):
     async def fake_response(self, url, headers, *args, **kwargs):
@@ -294,3 +315,532 @@ async def test_envelope_timestamp(monkeypatch):
     event.timestamp = 0.1
     event.add_attachment({'data': b''})
     assert await event.send()
+
+
+@pytest.mark.asyncio
+async def test_envelope_only(monkeypatch):
+    urls = []
+
+    async def fake_response(self, url, **kwargs):
+        urls.append(url)
+        data = gzip.decompress(kwargs['content'])
+        line, data = data.split(b'\n', 1)
+        header = json.loads(line)
+        assert header.get('dsn') == 'https://fake@dsn/0'
+        event_id = header.get('event_id')
+
+        line, data = data.split(b'\n', 1)
+        header = json.loads(line)
+        assert header.get('type') == 'event'
+        event = json.loads(data[:header['length']])
+        assert event['event_id'] == event_id
+        assert event['message'] == 'Oh no'
+        data = data[header['length'] + 1:]
+
+        line, data = data.split(b'\n', 1)
+        header = json.loads(line)
+        assert header.get('type') == 'attachment'
+        assert data[:header['length']] == b'crowbar'
+        assert data[header['length']:] == b'\n'
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    event.message = 'Oh no'
+    event.add_attachment({'data': b'crowbar'})
+    assert await event.send() == HelperResult.OK
+    assert urls == ['https://fake@dsn/api/0/envelope/']
+
+
+@pytest.mark.asyncio
+async def test_envelope_only_no_attachments(monkeypatch):
+    urls = []
+
+    async def fake_response(self, url, **kwargs):
+        urls.append(url)
+        data = gzip.decompress(kwargs['content'])
+        lines = data.split(b'\n')
+        assert json.loads(lines[1]).get('type') == 'event'
+        assert json.loads(lines[2])['event_id'] == json.loads(lines[0])['event_id']
+        assert lines[3:] == [b'']
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    assert await event.send() == HelperResult.OK
+    assert urls == ['https://fake@dsn/api/0/envelope/']
+
+
+@pytest.mark.asyncio
+async def test_envelope_only_errors(monkeypatch):
+    status = 413
+
+    async def fake_response(self, url, **kwargs):
+        return httpx.Response(status)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    assert await event.send() == HelperResult.PERMANENT_ERROR
+    status = 503
+    assert await event.send() == HelperResult.TRANSIENT_ERROR
+
+
+@pytest.mark.asyncio
+async def test_envelope_file_attachments(monkeypatch):
+    async def fake_response(self, url, **kwargs):
+        if url == 'https://fake@dsn/api/0/envelope/':
+            data = gzip.decompress(kwargs['content'])
+            line, data = data.split(b'\n', 1)
+            attachments = []
+            while data:
+                line, data = data.split(b'\n', 1)
+                header = json.loads(line)
+                attachments.append((header.get('filename'), data[:header['length']]))
+                data = data[header['length'] + 1:]
+            assert attachments == [('path.txt', b'crowbar'), ('file.txt', b'gravity gun')]
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    with tempfile.NamedTemporaryFile() as path, tempfile.TemporaryFile() as f:
+        path.write(b'crowbar')
+        path.flush()
+        f.write(b'gravity gun')
+        f.seek(0)
+        event = sentry.SentryEvent('https://fake@dsn/0')
+        event.add_attachment({'path': path.name, 'filename': 'path.txt'}, {'data': f, 'filename': 'file.txt'})
+        assert await event.send()
+
+
+@pytest.mark.asyncio
+async def test_envelope_missing_file(monkeypatch):
+    monkeypatch.setattr(httpx.AsyncClient, 'post', unreachable)
+    event = sentry.SentryEvent('https://fake@dsn/0')
+    event.add_attachment({'path': '/does/not/exist'})
+    assert await event.send() == HelperResult.TRANSIENT_ERROR
+
+
+@pytest.mark.asyncio
+async def test_envelope_streamed(monkeypatch):
+    data = os.urandom(aggregators.SPOOL_SIZE * 2)
+
+    async def fake_response(self, url, **kwargs):
+        assert not isinstance(kwargs['content'], bytes)
+        body = b''.join([chunk async for chunk in kwargs['content']])
+        assert kwargs['headers']['Content-Length'] == str(len(body))
+        # Random data can't be compressed, so it's sent as-is
+        assert 'Content-Encoding' not in kwargs['headers']
+        _, envelope = body.split(b'\n', 1)
+        _, envelope = envelope.split(b'\n', 1)
+        event = envelope.split(b'\n', 1)[0]
+        assert json.loads(event)['event_id']
+        _, envelope = envelope.split(b'\n', 1)
+        line, envelope = envelope.split(b'\n', 1)
+        assert json.loads(line)['length'] == len(data)
+        assert envelope == data + b'\n'
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+        event.add_attachment({'path': f.name})
+        assert await event.send()
+    assert event._raw_envelope is None
+
+
+def test_is_compressed():
+    assert sentry.is_compressed(b'', 'application/zip')
+    assert sentry.is_compressed(b'PK\x03\x04')
+    assert sentry.is_compressed(b'\x1f\x8b\x08')
+    assert not sentry.is_compressed(b'crowbar', 'text/plain')
+    assert not sentry.is_compressed(os.urandom(16))
+    assert sentry.is_compressed(os.urandom(sentry.MIN_SAMPLE_SIZE))
+    assert not sentry.is_compressed(b'headcrab zombie\n' * 1024)
+
+
+@pytest.mark.asyncio
+async def test_envelope_compression(monkeypatch):
+    text = b'headcrab zombie\n' * 4096
+    compressed = os.urandom(len(text))
+    headers = []
+
+    async def fake_response(self, url, **kwargs):
+        headers.append(kwargs['headers'].get('Content-Encoding'))
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    event.add_attachment({'data': text})
+    assert await event.send()
+    assert event.encoding == 'gzip'
+    assert event.encoded_size < event.raw_size
+    assert event.seal_time >= 0
+
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    event.add_attachment({'data': compressed})
+    assert await event.send()
+    assert event.encoding is None
+    assert event.encoded_size == event.raw_size
+
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(text)
+        f.flush()
+        event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+        event.add_attachment({'path': f.name, 'mime-type': 'application/zip'})
+        assert await event.send()
+        assert event.encoding is None
+
+    assert headers == ['gzip', None, None]
+
+
+def test_envelope_compression_level(monkeypatch):
+    levels = []
+
+    class FakeGzipFile(gzip.GzipFile):
+        def __init__(self, *args, compresslevel=9, **kwargs):
+            levels.append(compresslevel)
+            super().__init__(*args, compresslevel=compresslevel, **kwargs)
+
+    monkeypatch.setattr(gzip, 'GzipFile', FakeGzipFile)
+    text = b'headcrab zombie\n' * 4096
+
+    event = sentry.SentryEvent('https://fake@dsn/0')
+    event.add_attachment({'data': text}, {'data': b'PK\x03\x04' + os.urandom(len(text) * 2)})
+    event.seal()
+    event.close()
+    event = sentry.SentryEvent('https://fake@dsn/0')
+    event.add_attachment({'data': text})
+    event.seal()
+    event.close()
+    assert levels == [1, 9]
+
+
+def test_envelope_compression_config(monkeypatch):
+    levels = []
+
+    class FakeGzipFile(gzip.GzipFile):
+        def __init__(self, *args, compresslevel=9, **kwargs):
+            levels.append(compresslevel)
+            super().__init__(*args, compresslevel=compresslevel, **kwargs)
+
+    monkeypatch.setattr(gzip, 'GzipFile', FakeGzipFile)
+    monkeypatch.delitem(sentry.CODECS, 'zstd', raising=False)
+    compressed = b'PK\x03\x04' + os.urandom(4096)
+
+    event = sentry.SentryEvent('https://fake@dsn/0', compression=('gzip', 4))
+    event.add_attachment({'data': compressed})
+    event.seal()
+    event.close()
+    assert event.encoding == 'gzip'
+
+    event = sentry.SentryEvent('https://fake@dsn/0', compression=('none', None))
+    event.add_attachment({'data': b'headcrab zombie\n' * 4096})
+    event.seal()
+    event.close()
+    assert event.encoding is None
+    assert event.encoded_size == event.raw_size
+
+    event = sentry.SentryEvent('https://fake@dsn/0', compression=('zstd', None))
+    event.add_attachment({'data': compressed})
+    event.seal()
+    event.close()
+    assert event.encoding == 'gzip'
+
+    event = sentry.SentryEvent('https://fake@dsn/0', compression=('gzip', 42))
+    event.add_attachment({'data': compressed})
+    event.seal()
+    event.close()
+
+    event = sentry.SentryEvent('https://fake@dsn/0', compression=('brotli', 6))
+    event.add_attachment({'data': b'headcrab zombie\n' * 4096})
+    event.seal()
+    event.close()
+    assert event.encoding == 'gzip'
+
+    assert levels == [4, 9, 9, 6]
+
+
+@pytest.mark.skipif(not sentry.zstandard, reason='zstandard is not installed')
+def test_envelope_zstd():
+    text = b'headcrab zombie\n' * 4096
+    event = sentry.SentryEvent('https://fake@dsn/0', compression=('zstd', 19))
+    event.add_attachment({'data': text})
+    event.seal()
+    assert event.encoding == 'zstd'
+    assert event.encoded_size < event.raw_size
+    assert event._raw_envelope
+    event._raw_envelope.seek(0)
+    with sentry.zstandard.ZstdDecompressor().stream_reader(event._raw_envelope) as reader:
+        body = reader.read()
+    event.close()
+    assert len(body) == event.raw_size
+    assert body.endswith(text + b'\n')
+
+
+@pytest.mark.asyncio
+async def test_envelope_throttled(mock_config, monkeypatch):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'bandwidth-limit', '1000000')
+
+    async def fake_response(self, url, **kwargs):
+        if url == 'https://fake@dsn/api/0/envelope/':
+            body = b''.join([chunk async for chunk in kwargs['content']])
+            assert kwargs['headers']['Content-Length'] == str(len(body))
+            data = gzip.decompress(body)
+            line, data = data.split(b'\n', 1)
+            line, data = data.split(b'\n', 1)
+            assert data == b'crowbar\n'
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent('https://fake@dsn/0')
+    event.add_attachment({'data': b'crowbar'})
+    assert await event.send()
+
+
+@pytest.mark.asyncio
+async def test_minidump_throttled(mock_config, monkeypatch):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'bandwidth-limit', '1000000')
+    minidump = b'MDMP' * 0x10000
+
+    async def fake_response(self, url, **kwargs):
+        assert 'files' not in kwargs
+        body = b''.join([chunk async for chunk in kwargs['content']])
+        assert kwargs['headers']['content-length'] == str(len(body))
+        assert kwargs['headers']['content-type'].startswith('multipart/form-data; boundary=')
+        assert b'name="upload_file_minidump"' in body
+        assert minidump in body
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.MinidumpEvent('https://fake@dsn/0')
+    with tempfile.TemporaryFile() as f:
+        f.write(minidump)
+        f.seek(0)
+        assert await event.send_minidump(f) == HelperResult.OK
+
+
+@pytest.mark.asyncio
+async def test_token_bucket(monkeypatch):
+    now = 0.0
+    sleeps = []
+
+    async def fake_sleep(duration):
+        nonlocal now
+        sleeps.append(duration)
+        now += duration
+
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    monkeypatch.setattr(asyncio, 'sleep', fake_sleep)
+    bucket = aggregators.TokenBucket(100)
+    await bucket.consume(100)
+    assert not sleeps
+    await bucket.consume(250)
+    assert sum(sleeps) == pytest.approx(2.5)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_concurrent(monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(duration):
+        sleeps.append(duration)
+
+    monkeypatch.setattr(time, 'monotonic', lambda: 0.0)
+    monkeypatch.setattr(asyncio, 'sleep', fake_sleep)
+    bucket = aggregators.TokenBucket(100)
+    await asyncio.gather(bucket.consume(200), bucket.consume(200))
+    # The second caller waits behind the first instead of sharing its tokens
+    assert sorted(sleeps) == [pytest.approx(1), pytest.approx(3)]
+
+
+@pytest.mark.asyncio
+async def test_limiter_config(mock_config):
+    assert aggregators.limiter() is None
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'bandwidth-limit', '1000')
+    bucket = aggregators.limiter()
+    assert bucket is not None
+    assert bucket.rate == 1000
+    assert aggregators.limiter() is bucket
+    mock_config.set('sls', 'bandwidth-limit', 'fast')
+    assert aggregators.limiter() is None
+
+
+@pytest.mark.asyncio
+async def test_client_shared(mock_config, monkeypatch):
+    clients = set()
+
+    async def fake_response(self, url, **kwargs):
+        clients.add(self)
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    for _ in range(3):
+        event = sentry.SentryEvent('https://fake@dsn/0')
+        event.add_attachment({'data': b'crowbar'})
+        assert await event.send()
+    assert len(clients) == 1
+    assert aggregators.client() in clients
+
+    await aggregators.close()
+    assert all(client.is_closed for client in clients)
+    assert aggregators.client() not in clients
+    await aggregators.close()
+
+
+@pytest.mark.asyncio
+async def test_client_config(mock_config, monkeypatch):
+    limits = []
+    timeouts = []
+
+    class FakeClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            limits.append(kwargs['limits'])
+            timeouts.append(kwargs['timeout'])
+            super().__init__(**kwargs)
+
+    monkeypatch.setattr(httpx, 'AsyncClient', FakeClient)
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'http-max-connections', '2')
+    mock_config.set('sls', 'http-max-keepalive', 'many')
+    mock_config.set('sls', 'http-timeout', '120')
+    aggregators.client()
+    await aggregators.close()
+    assert limits[0].max_connections == 2
+    assert limits[0].max_keepalive_connections == 5
+    assert timeouts[0] == 120
+
+
+@pytest.mark.asyncio
+async def test_client_http2_missing(mock_config, monkeypatch):
+    monkeypatch.setattr(aggregators.importlib.util, 'find_spec', lambda name: None)
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'http2', 'on')
+    client = aggregators.client()
+    await aggregators.close()
+    assert client.is_closed
+
+
+def test_client_per_loop(mock_config):
+    async def get_client():
+        return aggregators.client()
+
+    first = asyncio.run(get_client())
+    second = asyncio.run(get_client())
+    assert first is not second
+
+
+def parse_envelope(data):
+    _, data = data.split(b'\n', 1)
+    items = []
+    while data:
+        line, data = data.split(b'\n', 1)
+        header = json.loads(line)
+        items.append((header, data[:header['length']]))
+        assert data[header['length']] == ord('\n')
+        data = data[header['length'] + 1:]
+    return items
+
+
+def test_size_limits(mock_config):
+    mock_config.add_section('sls')
+    assert sentry.size_limits() == (sentry.MAX_EVENT_SIZE, sentry.MAX_ATTACHMENT_SIZE, sentry.MAX_ENVELOPE_SIZE)
+    mock_config.set('sls', 'max-event-size', '1000')
+    mock_config.set('sls', 'max-attachment-size', '-1')
+    mock_config.set('sls', 'max-envelope-size', 'big')
+    assert sentry.size_limits() == (1000, sentry.MAX_ATTACHMENT_SIZE, sentry.MAX_ENVELOPE_SIZE)
+
+
+@pytest.mark.asyncio
+async def test_envelope_drop_priority(mock_config, monkeypatch):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'max-envelope-size', '8192')
+    posted = []
+
+    async def fake_response(self, url, **kwargs):
+        posted.append(parse_envelope(gzip.decompress(kwargs['content'])))
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    event.add_attachment({'data': b'dmesg' * 100, 'filename': 'dmesg.txt', 'priority': 10},
+                         {'data': os.urandom(8192), 'filename': 'kdump.zip', 'mime-type': 'application/zip'},
+                         {'data': b'version', 'filename': 'version.txt'})
+    assert await event.send() == HelperResult.OK
+    assert event.raw_size <= 8192
+    items, = posted
+    assert [header.get('filename') for header, _ in items] == [None, 'dmesg.txt', 'version.txt']
+    assert json.loads(items[0][1])['extra']['sls.dropped_attachments'] == ['kdump.zip']
+
+
+@pytest.mark.asyncio
+async def test_envelope_required_attachment(mock_config, monkeypatch):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'max-envelope-size', '8192')
+    posted = []
+
+    async def fake_response(self, url, **kwargs):
+        posted.append(parse_envelope(gzip.decompress(kwargs['content'])))
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    event.add_attachment({'data': b'dmesg' * 100, 'filename': 'dmesg.txt', 'priority': 10},
+                         {'data': os.urandom(6144), 'filename': 'report.zip', 'mime-type': 'application/zip', 'required': True},
+                         {'data': os.urandom(2048), 'filename': 'extra.zip', 'mime-type': 'application/zip'})
+    assert await event.send() == HelperResult.OK
+    items, = posted
+    assert [header.get('filename') for header, _ in items] == [None, 'dmesg.txt', 'report.zip']
+
+    mock_config.set('sls', 'max-attachment-size', '1000')
+    monkeypatch.setattr(httpx.AsyncClient, 'post', unreachable)
+    event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+    event.add_attachment({'data': os.urandom(5000), 'filename': 'report.zip', 'mime-type': 'application/zip', 'required': True})
+    assert await event.send() == HelperResult.PERMANENT_ERROR
+
+
+@pytest.mark.asyncio
+async def test_envelope_truncate_text(mock_config, monkeypatch):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'max-attachment-size', '1000')
+    mock_config.set('sls', 'max-envelope-size', '2048')
+    posted = []
+
+    async def fake_response(self, url, **kwargs):
+        posted.append(parse_envelope(gzip.decompress(kwargs['content'])))
+        return httpx.Response(200)
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    log = b''.join(b'line %d\n' % i for i in range(1000))
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(log)
+        f.flush()
+        event = sentry.SentryEvent('https://fake@dsn/0', envelope_only=True)
+        event.add_attachment({'path': f.name, 'filename': 'journal.txt', 'mime-type': 'text/plain'},
+                             {'data': log, 'filename': 'dmesg.txt', 'mime-type': 'text/plain'})
+        assert await event.send() == HelperResult.OK
+    assert event.raw_size == 2048
+    items, = posted
+    (_, event_data), (journal, journal_data), (dmesg, dmesg_data) = items
+    assert journal_data == log[-1000:]
+    assert dmesg_data == log[-dmesg['length']:]
+    assert dmesg['length'] < 1000
+    assert json.loads(event_data)['extra']['sls.truncated_attachments'] == {
+        'journal.txt': len(log) - 1000,
+        'dmesg.txt': len(log) - dmesg['length'],
+    }
+
+
+@pytest.mark.asyncio
+async def test_event_too_large(mock_config, monkeypatch):
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'max-event-size', '1000')
+    monkeypatch.setattr(httpx.AsyncClient, 'post', unreachable)
+    event = sentry.SentryEvent('https://fake@dsn/0')
+    event.message = 'crowbar' * 1000
+    assert await event.send() == HelperResult.PERMANENT_ERROR
+    assert event._raw_envelope is None
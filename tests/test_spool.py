@@ -0,0 +1,148 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# vim:ts=4:sw=4:et
+#
+# Copyright (c) 2025 Valve Software
+# Maintainer: Vicki Pfau <vi@endrift.com>
+import gzip
+import httpx
+import json
+import os
+import pytest
+import tempfile
+import steamos_log_submitter as sls
+import steamos_log_submitter.aggregators as aggregators
+import steamos_log_submitter.aggregators.sentry as sentry
+import steamos_log_submitter.aggregators.spool as spool
+from steamos_log_submitter.helpers import HelperResult
+from . import mock_config  # NOQA: F401
+from . import unreachable
+
+
+@pytest.fixture
+def spool_dir():
+    d = tempfile.TemporaryDirectory(prefix='sls-spool-')
+    yield d.name
+    del d
+
+
+def test_get_backend():
+    assert aggregators.get_backend('https://fake@dsn/0') is sentry
+    assert aggregators.get_backend('file:///var/spool/sls') is spool
+    assert aggregators.get_backend('') is sentry
+    assert aggregators.get_backend('https://fake@dsn/0', 'spool') is spool
+    with pytest.raises(ValueError):
+        aggregators.get_backend('https://fake@dsn/0', 'crowbar')
+
+
+def test_create(spool_dir):
+    event = sentry.SentryEvent.create('https://fake@dsn/0', envelope_only=True)
+    assert type(event) is sentry.SentryEvent
+    assert event.envelope_only
+    assert type(sentry.MinidumpEvent.create('https://fake@dsn/0')) is sentry.MinidumpEvent
+
+    event = sentry.SentryEvent.create(f'file://{spool_dir}')
+    assert type(event) is spool.SpoolEvent
+    assert event.directory == spool_dir
+    assert event.envelope_only
+    assert type(sentry.MinidumpEvent.create(f'file://{spool_dir}')) is spool.SpoolMinidumpEvent
+
+
+def test_spool_directory(mock_config):
+    mock_config.add_section('sls')
+    assert spool.spool_directory('file:///var/spool/sls%20events') == '/var/spool/sls events'
+    assert spool.spool_directory('https://fake@dsn/0') == f'{sls.base}/spool'
+    mock_config.set('sls', 'spool-directory', '/tmp/spool')
+    assert spool.spool_directory('https://fake@dsn/0') == '/tmp/spool'
+
+
+@pytest.mark.asyncio
+async def test_spool_event(spool_dir, monkeypatch):
+    monkeypatch.setattr(httpx.AsyncClient, 'post', unreachable)
+    text = b'headcrab zombie\n' * 1024
+    event = sentry.SentryEvent.create(f'file://{spool_dir}')
+    event.message = 'Crowbar'
+    event.add_attachment({'data': text, 'filename': 'log.txt'})
+    assert await event.send() == HelperResult.OK
+
+    fname, = os.listdir(spool_dir)
+    assert fname == f'{event._event_id}.envelope.gz'
+    with gzip.open(f'{spool_dir}/{fname}') as f:
+        header = json.loads(f.readline())
+        assert header['event_id'] == event._event_id
+        item = json.loads(f.readline())
+        assert item['type'] == 'event'
+        assert json.loads(f.readline())['message'] == 'Crowbar'
+        item = json.loads(f.readline())
+        assert item['filename'] == 'log.txt'
+        assert f.read() == text + b'\n'
+
+
+@pytest.mark.asyncio
+async def test_spool_event_failure(spool_dir, monkeypatch):
+    def fail(*args):
+        raise OSError('disk full')
+
+    event = sentry.SentryEvent.create(f'file://{spool_dir}')
+    monkeypatch.setattr(os, 'replace', fail)
+    assert await event.send() == HelperResult.TRANSIENT_ERROR
+    assert os.listdir(spool_dir) == []
+
+
+@pytest.mark.asyncio
+async def test_spool_minidump(spool_dir, monkeypatch):
+    monkeypatch.setattr(httpx.AsyncClient, 'post', unreachable)
+    event = sentry.MinidumpEvent.create('https://fake@dsn/0', 'spool')
+    assert isinstance(event, spool.SpoolMinidumpEvent)
+    event.directory = spool_dir
+    event.appid = 220
+    with tempfile.TemporaryFile() as f:
+        f.write(b'MDMP')
+        assert await event.send_minidump(f) == HelperResult.OK
+
+    assert sorted(os.listdir(spool_dir)) == [f'{event._event_id}.dmp', f'{event._event_id}.json']
+    with open(f'{spool_dir}/{event._event_id}.dmp', 'rb') as f:
+        assert f.read() == b'MDMP'
+    with open(f'{spool_dir}/{event._event_id}.json') as f:
+        metadata = json.load(f)
+    assert metadata['dsn'] == 'https://fake@dsn/0'
+    assert json.loads(metadata['sentry'])['tags']['appid'] == 220
+
+
+@pytest.mark.asyncio
+async def test_replay(spool_dir, monkeypatch):
+    posted = []
+
+    async def fake_response(self, url, **kwargs):
+        if 'content' in kwargs and not isinstance(kwargs['content'], bytes):
+            kwargs['content'] = b''.join([chunk async for chunk in kwargs['content']])
+        posted.append((url, kwargs))
+        return httpx.Response(500 if 'minidump' in url else 200)
+
+    event = sentry.SentryEvent.create(f'file://{spool_dir}')
+    event.add_attachment({'data': b'headcrab zombie\n' * 1024})
+    assert await event.send() == HelperResult.OK
+    event = sentry.SentryEvent.create(f'file://{spool_dir}', compression=('none', None))
+    assert await event.send() == HelperResult.OK
+    event = sentry.MinidumpEvent.create(f'file://{spool_dir}')
+    with tempfile.TemporaryFile() as f:
+        f.write(b'MDMP')
+        assert await event.send_minidump(f) == HelperResult.OK
+
+    monkeypatch.setattr(httpx.AsyncClient, 'post', fake_response)
+    results = await spool.replay(spool_dir, 'https://key@sentry.example:8443/5')
+    assert len(results) == 2
+    assert list(results.values()).count(True) == 2
+    for url, kwargs in posted:
+        assert url == 'https://sentry.example:8443/api/5/envelope/?sentry_key=key'
+        assert kwargs['headers']['Content-Length'] == str(len(kwargs['content']))
+    assert {kwargs['headers'].get('Content-Encoding') for _, kwargs in posted} == {'gzip', None}
+
+    posted.clear()
+    results = await spool.replay(spool_dir, 'https://key@sentry.example/5', 'https://sentry.example/api/5/minidump/?sentry_key=key')
+    assert len(results) == 3
+    assert list(results.values()).count(True) == 2
+    assert results[f'{event._event_id}.dmp'] is False
+    kwargs, = [kwargs for url, kwargs in posted if url == 'https://sentry.example/api/5/minidump/?sentry_key=key']
+    with open(f'{spool_dir}/{event._event_id}.json') as metadata:
+        assert kwargs['data']['sentry'] == json.load(metadata)['sentry']
+    assert 'upload_file_minidump' in kwargs['files']
@@ -13,12 +13,7 @@ import steamos_log_submitter as sls
 import steamos_log_submitter.helpers as helpers
 from steamos_log_submitter.runner import submit
 from . import awaitable, setup_categories, setup_logs, unreachable
-from . import helper_directory, mock_config, patch_module, count_hits  # NOQA: F401
-
-
-@pytest.fixture
-def online(monkeypatch):
-    monkeypatch.setattr(sls.util, 'check_network', lambda: True)
+from . import helper_directory, mock_config, online, patch_module, count_hits  # NOQA: F401
 
 
 @pytest.mark.asyncio
@@ -261,3 +256,419 @@ async def test_list(helper_directory, online, patch_module, count_hits):
     patch_module.submit = awaitable(count_hits)
     assert await submit() == {'test/log': helpers.HelperResult.OK}
     assert count_hits.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrency(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {f'test/log{i}': '' for i in range(8)})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'concurrency', '4')
+
+    running = 0
+    peak = 0
+
+    async def fake_submit(fname):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert peak == 4
+    assert len(submitted) == 8
+    for i in range(8):
+        assert not os.access(f'{sls.pending}/test/log{i}', os.F_OK)
+        assert os.access(f'{sls.uploaded}/test/log{i}', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_invalid(helper_directory, online, mock_config, patch_module, count_hits):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'concurrency', 'many')
+    count_hits.ret = helpers.HelperResult.OK
+
+    patch_module.submit = awaitable(count_hits)
+    await submit()
+
+    assert patch_module.concurrency() == 1
+    assert count_hits.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrency_class_failure(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {f'test/log{i}': '' for i in range(8)})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'concurrency', '2')
+
+    attempts = 0
+
+    async def fake_submit(fname):
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(0.01)
+        return helpers.HelperResult.CLASS_ERROR
+
+    patch_module.submit = fake_submit
+    await submit()
+
+    assert attempts == 2
+    for i in range(8):
+        assert os.access(f'{sls.pending}/test/log{i}', os.F_OK)
+        assert not os.access(f'{sls.failed}/test/log{i}', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_permanent_failure(helper_directory, online, mock_config, patch_module, count_hits):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {f'test/log{i}': '' for i in range(4)})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'concurrency', '3')
+    count_hits.ret = helpers.HelperResult.PERMANENT_ERROR
+
+    patch_module.submit = awaitable(count_hits)
+    await submit()
+
+    assert count_hits.hits == 4
+    for i in range(4):
+        assert not os.access(f'{sls.pending}/test/log{i}', os.F_OK)
+        assert os.access(f'{sls.failed}/test/log{i}', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_priority_order(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {'test/big': 'x' * 100, 'test/small': 'x', 'test2/log': 'x' * 1000})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'concurrency', '1')
+    mock_config.add_section('helpers.test2')
+    mock_config.set('helpers.test2', 'priority', '10')
+
+    order = []
+
+    async def fake_submit(fname):
+        order.append(fname[len(sls.pending) + 1:])
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    await submit()
+
+    assert order == ['test2/log', 'test/small', 'test/big']
+
+
+@pytest.mark.asyncio
+async def test_lock_per_helper(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {'test/log': 'x', 'test2/log': 'x'})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'concurrency', '1')
+    mock_config.add_section('helpers.test2')
+    mock_config.set('helpers.test2', 'priority', '10')
+
+    locked = []
+
+    async def fake_submit(fname):
+        locked.append(sorted(category for category in ('test', 'test2') if os.access(f'{sls.pending}/{category}/.lock', os.F_OK)))
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    await submit()
+
+    # Each helper only holds its lock while its own logs are submitted
+    assert locked == [['test2'], ['test']]
+    assert not os.access(f'{sls.pending}/test/.lock', os.F_OK)
+    assert not os.access(f'{sls.pending}/test2/.lock', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_lock_held_skips_helper(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {'test/log': 'x', 'test2/log': 'x'})
+
+    async def fake_submit(fname):
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    with sls.lockfile.Lockfile(f'{sls.pending}/test/.lock'):
+        submitted = await submit()
+
+    assert set(submitted) == {'test2/log'}
+    assert os.access(f'{sls.pending}/test/log', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_global_concurrency(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2', 'test3'])
+    setup_logs(helper_directory, {f'{category}/log{i}': '' for category in ('test', 'test2', 'test3') for i in range(4)})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'concurrency', '2')
+    for category in ('test', 'test2', 'test3'):
+        mock_config.add_section(f'helpers.{category}')
+        mock_config.set(f'helpers.{category}', 'concurrency', '4')
+
+    running = 0
+    peak = 0
+
+    async def fake_submit(fname):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert peak == 2
+    assert len(submitted) == 12
+
+
+@pytest.mark.asyncio
+async def test_helper_concurrency_under_global(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {f'{category}/log{i}': '' for category in ('test', 'test2') for i in range(4)})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'concurrency', '4')
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'priority', '10')
+
+    running: collections.Counter[str] = collections.Counter()
+    peak: collections.Counter[str] = collections.Counter()
+
+    async def fake_submit(fname):
+        category = fname[len(sls.pending) + 1:].split('/')[0]
+        running[category] += 1
+        peak[category] = max(peak[category], running[category])
+        await asyncio.sleep(0.01)
+        running[category] -= 1
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert peak == {'test': 1, 'test2': 1}
+    assert len(submitted) == 8
+
+
+@pytest.mark.asyncio
+async def test_class_failure_isolated(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {f'{category}/log{i}': '' for category in ('test', 'test2') for i in range(3)})
+
+    async def fake_submit(fname):
+        if fname.startswith(f'{sls.pending}/test/'):
+            return helpers.HelperResult.CLASS_ERROR
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert len([log for log in submitted if log.startswith('test/')]) == 1
+    for i in range(3):
+        assert os.access(f'{sls.pending}/test/log{i}', os.F_OK)
+        assert os.access(f'{sls.uploaded}/test2/log{i}', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_byte_budget(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/a': 'x' * 10, 'test/b': 'x' * 20, 'test/c': 'x' * 40})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'byte-budget', '35')
+
+    async def fake_submit(fname):
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert set(submitted) == {'test/a', 'test/b'}
+    assert os.access(f'{sls.pending}/test/c', os.F_OK)
+    assert sls.ledger.eligible('test', 'c')
+
+    submitted = await submit()
+    assert not submitted
+
+    mock_config.set('sls', 'byte-budget', '40')
+    submitted = await submit()
+    assert set(submitted) == {'test/c'}
+
+
+@pytest.mark.asyncio
+async def test_byte_budget_skips_large(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {'test/big': 'x' * 50, 'test/small': 'x' * 10, 'test2/log': 'x' * 10})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'byte-budget', '30')
+    mock_config.set('sls', 'concurrency', '1')
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'priority', '10')
+
+    order = []
+
+    async def fake_submit(fname):
+        order.append(fname[len(sls.pending) + 1:])
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    await submit()
+
+    assert order == ['test/small', 'test2/log']
+    assert os.access(f'{sls.pending}/test/big', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_byte_budget_oversized(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/a': 'x' * 50, 'test/b': 'x' * 60})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'byte-budget', '20')
+
+    async def fake_submit(fname):
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert not submitted
+    assert os.access(f'{sls.pending}/test/a', os.F_OK)
+    assert os.access(f'{sls.pending}/test/b', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_byte_budget_invalid(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/a': 'x' * 50, 'test/b': 'x' * 60})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'byte-budget', 'lots')
+
+    async def fake_submit(fname):
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert set(submitted) == {'test/a', 'test/b'}
+
+
+@pytest.mark.asyncio
+async def test_submit_only(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {'test/a': '', 'test/b': '', 'test/.c': '', 'test2/d': ''})
+
+    async def fake_submit(fname):
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit({'test': ['a', '.c', 'missing']})
+
+    assert set(submitted) == {'test/a'}
+    assert os.access(f'{sls.pending}/test/b', os.F_OK)
+    assert os.access(f'{sls.pending}/test2/d', os.F_OK)
+
+
+@pytest.mark.asyncio
+async def test_log_timeout(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/slow': '', 'test/fast': 'x'})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'timeout', '0.05')
+
+    async def fake_submit(fname):
+        if fname.endswith('slow'):
+            await asyncio.sleep(1)
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    start = time.time()
+    submitted = await submit()
+    assert time.time() - start < 0.5
+
+    assert submitted == {'test/slow': helpers.HelperResult.TRANSIENT_ERROR, 'test/fast': helpers.HelperResult.OK}
+    assert os.access(f'{sls.pending}/test/slow', os.F_OK)
+    entry = sls.ledger.get('test', 'slow')
+    assert entry
+    assert entry['timeouts'] == 1
+    assert not sls.ledger.eligible('test', 'slow')
+
+
+@pytest.mark.asyncio
+async def test_log_timeout_bandwidth_limit(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': 'x' * 10})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'bandwidth-limit', '100')
+    mock_config.set('sls', 'concurrency', '2')
+    mock_config.set('sls', 'timeout', '0.05')
+
+    async def fake_submit(fname):
+        await asyncio.sleep(0.1)
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert submitted == {'test/log': helpers.HelperResult.OK}
+
+
+@pytest.mark.asyncio
+async def test_log_timeout_global(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/slow': ''})
+    mock_config.add_section('sls')
+    mock_config.set('sls', 'timeout', '0.05')
+
+    async def fake_submit(fname):
+        await asyncio.sleep(1)
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert submitted == {'test/slow': helpers.HelperResult.TRANSIENT_ERROR}
+
+
+@pytest.mark.asyncio
+async def test_log_timeout_invalid(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test'])
+    setup_logs(helper_directory, {'test/log': ''})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'timeout', 'forever')
+
+    async def fake_submit(fname):
+        await asyncio.sleep(0.01)
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert submitted == {'test/log': helpers.HelperResult.OK}
+
+
+@pytest.mark.asyncio
+async def test_category_timeout(helper_directory, online, mock_config, patch_module):
+    setup_categories(['test', 'test2'])
+    setup_logs(helper_directory, {'test/a': '', 'test/b': 'x', 'test/c': 'xx', 'test2/d': ''})
+    mock_config.add_section('helpers.test')
+    mock_config.set('helpers.test', 'category-timeout', '0.1')
+
+    async def fake_submit(fname):
+        await asyncio.sleep(0.06)
+        return helpers.HelperResult.OK
+
+    patch_module.submit = fake_submit
+    submitted = await submit()
+
+    assert submitted['test/a'] == helpers.HelperResult.OK
+    assert submitted['test/b'] == helpers.HelperResult.TRANSIENT_ERROR
+    assert 'test/c' not in submitted
+    assert submitted['test2/d'] == helpers.HelperResult.OK
+    assert sls.ledger.eligible('test', 'c')